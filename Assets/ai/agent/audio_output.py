@@ -0,0 +1,180 @@
+# audio_output.py
+"""
+Gapless audio output for NPC speech.
+
+One sounddevice.OutputStream stays open for the whole session. Producers (the TTS worker)
+append float32 frames to a single-producer/single-consumer ring buffer and the stream's
+callback drains it, so consecutive chunks play back to back with no gaps, no overlap, and
+without the conversation thread sleeping for the length of each chunk.
+
+The ring buffer needs no lock between its two sides: the producer only ever advances the write
+counter and the audio callback only ever advances the read counter. A flush (player interrupted
+the NPC) is requested by the producer and carried out by the callback on its next pass.
+
+That only holds for one producer. The NPC server runs several speakers at once (one per
+session), so producers take turns through `producer_lock`: write() holds it for each call and
+a SentenceSpeaker holds it for a whole reply, so replies play one after another rather than
+interleaved chunk by chunk.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+SAMPLE_RATE = 24000
+
+
+class RingBuffer:
+    """Fixed-size float32 ring buffer for one producer thread and one consumer thread."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._frames = np.zeros(capacity, dtype=np.float32)
+        # Monotonic frame counters; their difference is the queue depth.
+        self._written = 0
+        self._read = 0
+
+    def depth(self):
+        return self._written - self._read
+
+    def space(self):
+        return self.capacity - self.depth()
+
+    def write(self, frames):
+        """Copy as many frames as fit and return how many were written (producer side)."""
+        count = min(len(frames), self.space())
+        if count <= 0:
+            return 0
+        start = self._written % self.capacity
+        first = min(count, self.capacity - start)
+        self._frames[start:start + first] = frames[:first]
+        self._frames[:count - first] = frames[first:count]
+        # Publish the frames only after they have been copied in.
+        self._written += count
+        return count
+
+    def read_into(self, out):
+        """Fill `out` with queued frames and return how many were read (consumer side)."""
+        count = min(len(out), self.depth())
+        if count <= 0:
+            return 0
+        start = self._read % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self._frames[start:start + first]
+        out[first:count] = self._frames[:count - first]
+        self._read += count
+        return count
+
+    def discard(self):
+        """Drop everything queued (consumer side)."""
+        self._read = self._written
+
+
+class AudioOutputQueue:
+    """A persistent output stream fed from a ring buffer, with queue-depth and underrun counters."""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, samplerate=SAMPLE_RATE, buffer_seconds=60, blocksize=1024):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.buffer = RingBuffer(int(samplerate * buffer_seconds))
+        self.underruns = 0
+        self.frames_played = 0
+        self._flush_requested = False
+        # True while a producer is mid-utterance; running dry then is an underrun, not silence.
+        self._producing = False
+        self._stream = None
+        # Serializes producers so the ring buffer only ever has one writer (reentrant, so a
+        # speaker holding it for a whole reply can still call write()).
+        self.producer_lock = threading.RLock()
+
+    @classmethod
+    def shared(cls):
+        """The process-wide output queue, with its stream started on first use."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    def start(self):
+        import sounddevice as sd
+
+        self._stream = sd.OutputStream(
+            samplerate=self.samplerate,
+            channels=1,
+            dtype='float32',
+            blocksize=self.blocksize,
+            callback=self._callback,
+        )
+        self._stream.start()
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.underruns += 1
+        if self._flush_requested:
+            self.buffer.discard()
+            self._flush_requested = False
+
+        out = outdata[:, 0]
+        count = self.buffer.read_into(out)
+        if count < frames:
+            out[count:] = 0.0
+            if self._producing:
+                self.underruns += 1
+        self.frames_played += count
+
+    # --- Producer side ---
+    def write(self, audio, timeout=None):
+        """Queue audio frames, waiting for room in the buffer if it is full."""
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        with self.producer_lock:
+            self._producing = True
+            deadline = None if timeout is None else time.monotonic() + timeout
+            offset = 0
+            while offset < len(audio):
+                offset += self.buffer.write(audio[offset:])
+                if offset < len(audio):
+                    if deadline is not None and time.monotonic() > deadline:
+                        return offset
+                    time.sleep(0.01)
+            return offset
+
+    def end_utterance(self):
+        """Mark that no more audio is coming for now, so running dry is not counted as an underrun."""
+        self._producing = False
+
+    def flush(self):
+        """Stop playback immediately and drop everything queued (e.g. the player interrupted)."""
+        self._producing = False
+        self._flush_requested = True
+
+    def wait_until_drained(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.buffer.depth() > 0:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    # --- Monitoring ---
+    def queue_depth(self):
+        return self.buffer.depth()
+
+    def stats(self):
+        depth = self.buffer.depth()
+        return {
+            "queue_depth_frames": depth,
+            "queue_depth_seconds": depth / self.samplerate,
+            "underruns": self.underruns,
+            "frames_played": self.frames_played,
+        }
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,367 @@
+# bench_npc.py
+"""
+Deterministic replay benchmark for NPC conversations.
+
+Scripted player transcripts are fed through NPC.process_player_input and
+handle_streaming_response exactly as run_npc_conversation does. Each transcript starts from a
+fresh copy of the memory file in a temporary directory, and the LLM is the local stand-in from
+fake_llm_server.py (canned replies, fixed latency), so two runs differ only by the code under
+test. TTS and the message bus are off.
+
+Per turn the report records:
+
+    - latency: player input to the last spoken token, and to the first spoken token
+    - LLM calls made for the turn, by call type (background summary/trust calls included)
+    - memory-file I/O: bytes read and written to the memory JSON, its journal or database
+
+Reports are JSON and carry the git commit, so they can be kept per commit and compared:
+
+    python bench_npc.py --output bench_before.json
+    python bench_npc.py --output bench_after.json --compare bench_before.json
+    python bench_npc.py --transcripts my_transcripts.json --ttft-ms 600 --token-ms 30
+
+A transcripts file is a list of {"name": "...", "turns": ["", "My name is Ahmed", ...]}; an empty
+turn is the NPC's opening greeting.
+"""
+
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import builtins
+import tempfile
+import platform
+import threading
+import contextlib
+import subprocess
+from datetime import datetime
+
+from fake_llm_server import FakeLLMServer, load_rules
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MEMORY = os.path.join(AGENT_DIR, "Neferkare_memory.json")
+
+DEFAULT_TRANSCRIPTS = [
+    {
+        "name": "full_conversation",
+        "turns": [
+            "",
+            "My name is Ahmed",
+            "I am a merchant from Thebes, I was crossing the desert with my camel",
+            "I found you lying in the sand and gave you water",
+            "Do you have family waiting for you?",
+            "I respect Ma'at and the gods, I would never leave a man to die",
+            "Where were you travelling when you were hurt?",
+            "You can rest here until your leg is better",
+            "I only want to help you get home safely",
+            "Will you tell me what troubles you?",
+        ],
+    },
+    {
+        "name": "evasive_stranger",
+        "turns": [
+            "",
+            "Why do you need my name?",
+            "What are you carrying in your robes?",
+            "Pamiu sent me to find a trader lost in the desert",
+        ],
+    },
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=AGENT_DIR, capture_output=True, text=True,
+                                  timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "HEAD") or None,
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+class MemoryIO:
+    """Counts bytes read and written through open() for the memory files inside one directory."""
+
+    def __init__(self, directory, prefixes):
+        self.directory = os.path.abspath(directory)
+        self.prefixes = tuple(prefixes)
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self._lock = threading.Lock()
+        self._open = None
+
+    def _count(self, attribute, amount):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + amount)
+
+    def counts(self, path):
+        path = os.path.abspath(os.fsdecode(path))
+        return os.path.dirname(path) == self.directory and os.path.basename(path).startswith(self.prefixes)
+
+    def install(self):
+        self._open = builtins.open
+        counter = self
+
+        def counting_open(file, mode='r', *args, **kwargs):
+            handle = counter._open(file, mode, *args, **kwargs)
+            if isinstance(file, (str, bytes, os.PathLike)) and counter.counts(file):
+                return _CountingFile(handle, counter)
+            return handle
+
+        builtins.open = counting_open
+
+    def uninstall(self):
+        if self._open is not None:
+            builtins.open = self._open
+            self._open = None
+
+    def database_bytes(self):
+        """Size of SQLite files in the directory; their I/O happens outside open()."""
+        return sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in os.listdir(self.directory) if ".db" in name and name.startswith(self.prefixes))
+
+    def totals(self):
+        with self._lock:
+            return self.read_bytes, self.write_bytes
+
+
+class _CountingFile:
+    def __init__(self, handle, counter):
+        self._handle = handle
+        self._counter = counter
+
+    def _size(self, data):
+        return len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+
+    def read(self, *args):
+        data = self._handle.read(*args)
+        self._counter._count("read_bytes", self._size(data))
+        return data
+
+    def readline(self, *args):
+        line = self._handle.readline(*args)
+        self._counter._count("read_bytes", self._size(line))
+        return line
+
+    def __iter__(self):
+        for line in self._handle:
+            self._counter._count("read_bytes", self._size(line))
+            yield line
+
+    def write(self, data):
+        self._counter._count("write_bytes", self._size(data))
+        return self._handle.write(data)
+
+    def __enter__(self):
+        self._handle.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._handle.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+
+def wait_for_background(npc, timeout=30):
+    """Let the turn's background LLM work (trust update, summary) finish before measuring it."""
+    npc.trust.wait_idle(timeout=timeout)
+    for thread in threading.enumerate():
+        if thread.name == "npc-summary":
+            thread.join(timeout)
+
+
+def run_transcript(npc4, transcript, memory_path, workdir, verbose=False):
+    telemetry = npc4.get_telemetry()
+    memory_copy = os.path.join(workdir, os.path.basename(memory_path))
+    shutil.copy(memory_path, memory_copy)
+
+    # The memory JSON, its journal and the SQLite database (npc_memory.db unless NPC_MEMORY_DB is set).
+    memory_io = MemoryIO(workdir, [os.path.splitext(os.path.basename(memory_path))[0], "npc_memory"])
+    memory_io.install()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    turns = []
+    cwd = os.getcwd()
+    # npc_output.txt is written relative to the working directory; keep it out of the real one.
+    os.chdir(workdir)
+    try:
+        with output:
+            start = time.perf_counter()
+            npc = npc4.NPC(name="Neferkare", path_json=memory_copy)
+            load_ms = (time.perf_counter() - start) * 1000
+            load_read_bytes = memory_io.totals()[0]
+
+            for index, player_input in enumerate(transcript["turns"]):
+                calls_before = dict(telemetry.calls)
+                io_before = memory_io.totals()
+                db_before = memory_io.database_bytes()
+                first_token = []
+
+                start = time.perf_counter()
+                npc_output, response_stream = npc.process_player_input(player_input)
+                if response_stream:
+                    def timed(stream):
+                        for piece in stream:
+                            if not first_token and npc4._chunk_text(piece):
+                                first_token.append(time.perf_counter())
+                            yield piece
+                    npc4.handle_streaming_response(npc, player_input, npc_output, timed(response_stream),
+                                                   speak_response=False)
+                latency = time.perf_counter() - start
+
+                wait_for_background(npc)
+                calls = {call_type: count - calls_before.get(call_type, 0)
+                         for call_type, count in telemetry.calls.items()
+                         if count - calls_before.get(call_type, 0)}
+                io_after = memory_io.totals()
+                turns.append({
+                    "turn": index,
+                    "player": player_input,
+                    "latency_ms": round(latency * 1000, 2),
+                    "first_token_ms": round((first_token[0] - start) * 1000, 2) if first_token else None,
+                    "llm_calls": sum(calls.values()),
+                    "llm_calls_by_type": calls,
+                    "memory_read_bytes": io_after[0] - io_before[0],
+                    "memory_write_bytes": io_after[1] - io_before[1],
+                    "database_growth_bytes": memory_io.database_bytes() - db_before,
+                })
+                if npc.data.get("conversation_completed", False):
+                    break
+
+            npc.trust.wait_idle(timeout=10)
+            npc.memory.close()
+    finally:
+        os.chdir(cwd)
+        memory_io.uninstall()
+
+    return {"name": transcript["name"], "load_ms": round(load_ms, 2), "load_read_bytes": load_read_bytes,
+            "turns": turns}
+
+
+def summarize(transcripts):
+    turns = [turn for transcript in transcripts for turn in transcript["turns"]]
+    latencies = [turn["latency_ms"] for turn in turns]
+    first_tokens = [turn["first_token_ms"] for turn in turns if turn["first_token_ms"] is not None]
+    count = len(turns) or 1
+    return {
+        "turns": len(turns),
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "max": max(latencies, default=0.0)},
+        "first_token_ms": {"p50": percentile(first_tokens, 50), "p95": percentile(first_tokens, 95)},
+        "llm_calls_per_turn": round(sum(turn["llm_calls"] for turn in turns) / count, 2),
+        "memory_read_bytes_per_turn": round(sum(turn["memory_read_bytes"] for turn in turns) / count, 1),
+        "memory_write_bytes_per_turn": round(sum(turn["memory_write_bytes"] for turn in turns) / count, 1),
+        "database_growth_bytes_per_turn": round(sum(turn["database_growth_bytes"] for turn in turns) / count, 1),
+    }
+
+
+def compare(base, report):
+    """Print the summary of `report` next to `base` with relative changes."""
+    print(f"\nCompared with {base['git']['commit'] or 'unknown commit'} ({base['created']}):")
+    rows = [
+        ("latency p50 (ms)", ("latency_ms", "p50")),
+        ("latency p95 (ms)", ("latency_ms", "p95")),
+        ("first token p50 (ms)", ("first_token_ms", "p50")),
+        ("LLM calls / turn", ("llm_calls_per_turn",)),
+        ("memory read B / turn", ("memory_read_bytes_per_turn",)),
+        ("memory write B / turn", ("memory_write_bytes_per_turn",)),
+        ("database growth B / turn", ("database_growth_bytes_per_turn",)),
+    ]
+    for label, path in rows:
+        before, after = base["summary"], report["summary"]
+        for key in path:
+            before, after = before[key], after[key]
+        change = f"{(after - before) / before:+.1%}" if before else "n/a"
+        print(f"  {label:<24} {before:>10.2f} -> {after:>10.2f}   {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay scripted conversations against a local LLM stand-in.")
+    parser.add_argument("--transcripts", help="JSON file of transcripts (default: built-in set)")
+    parser.add_argument("--memory", default=DEFAULT_MEMORY, help="memory file each transcript starts from")
+    parser.add_argument("--runs", type=int, default=1, help="repeat every transcript this many times")
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rules", help="reply rules for the stand-in (see fake_llm_server.py)")
+    parser.add_argument("--base-url", help="use an already running stand-in instead of starting one")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the NPC's own output")
+    args = parser.parse_args()
+
+    transcripts = DEFAULT_TRANSCRIPTS
+    if args.transcripts:
+        with open(args.transcripts, 'r', encoding='utf-8') as file:
+            transcripts = json.load(file)
+
+    server = None
+    if not args.base_url:
+        server = FakeLLMServer(port=0, rules=load_rules(args.rules) if args.rules else None,
+                               ttft_ms=args.ttft_ms, token_ms=args.token_ms, jitter=args.jitter,
+                               seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="bench_npc_")
+
+    # Everything the NPC reads from the environment has to be set before npc4 is imported.
+    os.environ["OPENAI_BASE_URL"] = args.base_url or server.base_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["MESSAGE_BUS_DISABLED"] = "1"
+    os.environ["NPC_TELEMETRY_FILE"] = os.path.join(workdir, "npc_telemetry.jsonl")
+    import npc4
+
+    results = []
+    try:
+        for run in range(args.runs):
+            for transcript in transcripts:
+                run_dir = tempfile.mkdtemp(prefix=f"{transcript['name']}_", dir=workdir)
+                result = run_transcript(npc4, transcript, args.memory, run_dir, verbose=args.verbose)
+                result["run"] = run
+                results.append(result)
+                print(f"{transcript['name']} (run {run + 1}): {len(result['turns'])} turns, "
+                      f"p50 {percentile([turn['latency_ms'] for turn in result['turns']], 50):.0f} ms")
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git": git_info(),
+        "python": platform.python_version(),
+        "config": {
+            "memory": os.path.basename(args.memory), "runs": args.runs, "ttft_ms": args.ttft_ms,
+            "token_ms": args.token_ms, "jitter": args.jitter, "seed": args.seed, "rules": args.rules,
+            "base_url": args.base_url, "turn_mode": os.environ.get("NPC_TURN_MODE", "combined"),
+            "memory_backend": os.environ.get("NPC_MEMORY_BACKEND", "journal"),
+        },
+        "summary": summarize(results),
+        "transcripts": results,
+    }
+
+    summary = report["summary"]
+    print(f"\n{summary['turns']} turns: latency p50 {summary['latency_ms']['p50']:.0f} ms, "
+          f"p95 {summary['latency_ms']['p95']:.0f} ms, first token p50 {summary['first_token_ms']['p50']:.0f} ms, "
+          f"{summary['llm_calls_per_turn']} LLM calls/turn, "
+          f"{summary['memory_write_bytes_per_turn']:.0f} B written/turn")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# eval_fast_screen.py
+"""
+Evaluate the fast name tagger and suspicion screen against the LLM on logged conversations.
+
+Player messages are collected from NPC memory files (Conversation_History, inner_thoughts and
+suspicious entries) and/or plain text files with one message per line. Each message is run
+through fast_screen. The LLM's answer (the same prompts the NPC uses) is fetched as the
+reference, and the report shows:
+
+    - escalation rate: share of messages the fast path hands to the LLM
+    - agreement with the LLM on the messages it settles itself
+    - misses: messages cleared locally that the LLM flagged as suspicious
+    - known suspicious messages (MUST_NOT_CLEAR, always evaluated) that the screen cleared
+    - local latency (p50 / p99)
+
+LLM answers are cached in a JSONL file, so re-running after tuning the lexicons costs nothing.
+A failed LLM call is neither cached nor compared; the message is counted as unlabeled.
+
+    python eval_fast_screen.py --memory Neferkare_memory.json --messages extra_messages.txt
+    python eval_fast_screen.py --no-llm      # escalation rate and latency only
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import time
+
+from fast_screen import tag_name, screen_message
+
+DEFAULT_MEMORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Neferkare_memory.json")
+DEFAULT_LABELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fast_screen_labels.jsonl")
+# Returned by LLMLabels.get when the reference answer could not be fetched
+UNLABELED = object()
+# Suspicious messages outside the lexicons; the screen must escalate or flag them, never clear them.
+MUST_NOT_CLEAR = [
+    "I came from the future on a spaceship",
+    "I want to take what you hold, old man",
+]
+
+
+def collect_messages(memory_paths, message_paths):
+    messages = []
+    for path in memory_paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        for key, field in (("Conversation_History", "player_message"), ("inner_thoughts", "player_message"),
+                           ("suspicious", "suspicious_message")):
+            for entry in data.get(key, []):
+                if isinstance(entry, dict) and entry.get(field):
+                    messages.append(entry[field])
+    for path in message_paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            messages.extend(line.strip() for line in file if line.strip())
+    # Keep the first occurrence of each message, in order.
+    return list(dict.fromkeys(messages))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class LLMLabels:
+    """LLM reference answers, cached on disk by (task, message)."""
+
+    def __init__(self, cache_path, memory_path):
+        self.cache_path = cache_path
+        self.memory_path = memory_path
+        self.labels = {}
+        self._npc = None
+        self._workdir = None
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    record = json.loads(line)
+                    self.labels[(record["task"], record["message"])] = record["label"]
+
+    def _get_npc(self):
+        if self._npc is None:
+            # Work on a copy so the evaluation never writes to the real memory file.
+            from npc4 import NPC
+            self._workdir = tempfile.mkdtemp(prefix="eval_fast_screen_")
+            path = os.path.join(self._workdir, os.path.basename(self.memory_path))
+            shutil.copy(self.memory_path, path)
+            self._npc = NPC(name="Neferkare", path_json=path)
+        return self._npc
+
+    def get(self, task, message):
+        key = (task, message)
+        if key not in self.labels:
+            npc = self._get_npc()
+            try:
+                if task == "name":
+                    label = npc.llm_extract_name(message, raise_errors=True)
+                else:
+                    verdict = npc.llm_check_suspicious(message, raise_errors=True)
+                    label = "clear" if "not suspicious" in verdict.lower() else "suspicious"
+            except Exception as e:
+                # Not cached, so the next run asks again.
+                print(f"LLM reference unavailable for {message!r}: {e}")
+                return UNLABELED
+            self.labels[key] = label
+            with open(self.cache_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps({"task": task, "message": message, "label": label}, ensure_ascii=False) + "\n")
+        return self.labels[key]
+
+    def close(self):
+        """Release the NPC's copy of the memory file and delete its temporary directory."""
+        if self._npc is not None:
+            memory = getattr(self._npc, "memory", None)
+            if hasattr(memory, "close"):
+                memory.close()
+            self._npc = None
+        if self._workdir is not None:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+            self._workdir = None
+
+
+def evaluate(messages, labels=None):
+    report = {"messages": len(messages)}
+    for task in ("name", "suspicion"):
+        latencies = []
+        escalated = settled = compared = agreed = misses = 0
+        disagreements = []
+        for message in messages:
+            start = time.perf_counter()
+            if task == "name":
+                decision, value = tag_name(message)
+                local = value if decision == "name" else None
+            else:
+                result = screen_message(message)
+                decision, local = result.decision, result.decision
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            if decision == "escalate":
+                escalated += 1
+                continue
+            settled += 1
+            if labels is None:
+                continue
+
+            reference = labels.get(task, message)
+            if reference is UNLABELED:
+                continue
+            compared += 1
+            if task == "name":
+                match = (local or "").lower() == (reference or "").lower()
+            else:
+                match = local == reference
+                if local == "clear" and reference == "suspicious":
+                    misses += 1
+            if match:
+                agreed += 1
+            else:
+                disagreements.append({"message": message, "local": local, "llm": reference})
+
+        task_report = {
+            "escalation_rate": escalated / len(messages) if messages else 0.0,
+            "settled_locally": settled,
+            "latency_ms_p50": percentile(latencies, 50),
+            "latency_ms_p99": percentile(latencies, 99),
+        }
+        if labels is not None:
+            task_report["agreement_with_llm"] = agreed / compared if compared else 1.0
+            task_report["unlabeled"] = settled - compared
+            task_report["disagreements"] = disagreements
+            if task == "suspicion":
+                task_report["missed_suspicious"] = misses
+        report[task] = task_report
+    report["suspicion"]["known_suspicious_cleared"] = [
+        message for message in MUST_NOT_CLEAR if screen_message(message).decision == "clear"
+    ]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fast name/suspicion screen with the LLM.")
+    parser.add_argument("--memory", nargs="*", default=[DEFAULT_MEMORY], help="NPC memory JSON files to read messages from")
+    parser.add_argument("--messages", nargs="*", default=[], help="text files with one player message per line")
+    parser.add_argument("--labels", default=DEFAULT_LABELS, help="JSONL cache of LLM reference answers")
+    parser.add_argument("--no-llm", action="store_true", help="skip the LLM comparison")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    messages = list(dict.fromkeys(collect_messages(args.memory, args.messages) + MUST_NOT_CLEAR))
+    if not messages:
+        print("No player messages found.")
+        sys.exit(1)
+
+    labels = None if args.no_llm else LLMLabels(args.labels, (args.memory or [DEFAULT_MEMORY])[0])
+    try:
+        report = evaluate(messages, labels)
+    finally:
+        if labels is not None:
+            labels.close()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"Messages evaluated: {report['messages']}")
+    for task in ("name", "suspicion"):
+        task_report = report[task]
+        print(f"\n[{task}]")
+        print(f"  escalated to LLM:   {task_report['escalation_rate']:.1%}")
+        print(f"  settled locally:    {task_report['settled_locally']}")
+        print(f"  local latency:      p50 {task_report['latency_ms_p50']:.3f} ms, p99 {task_report['latency_ms_p99']:.3f} ms")
+        if "agreement_with_llm" in task_report:
+            print(f"  agreement with LLM: {task_report['agreement_with_llm']:.1%}")
+            if task_report["unlabeled"]:
+                print(f"  no LLM reference:   {task_report['unlabeled']} (API errors, not cached)")
+            if task == "suspicion":
+                print(f"  missed suspicious:  {task_report['missed_suspicious']}")
+            for item in task_report["disagreements"][:10]:
+                print(f"    - {item['message']!r}: local={item['local']!r} llm={item['llm']!r}")
+    cleared = report["suspicion"]["known_suspicious_cleared"]
+    print(f"\nKnown suspicious messages cleared locally: {len(cleared)}/{len(MUST_NOT_CLEAR)}")
+    for message in cleared:
+        print(f"    - {message!r}")
+    if cleared:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
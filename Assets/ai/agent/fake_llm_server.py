@@ -0,0 +1,242 @@
+# fake_llm_server.py
+"""
+Local OpenAI-compatible stand-in for benchmarking the NPC without the live API.
+
+Serves POST /v1/chat/completions, streamed (server-sent events, with a final usage chunk when
+stream_options.include_usage is set) and non-streamed. Replies are canned per call type: each rule
+is a regex matched against the prompt and a list of replies used in turn, so a run is fully
+repeatable. The built-in rules recognize every prompt npc4 sends and answer in the format it
+expects. Latency is simulated as a time to first token plus a fixed gap per streamed token, with
+optional seeded jitter.
+
+    python fake_llm_server.py --port 8799 --ttft-ms 400 --token-ms 25
+    set OPENAI_BASE_URL=http://127.0.0.1:8799/v1        (then run npc4.py as usual)
+
+GET /stats returns the number of requests served per call type. bench_npc.py starts one of these
+in-process unless it is given --base-url.
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8799
+
+# (call type, prompt regex, replies). The first matching rule wins, the last one is the fallback.
+DEFAULT_RULES = [
+    ("combined", r"\[INNER THOUGHTS: \.\.\.\]", [
+        "[INNER THOUGHTS: They seem kind, but anyone can play at kindness in the desert. I will ask "
+        "where they come from and watch how they answer.]\n[SPOKEN: You have a generous heart, friend. "
+        "Tell me, which city do you call home?]",
+        "[INNER THOUGHTS: Nothing in that answer speaks of Pamiu, yet I must be careful. A question "
+        "about Ma'at will show me their character.]\n[SPOKEN: Few travelers would stop for a stranger "
+        "in the sand. What makes you walk the path of Ma'at?]",
+    ]),
+    ("inner_thoughts", r"What are my honest inner thoughts", [
+        "They seem kind, but anyone can play at kindness in the desert. I will ask where they come "
+        "from and watch how they answer.",
+    ]),
+    ("extract_name", r"Extract the name from this message", ["NO_NAME"]),
+    ("suspicious", r"Is there anything suspicious about this message", ["Not suspicious."]),
+    ("trust", r"Reply with JSON only: \{\"score\"", [
+        '{"score": 58, "rationale": "They saved my life and speak plainly, though I still know little of them."}',
+        '{"score": 64, "rationale": "They saved my life, answer openly and show respect for Ma\'at."}',
+    ]),
+    ("reflection", r"\[DECISION: Ally\] or \[DECISION: Enemy\]", [
+        "They saved me, healed me and never pried into my mission. I believe their heart is true.\n"
+        "[DECISION: Ally]",
+    ]),
+    ("summary", r"Rewrite the summary", [
+        "The stranger rescued Neferkare in the desert and healed his leg. They have answered his "
+        "questions openly and shown no sign of serving Pamiu. Neferkare has not revealed his mission.",
+    ]),
+    ("question", r"Return only the question", ["Where did you learn the ways of healing?"]),
+    ("greeting", r"Thank the stranger sincerely|Acknowledge their return", [
+        "By the gods, you pulled me from the sand and mended my leg. I owe you my life, stranger. "
+        "What name shall I thank in my prayers?",
+    ]),
+    ("final", r"\*\*Task:\*\*", [
+        "You have proven yourself, friend. Take this scroll to the vizier in Memphis, and trust no "
+        "priest of Karnak on the way.",
+    ]),
+    ("response", r"", [
+        "Fair words, friend. The desert teaches caution, so forgive my questions. Where are you headed?",
+    ]),
+]
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def split_tokens(text):
+    """Split a reply into word-sized stream deltas that join back to the exact text."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class FakeLLM:
+    """Canned replies and simulated latency; shared by all request handler threads."""
+
+    def __init__(self, rules=None, ttft_ms=300.0, token_ms=20.0, jitter=0.0, seed=0):
+        self.rules = [(call_type, re.compile(pattern), list(replies))
+                      for call_type, pattern, replies in (rules or DEFAULT_RULES)]
+        self.ttft_ms = ttft_ms
+        self.token_ms = token_ms
+        self.jitter = jitter
+        self.requests = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def reply(self, prompt):
+        """(call type, reply text) for a prompt; replies of a rule are used in rotation."""
+        for call_type, pattern, replies in self.rules:
+            if pattern.search(prompt):
+                with self._lock:
+                    count = self.requests.get(call_type, 0)
+                    self.requests[call_type] = count + 1
+                return call_type, replies[count % len(replies)]
+        return "unmatched", ""
+
+    def delay(self, ms):
+        if ms <= 0:
+            return
+        with self._lock:
+            factor = 1.0 + self._random.uniform(-self.jitter, self.jitter) if self.jitter else 1.0
+        time.sleep(ms * factor / 1000)
+
+
+def load_rules(path):
+    """Rules from a JSON file: [{"call_type": "...", "match": "<regex>", "replies": ["..."]}, ...]."""
+    with open(path, 'r', encoding='utf-8') as file:
+        return [(rule["call_type"], rule["match"], rule["replies"]) for rule in json.load(file)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    llm = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, {"requests": dict(self.llm.requests)})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        call_type, text = self.llm.reply(prompt)
+        model = request.get("model", "gpt-4o-mini")
+        usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(text)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-fake-{call_type}"
+
+        if not request.get("stream"):
+            tokens = split_tokens(text)
+            self.llm.delay(self.llm.ttft_ms + self.llm.token_ms * max(0, len(tokens) - 1))
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(body):
+            data = f"data: {body}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            body = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if chunk_usage is not None:
+                body["choices"] = []
+                body["usage"] = chunk_usage
+            event(json.dumps(body))
+
+        self.llm.delay(self.llm.ttft_ms)
+        chunk({"role": "assistant", "content": ""})
+        for index, token in enumerate(split_tokens(text)):
+            if index:
+                self.llm.delay(self.llm.token_ms)
+            chunk({"content": token})
+        chunk({}, finish_reason="stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk(None, chunk_usage=usage)
+        event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeLLMServer:
+    """Runs the stand-in on a background thread (port 0 picks a free port)."""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, **llm_options):
+        self.llm = FakeLLM(**llm_options)
+        handler = type("Handler", (_Handler,), {"llm": self.llm})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve canned OpenAI-compatible chat completions.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="delay between streamed tokens")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- fraction applied to every delay")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rules", help="JSON file of reply rules replacing the built-in ones")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.host, args.port, rules=load_rules(args.rules) if args.rules else None,
+                           ttft_ms=args.ttft_ms, token_ms=args.token_ms, jitter=args.jitter, seed=args.seed)
+    print(f"Fake LLM listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("Fake LLM stopped")
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
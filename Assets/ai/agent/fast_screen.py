@@ -0,0 +1,236 @@
+# fast_screen.py
+"""
+In-process fast path for name extraction and suspicion screening.
+
+Both used to cost a full LLM round-trip: extract_name whenever its three regexes missed, and
+check_for_suspicious on every message, usually just to hear "Not suspicious.". The functions here
+run on the CPU in well under a millisecond and return one of three decisions:
+
+    tag_name(message)        -> "name" (with the name), "no_name", or "escalate"
+    screen_message(message)  -> "clear", "suspicious" (with a reason), or "escalate"
+
+Only "escalate" goes to the LLM. The name tagger settles a name only after an explicit cue
+("my name is", "call me", ...); weaker evidence such as "I'm X", a one-word answer or a
+capitalized word is escalated, because a wrong name permanently renames the player. A
+stop-word list settles phrases like "I am tired" as no name. The suspicion screen scores the
+message against weighted lexicons. The lexicons cover:
+
+    - anachronisms
+    - interest in Neferkare's mission
+    - ties to his enemies
+    - reassuring, everyday talk, which lowers the score
+
+A message is cleared locally only when nothing is flagged and there is everyday evidence (an
+everyday lexicon term, or a short reply made only of everyday words). A message matching no
+lexicon at all is escalated, since most suspicious talk is not in the lexicons.
+
+eval_fast_screen.py measures escalation rate and agreement with the LLM on logged conversations.
+"""
+
+import re
+import math
+
+# --- Name tagging ---
+NAME_CUES = [
+    r"\bmy name is\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+    r"\bmy name's\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+    r"\bname(?: is|'s)\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+    r"\b(?:you can |you may |people |they )?call me\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+    r"\bI am called\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+    r"\bI'?m called\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+    r"\bknown as\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+    r"\b(?P<name>[A-Z][a-z]+) is my name\b",
+    r"\b(?:I am|I'm|Im|It's)\s+(?P<name>[A-Za-z][A-Za-z'\-]+)",
+]
+NAME_CUE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in NAME_CUES]
+# "I am X" / "I'm X" are weaker cues than "my name is X": they are never settled locally.
+WEAK_CUE_INDEX = len(NAME_CUES) - 1
+
+# Words that follow "I am" / "call me" without being a name.
+NOT_NAMES = {
+    "a", "an", "the", "not", "no", "so", "very", "just", "only", "also", "still", "here", "there",
+    "fine", "good", "well", "ok", "okay", "sorry", "glad", "happy", "tired", "hungry", "thirsty",
+    "lost", "sure", "afraid", "scared", "worried", "ready", "alone", "nobody", "someone", "anyone",
+    "nothing", "your", "you", "friend", "traveler", "traveller", "stranger", "merchant", "trader",
+    "going", "looking", "trying", "coming", "leaving", "from", "of", "in", "on", "at", "to", "with",
+    "what", "who", "why", "how", "when", "where", "that", "this", "it", "a", "as", "like", "whatever",
+    "nameless", "none", "healer", "soldier", "farmer", "hunter", "guard", "servant", "priest",
+    "sent", "here", "called", "known", "named", "telling", "asking", "saying", "ahead", "back",
+    "thinking", "honest", "curious", "safe", "hurt", "wounded", "never", "always", "too",
+    "egyptian", "nubian", "libyan", "hittite", "foreign", "foreigner", "new", "old", "young",
+    "nice", "pleased", "honored", "honoured", "later", "if", "crazy", "anything", "anytime",
+    "nope", "yeah", "yep", "nah", "hmm", "hm", "uh", "um", "ah", "oh", "secret", "mine",
+}
+# Proper nouns from Neferkare's world that are not the player's name.
+KNOWN_NAMES = {
+    "Neferkare", "Pamiu", "Kemet", "Nafret", "Hotepre", "Egypt", "Thebes", "Memphis", "Karnak",
+    "Nile", "Amun", "Ra", "Osiris", "Isis", "Horus", "Anubis", "Pharaoh", "Maat", "Kemet",
+}
+NAME_REFUSALS = re.compile(
+    r"\b(?:won'?t|will not|can'?t|cannot|don'?t want to|rather not|not going to)\s+(?:tell|say|give|share)\b"
+    r"|\bno name\b|\bnone of your\b|\bdoesn'?t matter\b|\bnameless\b",
+    re.IGNORECASE,
+)
+SINGLE_WORD = re.compile(r"^\s*([A-Za-z][A-Za-z'\-]{1,20})\s*[.!]?\s*$")
+CAPITALIZED = re.compile(r"(?<![.!?]\s)(?<!^)\b([A-Z][a-z]{2,})\b")
+# "Ahmed, from Thebes": a leading word set off by a comma.
+LEADING_WORD = re.compile(r"^\s*([A-Z][a-z]{2,})\s*,")
+
+
+def _clean_name(candidate):
+    return candidate.strip("'-").capitalize()
+
+
+def tag_name(message):
+    """
+    Find the player's name in `message`.
+
+    Returns (decision, name): ("name", "Ahmed"), ("no_name", None) or ("escalate", None).
+    """
+    text = message.strip()
+    if not text:
+        return "no_name", None
+
+    if NAME_REFUSALS.search(text):
+        return "no_name", None
+
+    for index, pattern in enumerate(NAME_CUE_PATTERNS):
+        match = pattern.search(text)
+        if not match:
+            continue
+        candidate = match.group("name")
+        if candidate.lower() in NOT_NAMES or candidate.lower() in EVERYDAY_WORDS:
+            continue
+        if index == WEAK_CUE_INDEX:
+            # "I'm Ahmed" is likely a name, "I'm hurting" is not; "It's Nice..." only looks like one.
+            if candidate.endswith(("ing", "ly")):
+                continue
+            return "escalate", None
+        if _clean_name(candidate) in KNOWN_NAMES:
+            return "escalate", None
+        return "name", _clean_name(candidate)
+
+    # A one-word answer to "what is your name?" may be the name, or "Nope." / "Thebes".
+    single = SINGLE_WORD.match(text)
+    if single:
+        word = single.group(1)
+        if word.lower() in NOT_NAMES or word.lower() in EVERYDAY_WORDS or _clean_name(word) in KNOWN_NAMES:
+            return "no_name", None
+        return "escalate", None
+
+    # Capitalized words might be a name given without a cue ("Ahmed, from Thebes").
+    candidates = CAPITALIZED.findall(text)
+    leading = LEADING_WORD.match(text)
+    if leading and leading.group(1).lower() not in NOT_NAMES | EVERYDAY_WORDS:
+        candidates.append(leading.group(1))
+    if any(word not in KNOWN_NAMES for word in candidates):
+        return "escalate", None
+    return "no_name", None
+
+
+# --- Suspicion screening ---
+# Term -> weight. Multi-word terms are matched as phrases.
+ANACHRONISMS = {
+    "phone": 2.0, "telephone": 2.0, "car": 1.2, "gun": 2.0, "rifle": 2.0, "internet": 2.5,
+    "computer": 2.5, "electricity": 2.0, "airplane": 2.0, "plane": 1.0, "train": 1.0, "dollar": 2.0,
+    "dollars": 2.0, "america": 2.0, "england": 1.5, "europe": 1.5, "jesus": 2.0, "christ": 2.0,
+    "allah": 1.5, "television": 2.5, "tv": 1.5, "robot": 2.5, "video game": 3.0, "npc": 3.0,
+    "player": 1.0, "ai": 1.5, "chatgpt": 3.0, "openai": 3.0, "century": 1.2, "bce": 2.5,
+    "unity": 1.0, "photo": 1.5, "camera": 2.0, "rome": 1.2, "roman": 1.2, "greek": 0.8,
+    "iron sword": 1.0, "pistol": 2.0, "bomb": 2.0, "email": 2.5, "coffee": 1.2,
+}
+MISSION_INTEREST = {
+    "scroll": 1.0, "secret": 0.8, "secrets": 0.8, "mission": 0.9, "message you carry": 1.5,
+    "what are you carrying": 1.5, "what do you carry": 1.5, "conspiracy": 1.2, "plot": 0.9,
+    "evidence": 1.0, "proof": 0.8, "hidden": 0.6, "hiding": 0.6, "deliver": 0.6, "kemet": 1.2,
+    "memphis": 0.6, "who are your allies": 1.5, "your allies": 1.0, "nafret": 1.2,
+    "robes": 0.8, "show me": 0.7, "give me": 0.8, "hand it": 1.0,
+}
+ENEMY_TIES = {
+    "pamiu": 1.2, "high priest": 0.9, "vizier": 0.8, "hotepre": 1.2, "karnak": 0.6,
+    "reward": 0.9, "bounty": 1.5, "traitor": 1.2, "betray": 1.2, "kill": 1.2, "spy": 1.2,
+    "the priests sent": 2.0, "sent me": 1.2, "work for": 0.9, "serve the": 0.6, "orders": 0.8,
+    "turn you in": 2.0, "hunting you": 1.0, "looking for you": 0.9,
+}
+# Everyday, reassuring talk pulls the score down.
+EVERYDAY = {
+    "hello": -0.3, "hi": -0.3, "greetings": -0.3, "thank": -0.3, "thanks": -0.3, "welcome": -0.2,
+    "leg": -0.3, "rest": -0.3, "water": -0.3, "food": -0.3, "eat": -0.2, "drink": -0.2,
+    "heal": -0.3, "healed": -0.3, "help": -0.2, "safe": -0.2, "pain": -0.2, "better": -0.2,
+    "ma'at": -0.4, "maat": -0.4, "gods": -0.1, "nile": -0.1, "trade": -0.2, "goods": -0.2,
+    "camel": -0.2, "desert": -0.1, "sun": -0.1, "family": -0.2, "friend": -0.2, "feel": -0.2,
+}
+EVERYDAY_WORDS = set(EVERYDAY) | {"yes", "no", "maybe", "why", "what", "sure", "okay", "ok", "thanks"}
+
+LEXICONS = {
+    "anachronism": ANACHRONISMS,
+    "mission interest": MISSION_INTEREST,
+    "enemy ties": ENEMY_TIES,
+    "everyday": EVERYDAY,
+}
+_LEXICON_PATTERNS = {
+    category: [(re.compile(r"\b" + re.escape(term) + r"\b", re.IGNORECASE), term, weight)
+               for term, weight in terms.items()]
+    for category, terms in LEXICONS.items()
+}
+
+SUSPICIOUS_ABOVE = 0.85
+
+REASONS = {
+    "anachronism": "mentions things no one in the Two Lands should know of",
+    "mission interest": "shows unusual interest in my mission and what I carry",
+    "enemy ties": "speaks of my enemies in a way that suggests they may serve them",
+}
+
+
+class ScreenResult:
+    """Outcome of the fast suspicion screen."""
+
+    def __init__(self, decision, score, matches, reason=None):
+        self.decision = decision
+        self.score = score
+        self.matches = matches
+        self.reason = reason
+
+    def __repr__(self):
+        return f"ScreenResult({self.decision!r}, score={self.score:.2f}, matches={self.matches})"
+
+
+def suspicion_score(message):
+    """Weighted lexicon score squashed into [0, 1), plus the terms that matched per category."""
+    matches = {}
+    raw = 0.0
+    for category, patterns in _LEXICON_PATTERNS.items():
+        for pattern, term, weight in patterns:
+            if pattern.search(message):
+                matches.setdefault(category, []).append(term)
+                raw += weight
+    score = 1.0 - math.exp(-max(raw, 0.0))
+    return score, matches
+
+
+def is_everyday_reply(message):
+    """A short reply made only of everyday words ("yes", "okay, thanks")."""
+    words = re.findall(r"[a-z']+", message.lower())
+    return 0 < len(words) <= 3 and all(word in EVERYDAY_WORDS for word in words)
+
+
+def screen_message(message):
+    """First-pass suspicion screen: "clear", "suspicious" (with a reason) or "escalate"."""
+    score, matches = suspicion_score(message)
+    flagged = {category: terms for category, terms in matches.items() if category != "everyday"}
+
+    if not flagged:
+        if "everyday" in matches or is_everyday_reply(message):
+            return ScreenResult("clear", score, matches)
+        # No lexicon evidence either way: the LLM decides.
+        return ScreenResult("escalate", score, matches)
+
+    terms_flagged = sum(len(terms) for terms in flagged.values())
+    if score >= SUSPICIOUS_ABOVE and ("anachronism" in flagged or len(flagged) >= 2 or terms_flagged >= 3):
+        reason = "Suspicious: the stranger " + "; and ".join(
+            f"{REASONS[category]} ({', '.join(terms)})" for category, terms in flagged.items()
+        ) + "."
+        return ScreenResult("suspicious", score, matches, reason)
+
+    return ScreenResult("escalate", score, matches)
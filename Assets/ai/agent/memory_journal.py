@@ -0,0 +1,272 @@
+# memory_journal.py
+"""
+Append-only journaled storage for NPC memory.
+
+The NPC memory JSON file (e.g. Neferkare_memory.json) stays the snapshot that Unity and humans
+read. Every change made during a conversation is appended as one JSONL record to a write-ahead
+journal next to it, instead of re-serializing the whole file several times per turn:
+
+    {"op": "header", "snapshot": "<sha1 of the snapshot file>"}
+    {"op": "append", "key": "inner_thoughts", "value": {...}}
+    {"op": "set", "key": "conversation_count", "value": 3}
+
+Records are flushed on every write and fsynced in batches. A background thread folds the
+journal back into the snapshot once it grows past a threshold. On startup the snapshot is
+loaded and the journal replayed on top of it. The header ties a journal to the exact snapshot
+it was written against, so a snapshot replaced from outside (Unity resets the memory from
+Neferkare_memory_clean.json on game launch) discards the stale journal instead of replaying it.
+A torn record left by a crash ends the replay, and the journal is truncated to the last good
+record before anything new is appended after it.
+
+Compaction serializes the data under the lock but writes and fsyncs the snapshot outside it.
+Records written meanwhile go to the old journal and are carried over into the new one.
+"""
+
+import os
+import json
+import hashlib
+import threading
+import time
+
+
+class JournaledMemoryStore:
+    """NPC memory backed by a JSON snapshot plus a JSONL write-ahead journal."""
+
+    def __init__(self, path_json, journal_path=None, fsync_every=8, fsync_interval=1.0, compact_after=200):
+        self.path_json = path_json
+        self.journal_path = journal_path or os.path.splitext(path_json)[0] + ".journal.jsonl"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
+
+        self.data = {}
+        self.lock = threading.RLock()
+        self._journal = None
+        self._journal_records = 0
+        self._unsynced = 0
+        self._wake = threading.Condition(self.lock)
+        self._closed = False
+        self._worker = None
+        # Serializes exports; records written while one is in progress are kept in _tail.
+        self._export_lock = threading.Lock()
+        self._tail = None
+
+    # --- Loading ---
+    def load(self):
+        """Load the snapshot, replay the journal on top of it and return the live data dict."""
+        with self.lock:
+            self.data = {}
+            with open(self.path_json, 'rb') as file:
+                raw = file.read()
+            self.data = json.loads(raw.decode('utf-8'))
+            snapshot_hash = hashlib.sha1(raw).hexdigest()
+
+            replayed = self._replay_journal(snapshot_hash)
+            if replayed is None:
+                self._start_journal(snapshot_hash)
+            else:
+                self._journal = open(self.journal_path, 'a', encoding='utf-8')
+                self._journal_records = replayed
+                print(f"DEBUG: Replayed {replayed} journaled memory records")
+
+            self._start_worker()
+            return self.data
+
+    def _replay_journal(self, snapshot_hash):
+        """Apply journal records to self.data. Returns the record count, or None if the journal is unusable."""
+        if not os.path.exists(self.journal_path):
+            return None
+
+        with open(self.journal_path, 'rb') as file:
+            raw = file.read()
+        lines = raw.splitlines(keepends=True)
+        if not lines:
+            return None
+
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return None
+        if header.get("op") != "header" or header.get("snapshot") != snapshot_hash:
+            print("DEBUG: Memory journal belongs to a different snapshot, discarding it")
+            return None
+
+        count = 0
+        good_size = len(lines[0])
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn line from a crash mid-write; everything before it is intact.
+                print(f"DEBUG: Dropping torn memory journal record ({len(raw) - good_size} bytes)")
+                break
+            self._apply(record)
+            count += 1
+            good_size += len(line)
+        self._repair_journal(good_size, len(raw))
+        return count
+
+    def _repair_journal(self, good_size, size):
+        """Cut the journal after its last good record so new records are not written behind a torn one."""
+        with open(self.journal_path, 'r+b') as file:
+            if good_size < size:
+                file.truncate(good_size)
+            file.seek(good_size - 1)
+            if file.read(1) != b"\n":
+                # The last record is complete but lost its newline; don't glue the next one onto it.
+                file.write(b"\n")
+
+    def _apply(self, record):
+        if record["op"] == "append":
+            self.data.setdefault(record["key"], []).append(record["value"])
+        elif record["op"] == "set":
+            self.data[record["key"]] = record["value"]
+
+    # --- Writing ---
+    def append(self, key, value):
+        """Append `value` to the list stored under `key`."""
+        with self.lock:
+            self.data.setdefault(key, []).append(value)
+            self._write({"op": "append", "key": key, "value": value})
+
+    def set(self, key, value):
+        """Replace the value stored under `key`."""
+        with self.lock:
+            self.data[key] = value
+            self._write({"op": "set", "key": key, "value": value})
+
+    def _write(self, record):
+        if self._journal is None:
+            self._start_journal(self._snapshot_hash())
+        if self._tail is not None:
+            self._tail.append(record)
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        self._journal_records += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or self._journal_records >= self.compact_after:
+            self._wake.notify()
+
+    def _start_journal(self, snapshot_hash):
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w', encoding='utf-8')
+        self._journal.write(json.dumps({"op": "header", "snapshot": snapshot_hash}) + "\n")
+        self._fsync()
+        self._journal_records = 0
+
+    def _snapshot_hash(self):
+        try:
+            with open(self.path_json, 'rb') as file:
+                return hashlib.sha1(file.read()).hexdigest()
+        except FileNotFoundError:
+            return None
+
+    def _fsync(self):
+        if self._journal is None:
+            return
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._unsynced = 0
+
+    # --- Queries ---
+    def recent(self, key, k):
+        """The last `k` entries of the list stored under `key`, oldest first."""
+        with self.lock:
+            return list(self.data.get(key, [])[-k:])
+
+    # --- Snapshot / compaction ---
+    def export(self, path=None):
+        """
+        Write the full memory in the original JSON layout. Exporting to the snapshot path also
+        compacts: the journal is restarted against the new snapshot. Writers are only blocked
+        while the data is serialized and while the files are swapped, not during the fsync.
+        """
+        target = path or self.path_json
+        compact = target == self.path_json
+        with self._export_lock:
+            with self.lock:
+                text = json.dumps(self.data, ensure_ascii=False, indent=4)
+                if compact:
+                    self._tail = []
+            try:
+                tmp_path = target + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    file.write(text)
+                    file.flush()
+                    os.fsync(file.fileno())
+                if not compact:
+                    os.replace(tmp_path, target)
+                    return
+                with self.lock:
+                    # The new journal (header + records written since the data was serialized) is
+                    # on disk before the snapshot it belongs to replaces the old one.
+                    journal_tmp = self._write_journal_file(hashlib.sha1(text.encode('utf-8')).hexdigest(), self._tail)
+                    os.replace(tmp_path, target)
+                    if self._journal is not None:
+                        self._journal.close()
+                    os.replace(journal_tmp, self.journal_path)
+                    self._journal = open(self.journal_path, 'a', encoding='utf-8')
+                    self._journal_records = len(self._tail)
+                    self._unsynced = 0
+            finally:
+                with self.lock:
+                    self._tail = None
+
+    def _write_journal_file(self, snapshot_hash, records):
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({"op": "header", "snapshot": snapshot_hash}) + "\n")
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        return tmp_path
+
+    def _start_worker(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run_worker, name="memory-journal", daemon=True)
+            self._worker.start()
+
+    def _run_worker(self):
+        while True:
+            with self.lock:
+                if self._closed:
+                    break
+                self._wake.wait(self.fsync_interval)
+                if self._closed:
+                    break
+                records = self._journal_records
+                compact = records >= self.compact_after
+                try:
+                    if not compact and self._unsynced:
+                        self._fsync()
+                except Exception as e:
+                    print(f"Error in memory journal worker: {e}")
+            if compact:
+                # Outside the lock: export only holds it to serialize and to swap the files.
+                try:
+                    start = time.perf_counter()
+                    self.export()
+                    print(f"DEBUG: Compacted {records} journal records in {time.perf_counter() - start:.3f}s")
+                except Exception as e:
+                    print(f"Error in memory journal worker: {e}")
+
+    def flush(self):
+        with self.lock:
+            self._fsync()
+
+    def close(self):
+        """Fold the journal into the snapshot so the JSON file is complete for Unity, then stop."""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+            pending = self._journal_records
+        if pending:
+            self.export()
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
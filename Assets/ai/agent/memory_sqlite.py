@@ -0,0 +1,264 @@
+# memory_sqlite.py
+"""
+Optional SQLite storage engine for NPC memory.
+
+Many NPCs share one database file and one small connection pool. Core memories, relationships
+and every memory-list type (Conversation_History, inner_thoughts, suspicious, reflections,
+questions_generated, ...) live in their own tables; memory entries are indexed on
+(npc, type, timestamp), so "the last K entries of type T" is an index range scan whose cost does
+not depend on how long the conversation has been going.
+
+The store exposes the same interface as JournaledMemoryStore (load / append / set / recent /
+export / close), so the NPC class can use either. Each NPC is seeded from its JSON memory file
+the first time it is seen; export() writes the original JSON layout back for the Unity side.
+If the JSON file is replaced from outside (Unity resets it on game launch), the NPC is re-seeded.
+"""
+
+import os
+import json
+import queue
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS npcs (
+    npc TEXT PRIMARY KEY,
+    fields TEXT NOT NULL,
+    json_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS core_memories (
+    npc TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (npc, position)
+);
+CREATE TABLE IF NOT EXISTS relationships (
+    npc TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (npc, name)
+);
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    npc TEXT NOT NULL,
+    type TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memories_npc_type_ts ON memories (npc, type, timestamp, id);
+"""
+
+# Statements are module constants so sqlite3's per-connection statement cache reuses the
+# prepared form on every call.
+SQL_GET_NPC = "SELECT fields, json_hash FROM npcs WHERE npc = ?"
+SQL_PUT_NPC = "INSERT OR REPLACE INTO npcs (npc, fields, json_hash) VALUES (?, ?, ?)"
+SQL_SET_JSON_HASH = "UPDATE npcs SET json_hash = ? WHERE npc = ?"
+SQL_GET_CORE = "SELECT type, content FROM core_memories WHERE npc = ? ORDER BY position"
+SQL_DELETE_CORE = "DELETE FROM core_memories WHERE npc = ?"
+SQL_INSERT_CORE = "INSERT INTO core_memories (npc, position, type, content) VALUES (?, ?, ?, ?)"
+SQL_GET_RELATIONSHIPS = "SELECT name, payload FROM relationships WHERE npc = ? ORDER BY position"
+SQL_DELETE_RELATIONSHIPS = "DELETE FROM relationships WHERE npc = ?"
+SQL_INSERT_RELATIONSHIP = "INSERT INTO relationships (npc, name, position, payload) VALUES (?, ?, ?, ?)"
+SQL_GET_MEMORY_TYPES = "SELECT DISTINCT type FROM memories WHERE npc = ?"
+SQL_GET_MEMORIES = "SELECT payload FROM memories WHERE npc = ? AND type = ? ORDER BY timestamp, id"
+SQL_GET_RECENT = "SELECT payload FROM memories WHERE npc = ? AND type = ? ORDER BY timestamp DESC, id DESC LIMIT ?"
+SQL_DELETE_MEMORIES = "DELETE FROM memories WHERE npc = ?"
+SQL_DELETE_MEMORY_TYPE = "DELETE FROM memories WHERE npc = ? AND type = ?"
+SQL_INSERT_MEMORY = "INSERT INTO memories (npc, type, timestamp, payload) VALUES (?, ?, ?, ?)"
+
+LIST_KEYS_EXCLUDED = ("core_memories",)
+
+
+class ConnectionPool:
+    """A fixed-size pool of connections to one SQLite file, shared by every NPC using it."""
+
+    def __init__(self, db_path, size=4):
+        self.db_path = db_path
+        self._connections = queue.Queue()
+        for _ in range(size):
+            connection = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections.put(connection)
+
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def connection(self):
+        connection = self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, size=4):
+    """Return the process-wide pool for `db_path`, opening it on first use."""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(key, size=size)
+            _pools[key] = pool
+        return pool
+
+
+def _file_hash(path):
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class SQLiteMemoryStore:
+    """NPC memory for one NPC, stored in a shared SQLite database."""
+
+    def __init__(self, path_json, db_path, npc_id=None, pool_size=4):
+        self.path_json = path_json
+        self.npc_id = npc_id or os.path.splitext(os.path.basename(path_json))[0]
+        self.pool = get_pool(db_path, size=pool_size)
+        self.data = {}
+        self.lock = threading.RLock()
+
+    # --- Loading ---
+    def load(self):
+        """Seed from the JSON file if needed, then build the in-memory view of this NPC."""
+        with self.lock, self.pool.connection() as connection:
+            self.data = {}
+            row = connection.execute(SQL_GET_NPC, (self.npc_id,)).fetchone()
+            json_hash = _file_hash(self.path_json)
+
+            if row is None or (json_hash is not None and row[1] != json_hash):
+                if row is not None:
+                    print(f"DEBUG: {self.path_json} changed outside the database, re-seeding {self.npc_id}")
+                with open(self.path_json, 'r', encoding='utf-8') as file:
+                    seed = json.load(file)
+                with connection:
+                    self._seed(connection, seed, json_hash)
+                row = connection.execute(SQL_GET_NPC, (self.npc_id,)).fetchone()
+
+            self.data = json.loads(row[0])
+            for key in self.data.pop("_lists", []):
+                self.data[key] = []
+            self.data["core_memories"] = [
+                {"type": memory_type, "content": content}
+                for memory_type, content in connection.execute(SQL_GET_CORE, (self.npc_id,))
+            ]
+            self.data["relationships"] = {
+                name: json.loads(payload)
+                for name, payload in connection.execute(SQL_GET_RELATIONSHIPS, (self.npc_id,))
+            }
+            for (memory_type,) in connection.execute(SQL_GET_MEMORY_TYPES, (self.npc_id,)).fetchall():
+                self.data[memory_type] = [
+                    json.loads(payload)
+                    for (payload,) in connection.execute(SQL_GET_MEMORIES, (self.npc_id, memory_type))
+                ]
+            return self.data
+
+    def _seed(self, connection, seed, json_hash):
+        connection.execute(SQL_DELETE_MEMORIES, (self.npc_id,))
+        fields = {}
+        for key, value in seed.items():
+            if key == "core_memories":
+                self._write_core(connection, value)
+            elif key == "relationships":
+                self._write_relationships(connection, value)
+            elif isinstance(value, list):
+                # Keep empty lists so the exported layout matches the original file.
+                fields.setdefault("_lists", []).append(key)
+                for entry in value:
+                    self._insert_memory(connection, key, entry)
+            else:
+                fields[key] = value
+        connection.execute(SQL_PUT_NPC, (self.npc_id, json.dumps(fields, ensure_ascii=False), json_hash))
+
+    def _write_core(self, connection, core_memories):
+        connection.execute(SQL_DELETE_CORE, (self.npc_id,))
+        connection.executemany(SQL_INSERT_CORE, [
+            (self.npc_id, position, memory["type"], memory["content"])
+            for position, memory in enumerate(core_memories)
+        ])
+
+    def _write_relationships(self, connection, relationships):
+        connection.execute(SQL_DELETE_RELATIONSHIPS, (self.npc_id,))
+        connection.executemany(SQL_INSERT_RELATIONSHIP, [
+            (self.npc_id, name, position, json.dumps(payload, ensure_ascii=False))
+            for position, (name, payload) in enumerate(relationships.items())
+        ])
+
+    def _insert_memory(self, connection, memory_type, entry):
+        timestamp = entry.get("timestamp", "") if isinstance(entry, dict) else ""
+        connection.execute(SQL_INSERT_MEMORY, (self.npc_id, memory_type, timestamp, json.dumps(entry, ensure_ascii=False)))
+
+    def _scalar_fields(self):
+        fields = {key: value for key, value in self.data.items()
+                  if key not in ("core_memories", "relationships") and not isinstance(value, list)}
+        fields["_lists"] = [key for key, value in self.data.items()
+                            if isinstance(value, list) and key not in LIST_KEYS_EXCLUDED]
+        return fields
+
+    # --- Writing ---
+    def append(self, key, value):
+        with self.lock, self.pool.connection() as connection:
+            self.data.setdefault(key, []).append(value)
+            with connection:
+                self._insert_memory(connection, key, value)
+
+    def set(self, key, value):
+        with self.lock, self.pool.connection() as connection:
+            self.data[key] = value
+            with connection:
+                if key == "core_memories":
+                    self._write_core(connection, value)
+                elif key == "relationships":
+                    self._write_relationships(connection, value)
+                elif isinstance(value, list):
+                    connection.execute(SQL_DELETE_MEMORY_TYPE, (self.npc_id, key))
+                    for entry in value:
+                        self._insert_memory(connection, key, entry)
+                else:
+                    row = connection.execute(SQL_GET_NPC, (self.npc_id,)).fetchone()
+                    connection.execute(SQL_PUT_NPC, (self.npc_id, json.dumps(self._scalar_fields(), ensure_ascii=False), row[1] if row else None))
+
+    # --- Queries ---
+    def recent(self, key, k):
+        """The last `k` entries of memory type `key`, oldest first."""
+        with self.pool.connection() as connection:
+            rows = connection.execute(SQL_GET_RECENT, (self.npc_id, key, k)).fetchall()
+        return [json.loads(payload) for (payload,) in reversed(rows)]
+
+    # --- Export ---
+    def export(self, path=None):
+        """Write this NPC's memory in the original JSON layout (default: its JSON memory file)."""
+        with self.lock:
+            text = json.dumps(self.data, ensure_ascii=False, indent=4)
+
+            target = path or self.path_json
+            tmp_path = target + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(text)
+            os.replace(tmp_path, target)
+
+            if target == self.path_json:
+                with self.pool.connection() as connection, connection:
+                    connection.execute(SQL_SET_JSON_HASH, (hashlib.sha1(text.encode('utf-8')).hexdigest(), self.npc_id))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.export()
@@ -1,18 +1,50 @@
 import re
 import os
+import sys
 import json
+import argparse
 from datetime import datetime
 import random
 import time
-from kokoro import KPipeline
-import sounddevice as sd
-import numpy as np
-from openai import OpenAI
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_gateway import get_gateway
+from turn_planner import plan_npc_turn
+from memory_journal import JournaledMemoryStore
+from memory_sqlite import SQLiteMemoryStore
+from tts_engine import KokoroEngine, SentenceSpeaker, interrupt
+from audio_output import AudioOutputQueue
+from prompt_builder import PromptBuilder, format_turns
+from section_stream import SectionStreamParser, THOUGHTS, SPOKEN
+from trust_reflection import TrustReflector
+from message_bus import BusPublisher
+from sentence_split import split_sentences
+from fast_screen import tag_name, screen_message
+from npc_telemetry import get_telemetry
+
+LLM_MODEL = "gpt-4o-mini"
+# What create_backbone returns (or streams) when the API call fails
+API_ERROR_REPLY = "Forgive me, my mind is clouded from the desert heat. Could you speak again?"
+
+
+def create_memory_store(path_json, backend=None, db_path=None, npc_id=None):
+    """
+    Pick the NPC memory backend: "journal" (default) keeps the JSON file plus an append-only
+    journal, "sqlite" keeps many NPCs in one indexed database. NPC_MEMORY_BACKEND and
+    NPC_MEMORY_DB select them from the environment.
+    """
+    backend = backend or os.environ.get("NPC_MEMORY_BACKEND", "journal")
+    if backend == "sqlite":
+        db_path = db_path or os.environ.get("NPC_MEMORY_DB") or os.path.join(os.path.dirname(os.path.abspath(path_json)), "npc_memory.db")
+        return SQLiteMemoryStore(path_json, db_path, npc_id=npc_id)
+    if backend == "journal":
+        return JournaledMemoryStore(path_json)
+    raise ValueError(f"Unknown NPC memory backend: {backend}")
 
 # ... (The rest of the NPC class is unchanged, so it's omitted for brevity) ...
 # ... (Paste the full NPC class from your original code here) ...
 class NPC:
-    def __init__(self, name, path_json='C:\\Developer\\Unity Projects\\ChronoRelic\\Assets\\ai\\agent\\Neferkare_memory.json'):
+    def __init__(self, name, path_json='C:\\Developer\\Unity Projects\\ChronoRelic\\Assets\\ai\\agent\\Neferkare_memory.json', memory_backend=None, db_path=None, combined_turns=None):
         self.name = name
         self.path_json = path_json
         self.identity = None
@@ -23,12 +55,29 @@ class NPC:
         self.relationships = None
         self.goal = None
         self.npc_condition = "trader whose leg has been partially healed"
+        # Memory changes are journaled (or stored in SQLite) instead of rewriting the whole JSON file every time.
+        self.memory = create_memory_store(path_json, memory_backend, db_path)
+        # Turn steps run concurrently, so memory writes are serialized through this lock.
+        self.memory_lock = self.memory.lock
         
         self.open_json()
         self.parse_npc_data_json()
         self.get_relationship()
         
         self.determine_conversation_stage()
+
+        # Prompts are assembled from a compact persona, a running summary and the last few turns.
+        self.prompts = PromptBuilder(self)
+        # "combined" (default): inner thoughts and the reply come from one streamed completion.
+        # "planned": a separate inner-thoughts call runs before the reply stream.
+        if combined_turns is None:
+            combined_turns = os.environ.get("NPC_TURN_MODE", "combined") == "combined"
+        self.combined_turns = combined_turns
+        # Trust is re-assessed in the background after every turn, so the final decision is a cheap read.
+        self.trust = TrustReflector(self)
+        self.pending_final_decision = None
+        # Replies are also streamed to the local message bus; npc_output.txt stays as a fallback.
+        self.bus = BusPublisher(f"npc.{self.name}")
         
         self.system_prompt = f"""You are roleplaying as {self.name}, a trader in ancient Egypt who was stranded in the desert. 
 You were saved by a stranger and your leg has been healed. Your identity is: {self.identity}
@@ -73,22 +122,20 @@ Important: Format your responses with clear separation:
                 self.conversation_stage = "awaiting_name"
 
     def open_json(self):
-        """Load NPC memory from JSON file"""
+        """Load NPC memory from the JSON snapshot plus its journal"""
         try:
-            with open(self.path_json, 'r', encoding='utf-8') as file:
-                self.data = json.load(file)
+            self.data = self.memory.load()
         except FileNotFoundError:
             print(f"Error: Memory file not found at {self.path_json}")
-            self.data = {}
+            self.data = self.memory.data
         except json.JSONDecodeError:
             print(f"Error: Invalid JSON format in memory file at {self.path_json}")
-            self.data = {}
+            self.data = self.memory.data
 
     def save_json(self):
-        """Save the current memory state back to JSON file"""
+        """Export the full memory state back to the JSON file (also compacts the journal)"""
         try:
-            with open(self.path_json, 'w', encoding='utf-8') as file:
-                json.dump(self.data, file, ensure_ascii=False, indent=4)
+            self.memory.export()
         except Exception as e:
             print(f"Error saving memory: {e}")
 
@@ -122,7 +169,7 @@ Important: Format your responses with clear separation:
         if player_name in self.data["relationships"]:
             old_status = self.data["relationships"][player_name]["type"]
             self.data["relationships"][player_name]["type"] = new_status
-            self.save_json()
+            self.memory.set("relationships", self.data["relationships"])
             print(f"DEBUG: Changed {player_name} from '{old_status}' to '{new_status}'")
             return True
         else:
@@ -131,11 +178,13 @@ Important: Format your responses with clear separation:
     def modify_json_memory_for_protagonist(self, player_name):
         """Update the NPC's memory with the player's name"""
         if "Stranger" in self.data["relationships"]:
-            stranger_data = self.data["relationships"]["Stranger"]
-            del self.data["relationships"]["Stranger"]
-            self.data["relationships"][player_name] = stranger_data
-            self.data["relationships"][player_name]["description"] = f"A mysterious figure who saved Neferkare from the desert and identified themselves as {player_name}. Their motives are unclear, but they seem strange in some way. Trust is a luxury Neferkare cannot afford."
-            self.save_json()
+            # Build a new dict instead of mutating in place: prompts running on other threads
+            # may be formatting the old one right now.
+            relationships = {name: rel for name, rel in self.data["relationships"].items() if name != "Stranger"}
+            relationships[player_name] = dict(self.data["relationships"]["Stranger"])
+            relationships[player_name]["description"] = f"A mysterious figure who saved Neferkare from the desert and identified themselves as {player_name}. Their motives are unclear, but they seem strange in some way. Trust is a luxury Neferkare cannot afford."
+            self.memory.set("relationships", relationships)
+            self.relationships = relationships
             print(f"DEBUG: Changed 'Stranger' to '{player_name}' in relationships")
             return True
         else:
@@ -144,27 +193,16 @@ Important: Format your responses with clear separation:
 
     def generate_inner_thoughts(self, player_message):
         """Generate NPC's inner thoughts in response to player message"""
-        conversation_history = self.data.get('Conversation_History', [])
-        recent_history = conversation_history[-5:] if len(conversation_history) > 5 else conversation_history
-        
-        history_context = ""
-        for entry in recent_history:
-            if isinstance(entry, dict) and "player_message" in entry and "npc_response" in entry:
-                history_context += f"Player: {entry['player_message']}\nMe: {entry['npc_response']}\n"
-        
-        prompt = f"""Based on my character:
-- Identity: {self.identity}
-- Backstory: {self.backstory}
-- Beliefs: {self.belief}
-- Current status: {self.status}
-- Goal: {self.goal}
-- Relationships: {self.relationships}
+        prompt = self.prompts.build("inner_thoughts", """Based on my character:
+{persona}
+Relationships:
+{relationships}
 Recent conversation:
-{history_context}
+{history}
 
 The player just said: "{player_message}"
 
-What are my honest inner thoughts as {self.name}? Consider:
+What are my honest inner thoughts as {name}? Consider:
 - My emotional reaction to what was just said
 - How this relates to my goals and fears
 - Any suspicions I might have about this stranger
@@ -173,8 +211,8 @@ What are my honest inner thoughts as {self.name}? Consider:
 -Is this person has a link to pamiu or not i should find out
 - A plan to test their trustworthiness
 Write 2-3 sentences of inner thoughts I wouldn't say aloud using all of the analysis you have done about the player.
-"""
-        inner_thoughts = self.create_backbone(message=prompt, role="assistant")
+""", player_message=player_message, name=self.name)
+        inner_thoughts = self.create_backbone(message=prompt, role="assistant", call_type="inner_thoughts")
         self.save_in_memory_json(player_message, inner_thoughts, "inner_thoughts")
         return inner_thoughts
     
@@ -183,29 +221,6 @@ Write 2-3 sentences of inner thoughts I wouldn't say aloud using all of the anal
         try:
             with open('npc_output.txt', 'w', encoding='utf-8') as file:
                 file.write(response)
-            # Load text from file
-            with open("C:/Developer/Unity Projects/ChronoRelic/Assets/ai/agent/npc_output.txt", "r", encoding="utf-8") as f:
-                text = f.read().strip()
-
-            # Initialize Kokoro pipeline
-            pipeline = KPipeline(lang_code="a", repo_id="hexgrad/Kokoro-82M")  # "a" = auto-detect
-
-            # Choose male voice, e.g., "am_onyx"
-            # Stream each phrase as it's generated
-            for i, (gender, phonemes, audio) in enumerate(pipeline(text, voice="am_onyx")):
-                print(f"[Chunk {i+1}] Playing audio ({len(audio)} samples)...")
-    
-                # Normalize audio if needed
-                if audio.dtype != np.float32:
-                    audio = audio.cpu().numpy().astype(np.float32)
-                    audio /= np.max(np.abs(audio) + 1e-9)  # normalize safely
-
-
-                # Play with sounddevice
-                sd.play(audio, samplerate=24000, blocking=False)
-
-                # Optional: short pause between chunks
-                time.sleep(len(audio) / 24000 * 0.9)  # adjust as needed for overlap
         except Exception as e:
             print(f"Error saving response to file: {e}")
     
@@ -213,41 +228,33 @@ Write 2-3 sentences of inner thoughts I wouldn't say aloud using all of the anal
     # It no longer saves the response, as that will be handled after the stream is complete.
     def generate_response(self, player_message, inner_thoughts, suspecious=" "):
         """Generate NPC's spoken response based on player message and inner thoughts"""
-        conversation_history = self.data.get('Conversation_History', [])
-        
         if self.conversation_stage == "initial_greeting" and self.data.get('conversation_count', 0) == 0:
-            prompt = f"""You are {self.name}, an ancient Egyptian trader who was rescued from the desert.
-Your identity: {self.identity}
-Your backstory: {self.backstory}
-Your beliefs: {self.belief}
-Your current situation: {self.status}
-conversation history : {conversation_history}
-Your Goal is : {self.goal}
+            prompt = self.prompts.build("greeting", """You are {name}, an ancient Egyptian trader who was rescued from the desert.
+{persona}
+Conversation so far:
+{history}
 This is your first interaction with the stranger who saved you. Your leg has now been healed.
 Your Response should be between 2 or 3 sentences at most
 Task: Thank the stranger sincerely for saving your life. Express your gratitude for both the rescue and healing your leg.
 Then, ask for their name
 
-"""
+""", name=self.name)
             # Request a streaming response
-            response_stream = self.create_backbone(message=prompt, role="user", stream=True)
+            response_stream = self.create_backbone(message=prompt, role="user", stream=True, call_type="greeting")
             self.conversation_stage = "awaiting_name"
             
         elif self.conversation_stage == "initial_greeting" and self.data.get('conversation_count', 0) > 0:
-            prompt = f"""You are {self.name}, continuing a conversation with someone who previously rescued you.
-Your identity: {self.identity}
-Your backstory: {self.backstory}
-Your beliefs: {self.belief}
-Your current situation: {self.status}
-conversation history : {conversation_history}
-Your Goal is : {self.goal}
+            prompt = self.prompts.build("greeting", """You are {name}, continuing a conversation with someone who previously rescued you.
+{persona}
+Conversation so far:
+{history}
 Inner thoughts: {inner_thoughts}
 You've spoken with this person before. They've just returned to speak with you again.
 Your Response should be between 2 or 3 sentences at most
 Task: Acknowledge their return and continue the conversation naturally. Don't re-introduce yourself or ask for their name again since you've already met.
-"""
+""", name=self.name, inner_thoughts=inner_thoughts)
             # Request a streaming response
-            response_stream = self.create_backbone(message=prompt, role="user", stream=True)
+            response_stream = self.create_backbone(message=prompt, role="user", stream=True, call_type="greeting")
             self.conversation_stage = "post_introduction"
             
         else:
@@ -265,19 +272,16 @@ Task: Acknowledge their return and continue the conversation naturally. Don't re
             else:
                 name_context = ""
 
-            prompt = f"""You are {self.name}, speaking to someone who rescued you in the desert.
-Your identity: {self.identity}
-Your backstory: {self.backstory}
-Your beliefs: {self.belief}
-Your current situation: {self.status}
-Your relationships: {self.relationships}
-Your Goal is : {self.goal}
+            prompt = self.prompts.build("response", """You are {name}, speaking to someone who rescued you in the desert.
+{persona}
+Your relationships:
+{relationships}
 {name_context}
-conversation history : 
-{conversation_history}
+Conversation so far:
+{history}
 The person just said: "{player_message}"
 My recent inner thoughts: {inner_thoughts}, follow the plan that is generated by inner thoughts:
-Respond naturally as {self.name}, taking into account your current feelings, suspicions, and the situation.
+Respond naturally as {name}, taking into account your current feelings, suspicions, and the situation.
 do not respond in a very relegious or philosophical tone remember you are a trader after all you should quick and charismatic 
 Remember you're not fully healed and vulnerable, but also carrying important secrets and evidence.
 you should not reveal too much about yourself or your mission.
@@ -285,29 +289,98 @@ you should not reveal anything about the conspiracy or the message you carry unt
 do not metion anything about the trust make the conversation natural and engaging 
 remeber your goal is to judge weather this person can be cosnderd an ally so you can give him the scroll or not
 Your Response should be between 2 or 3 sentences at most
-"""
+""", name=self.name, name_context=name_context, player_message=player_message, inner_thoughts=inner_thoughts)
             # Request a streaming response
-            response_stream = self.create_backbone(message=prompt, role="user", stream=True)
+            response_stream = self.create_backbone(message=prompt, role="user", stream=True, call_type="response")
         
         # Return the generator object for the calling function to handle
         return response_stream
+
+    def generate_thoughts_and_response(self, player_message, name_context=""):
+        """
+        Generate inner thoughts and the spoken reply in one streamed completion.
+
+        Returns (inner_thoughts, response_stream) like the two-call path: the stream is read until
+        the inner-thoughts section closes, the thoughts are saved, and the returned generator
+        yields the spoken text as it arrives.
+        """
+        prompt = self.prompts.build("combined", """You are roleplaying as {name}, a trader in ancient Egypt (around 3100 BCE) who was stranded in the desert and rescued by the person speaking to you. Your leg has been partially healed.
+{persona}
+Your relationships:
+{relationships}
+{name_context}
+Conversation so far:
+{history}
+The person just said: "{player_message}"
+
+First write your honest inner thoughts (2-3 sentences the player never hears): your emotional
+reaction, any suspicions or inconsistencies, whether this person may be linked to Pamiu, and a
+plan to test their trustworthiness.
+Then reply out loud following that plan: 2 or 3 sentences at most, natural, quick and charismatic
+like a trader rather than religious or philosophical. You are vulnerable and carry important
+secrets; do not reveal your mission, the conspiracy or the message you carry until you are sure
+you can trust this person, and never talk about trust itself. Your goal is to judge whether this
+person can be considered an ally so you can give them the scroll.
+
+Format your answer exactly as:
+[INNER THOUGHTS: ...]
+[SPOKEN: ...]
+""", name=self.name, name_context=name_context, player_message=player_message)
+        stream = self.create_backbone(message=prompt, role="user", stream=True, call_type="combined")
+
+        parser = SectionStreamParser()
+        chunks = iter(stream)
+        early_spoken = []
+        try:
+            for chunk in chunks:
+                for section, text in parser.feed(_chunk_text(chunk)):
+                    if section == SPOKEN:
+                        early_spoken.append(text)
+                if THOUGHTS in parser.closed or early_spoken:
+                    break
+            else:
+                early_spoken.extend(text for section, text in parser.finish() if section == SPOKEN)
+        except Exception as e:
+            print(f"\nAn error occurred while reading inner thoughts: {e}")
+
+        inner_thoughts = parser.thoughts()
+        if inner_thoughts:
+            self.save_in_memory_json(player_message, inner_thoughts, "inner_thoughts")
+
+        def response_stream():
+            yield from early_spoken
+            for chunk in chunks:
+                for section, text in parser.feed(_chunk_text(chunk)):
+                    if section == SPOKEN:
+                        yield text
+            for section, text in parser.finish():
+                if section == SPOKEN:
+                    yield text
+
+        return inner_thoughts, response_stream()
+
     def extract_name(self, message):
         """Attempt to extract a name from the player's message"""
-        name_patterns = [
-            r"(?:I am|I'm|call me|name is|It's) ([A-Z][a-z]+)",
-            r"([A-Z][a-z]+) is my name",
-            r"You can call me ([A-Z][a-z]+)",
-        ]
-        
-        for pattern in name_patterns:
-            match = re.search(pattern, message)
-            if match:
-                return match.group(1)
-        
+        # The local tagger settles clear cases; only ambiguous messages go to the LLM.
+        decision, name = tag_name(message)
+        print(f"DEBUG: Fast name tagger: {decision} {name or ''}")
+        if decision == "name":
+            return name
+        if decision == "no_name":
+            return None
+        return self.llm_extract_name(message)
+
+    def llm_extract_name(self, message, raise_errors=False):
+        """Ask the LLM for the name in the player's message; an API error is not a name"""
         prompt = f"""Extract the name from this message or respond with "NO_NAME" if no name is provided:
 Message: "{message}"
 Only return the name or "NO_NAME", nothing else."""
-        name = self.create_backbone(message=prompt, role="user")
+        try:
+            name = self.create_backbone(message=prompt, role="user", call_type="extract_name", raise_errors=True)
+        except Exception:
+            if raise_errors:
+                raise
+            return None
         name = name.strip('"\'.,!? ')
         
         if name.upper() in ["NO_NAME", "NONE", "NO NAME", ""]:
@@ -320,7 +393,8 @@ Only return the name or "NO_NAME", nothing else."""
         if not self.data:
             return
         if entry_type == "model_response":
-            self.data['conversation_count'] = self.data.get('conversation_count', 0) + 1
+            with self.memory_lock:
+                self.memory.set('conversation_count', self.data.get('conversation_count', 0) + 1)
         
         mem_list_map = {
             "inner_thoughts": ("inner_thoughts", {"player_message": player_message, "inner_thoughts": response}),
@@ -332,28 +406,14 @@ Only return the name or "NO_NAME", nothing else."""
 
         if entry_type in mem_list_map:
             list_name, content_dict = mem_list_map[entry_type]
-            if list_name not in self.data:
-                self.data[list_name] = []
-            
             new_memory = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **content_dict}
-            self.data[list_name].append(new_memory)
-            self.save_json()
+            self.memory.append(list_name, new_memory)
   
     def generate_reflection(self):
         """Generate a reflection on recent conversations and update relationship status"""
-        conversations = self.data.get("Conversation_History", [])
-        thoughts = self.data.get("inner_thoughts", [])
-        
-        if not conversations:
+        if not self.memory.recent("Conversation_History", 1):
             return None
-            
-        recent_convos = conversations[-5:] if len(conversations) > 5 else conversations
-        recent_thoughts = thoughts[-5:] if len(thoughts) > 5 else thoughts
-        
-        convo_summary = ""
-        for convo in recent_convos:
-            if isinstance(convo, dict) and "player_message" in convo and "npc_response" in convo:
-                convo_summary += f"Player said: {convo['player_message']}\nI responded: {convo['npc_response']}\n\n"
+        recent_thoughts = self.memory.recent("inner_thoughts", 5)
                 
         thoughts_summary = ""
         for thought in recent_thoughts:
@@ -366,15 +426,15 @@ Only return the name or "NO_NAME", nothing else."""
                 player_name = name
                 break
         
-        reflection_prompt = f"""As {self.name}, you must make a crucial decision about {player_name} after 8 conversations.
+        reflection_prompt = self.prompts.build("reflection", """As {name}, you must make a crucial decision about {player_name} after 8 conversations.
 
     Recent conversations:
-    {convo_summary}
+    {history}
 
     Your inner thoughts about these exchanges:
     {thoughts_summary}
 
-    You are {self.name}, a trader carrying vital information about High Priest Pamiu's conspiracy against the pharaoh. You've been rescued by {player_name} and have now spoken with them 8 times. You MUST decide if they can be trusted with your secret mission.
+    You are {name}, a trader carrying vital information about High Priest Pamiu's conspiracy against the pharaoh. You've been rescued by {player_name} and have now spoken with them 8 times. You MUST decide if they can be trusted with your secret mission.
 
     This is your FINAL assessment. Consider:
     1. Have they shown genuine concern for your wellbeing?
@@ -395,9 +455,9 @@ Only return the name or "NO_NAME", nothing else."""
     Format your response as:
     [REFLECTION: Your detailed analysis of all interactions and why you've reached this conclusion]
     [DECISION: Ally] or [DECISION: Enemy]
-    """
+    """, name=self.name, player_name=player_name, thoughts_summary=thoughts_summary)
         
-        reflection_response = self.create_backbone(reflection_prompt, "user")
+        reflection_response = self.create_backbone(reflection_prompt, "user", call_type="reflection")
         
         decision_patterns = [
             r'\[DECISION:\s*(Ally|Enemy)\]', r'DECISION:\s*(Ally|Enemy)', r'Decision:\s*(Ally|Enemy)', r'\b(Ally|Enemy)\b(?=\s*$)'
@@ -419,11 +479,28 @@ Only return the name or "NO_NAME", nothing else."""
 
     def check_for_suspicious(self, player_message):
         """Check if a player message seems suspicious based on NPC's background"""
+        # The lexicon screen settles clear cases; only ambiguous messages go to the LLM.
+        screen = screen_message(player_message)
+        print(f"DEBUG: Fast suspicion screen: {screen}")
+        if screen.decision == "clear":
+            return None
+        if screen.decision == "suspicious":
+            self.save_in_memory_json(player_message, screen.reason, "suspicious")
+            return screen.reason
+
+        response = self.llm_check_suspicious(player_message)
+        if "not suspicious" not in response.lower():
+            self.save_in_memory_json(player_message, response, "suspicious")
+            return response
+        return None
+
+    def llm_check_suspicious(self, player_message, raise_errors=False):
+        """
+        Ask the LLM whether a player message is suspicious; returns its raw verdict. An API error
+        is reported as "Not suspicious." unless `raise_errors` is set.
+        """
         suspicious_prompt = f"""You are {self.name}, an ancient Egyptian trader who was rescued from the desert.
-Your identity: {self.identity}
-Your backstory: {self.backstory}
-Your beliefs: {self.belief}
-Your current situation: {self.status} 
+{self.prompts.persona()}
 analyze this message from someone who rescued you: "{player_message}"
 
 Consider:
@@ -435,35 +512,32 @@ Consider:
 Is there anything suspicious about this message? If yes, explain why it's suspicious.
 If no, simply state "Not suspicious."
 """
-        response = self.create_backbone(message=suspicious_prompt, role="user")
-        if "not suspicious" not in response.lower():
-            self.save_in_memory_json(player_message, response, "suspicious")
-            return response
-        return None
+        try:
+            return self.create_backbone(message=suspicious_prompt, role="user", call_type="suspicious", raise_errors=True)
+        except Exception:
+            if raise_errors:
+                raise
+            return "Not suspicious."
 
     def generate_question(self, player_message):
         """Generate a question to learn more about the player or clarify suspicious points"""
-        suspicious = self.data.get("suspicious", [])
-        thoughts = self.data.get("inner_thoughts", [])
-        conversations = self.data.get("Conversation_History", [])
+        suspicious = self.memory.recent("suspicious", 3)
+        thoughts = self.memory.recent("inner_thoughts", 3)
+        conversations = self.memory.recent("Conversation_History", 3)
 
         suspicious_context = ""
         if suspicious:
-            for item in suspicious[-3:]:
-                suspicious_context += f"Suspicious message: {item['suspicious_message']}\nReason: {item.get('reason', 'Unknown')}\n\n,ME:{item.get('npc_message')}\n"
+            for item in suspicious:
+                suspicious_context += f"Suspicious message: {item['suspicious_message']}\nReason: {item.get('reason', 'Unknown')}\n\n"
         thoughts_context = ""
         if thoughts:
-            for item in thoughts[-3:]:
+            for item in thoughts:
                 thoughts_context += f"- {item['inner_thoughts']}\n"
-        conversations_context = ""
-        if conversations:
-            for item in conversations[-3:]:
-                conversations_context += f"Player: {item['player_message']}\n,I said:{item['npc_message']}\n"
+        conversations_context = format_turns(conversations, self.name)
 
         prompt = f"""As {self.name}, generate a natural-sounding question to ask the player.
 
-Your identity: {self.identity}
-Your backstory: {self.backstory}
+{self.prompts.persona()}
 Your current goals: Learn more about this person and determine if they're trustworthy
 Recent suspicious elements: {suspicious_context}
 My recent inner thoughts: {thoughts_context}
@@ -477,39 +551,55 @@ Generate a single question that would:
 4. Possibly reveal if they're connected to your enemies
 Return only the question, nothing else.
 """
-        question = self.create_backbone(message=prompt, role="user")
+        question = self.create_backbone(message=prompt, role="user", call_type="question")
         question = question.strip('"\'')
         self.save_in_memory_json(player_message, question, "question")
         return question
 
-    def create_backbone(self, message, role='user', stream=False):
-        """Make an API call to OpenAI for generating NPC responses"""
+    def create_backbone(self, message, role='user', stream=False, call_type="other", raise_errors=False):
+        """
+        Make an API call to OpenAI for generating NPC responses. `call_type` labels the call in
+        npc_telemetry (queue time, time to first token, tokens and chunk cadence per call type).
+        On an API error the NPC's API_ERROR_REPLY is returned, or the error re-raised with
+        `raise_errors` for callers that must not mistake it for an answer.
+        """
+        telemetry = get_telemetry()
+        timings = {}
+        started = time.perf_counter()
         try:
             # It's best practice to load the API key from an environment variable.
             # For this example, we'll keep your hardcoded key.
-            client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY", "sk-proj-oBIOgX0aO6YzaLlAldnpT3BlbkFJbdDbSEEoomYGNFVC9A2l"))
+            # The gateway is shared by the whole process, so every call reuses its pooled connections.
+            gateway = get_gateway(api_key=os.environ.get("OPENAI_API_KEY", "sk-proj-oBIOgX0aO6YzaLlAldnpT3BlbkFJbdDbSEEoomYGNFVC9A2l"))
             
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
+            options = {"stream_options": {"include_usage": True}} if stream else {}
+            completion = gateway.chat(
+                model=LLM_MODEL,
                 messages=[{"role": role, "content": message}],
-                stream=stream  # Use the stream parameter here
+                stream=stream,  # Use the stream parameter here
+                timings=timings,
+                **options
             )
 
             if stream:
-                # If streaming is enabled, return the generator object directly.
-                return completion
+                # If streaming is enabled, return the chunks as they arrive; the call is recorded once the stream ends.
+                return telemetry.wrap_stream(completion, call_type, LLM_MODEL, started, timings)
             else:
                 # If not streaming, return the complete response content as before.
+                telemetry.record_completion(call_type, LLM_MODEL, started, timings, completion)
                 response = completion.choices[0].message.content
                 return response
         except Exception as e:
             print(f"Error in API call: {e}")
+            telemetry.record_completion(call_type, LLM_MODEL, started, timings, error=str(e))
+            if raise_errors:
+                raise
             if stream:
                 # In case of an error, we need to return a generator that yields an error message.
                 def error_generator():
-                    yield "Forgive me, my mind is clouded from the desert heat. Could you speak again?"
+                    yield API_ERROR_REPLY
                 return error_generator()
-            return "Forgive me, my mind is clouded from the desert heat. Could you speak again?"
+            return API_ERROR_REPLY
 
     # MODIFICATION: This function now returns the full reflection text for printing.
     def process_player_input(self, player_message):
@@ -522,54 +612,73 @@ Return only the question, nothing else.
             decision = self.data.get('final_decision', 'UNKNOWN')
             return f"\n(System: The conversation with {self.name} has concluded. Final decision was {decision}.)", None
                 
-        if self.conversation_stage == "awaiting_name":
-            possible_name = self.extract_name(player_message)
-            if possible_name:
-                self.modify_json_memory_for_protagonist(possible_name)
-                print(f"\n(System: Player identified as {possible_name})")
-                self.conversation_stage = "post_introduction"
-        
         current_count = self.data.get('conversation_count', 0)
         print(f"DEBUG: Current conversation count: {current_count}")
         
         if current_count >= 7:
-            print("DEBUG: Triggering final reflection...")
-            reflection = self.generate_reflection() # The full reflection text is here
-            if reflection:
-                decision_patterns = [r'\[DECISION:\s*(Ally|Enemy)\]', r'DECISION:\s*(Ally|Enemy)', r'Decision:\s*(Ally|Enemy)', r'\b(Ally|Enemy)\b(?=\s*$)']
-                decision = None
-                for pattern in decision_patterns:
-                    decision_match = re.search(pattern, reflection, re.IGNORECASE)
-                    if decision_match:
-                        decision = decision_match.group(1).strip().capitalize()
-                        break
-                
-                if decision:
-                    print(f"\n(System: NPC has decided the player is: {decision})")
-                    _, final_response = self.generate_final_conversation(decision, player_message)
-                    
-                    # Save the final response to file
-                    self.save_response_to_file(final_response.strip())
-                    
-                    # MODIFICATION: Combine the reflection and final response into one message for printing.
-                    # This ensures the reflection is displayed to the user.
-                    final_message_to_print = (
-                        f"(Neferkare's Final Thoughts):\n{reflection.strip()}\n\n"
-                        f"{self.name}:\n{final_response.strip()}"
-                    )
-                    
-                    return final_message_to_print, "[CONVERSATION ENDED]"
+            if self.conversation_stage == "awaiting_name":
+                possible_name = self.extract_name(player_message)
+                if possible_name:
+                    self.modify_json_memory_for_protagonist(possible_name)
+                    print(f"\n(System: Player identified as {possible_name})")
+                    self.conversation_stage = "post_introduction"
 
-        # Normal conversation flow
-        inner_thoughts = self.generate_inner_thoughts(player_message)
-        response_stream = self.generate_response(player_message, inner_thoughts)
-        
-        return inner_thoughts, response_stream
+            # Let the update for the previous exchange land, but never stall the final turn for long.
+            self.trust.wait_idle(timeout=5)
+            if self.trust.turns_assessed() > 0:
+                print("DEBUG: Reading final decision from the trust assessment...")
+                reflection, decision = self.reflect_from_assessment()
+            else:
+                # No running assessment (e.g. memory from an older session): one full reflection.
+                print("DEBUG: Triggering final reflection...")
+                reflection = self.generate_reflection() # The full reflection text is here
+                decision = None
+                if reflection:
+                    decision_patterns = [r'\[DECISION:\s*(Ally|Enemy)\]', r'DECISION:\s*(Ally|Enemy)', r'Decision:\s*(Ally|Enemy)', r'\b(Ally|Enemy)\b(?=\s*$)']
+                    for pattern in decision_patterns:
+                        decision_match = re.search(pattern, reflection, re.IGNORECASE)
+                        if decision_match:
+                            decision = decision_match.group(1).strip().capitalize()
+                            break
+
+            if decision:
+                print(f"\n(System: NPC has decided the player is: {decision})")
+                final_inner_thought, final_stream = self.generate_final_conversation(decision, player_message)
+
+                # The reflection is shown as the NPC's thoughts; the final reply is streamed like
+                # any other and concludes the conversation once it has been saved.
+                final_thoughts = f"(Neferkare's Final Thoughts): {reflection.strip()}\n{final_inner_thought}"
+                return final_thoughts, final_stream
+
+        # Normal conversation flow: name extraction and the suspicion check run alongside
+        # inner-thought generation, and the response stream opens once its inputs are ready.
+        planner = plan_npc_turn(self, player_message, combined=self.combined_turns)
+        results = planner.run()
+        print(f"DEBUG: {planner.report()}")
+
+        if "turn" in results:
+            return results["turn"]
+        return results["inner_thoughts"], results["response"]
     
+    def reflect_from_assessment(self):
+        """Turn the running trust assessment into the final reflection and decision (no LLM call)"""
+        assessment = self.trust.assessment()
+        decision = self.trust.decision()
+        reflection = f"Trust {assessment['score']}/100 after {assessment.get('turns_assessed', 0)} exchanges. {assessment['rationale']}"
+
+        player_name = next((name for name in self.relationships if name != "Stranger"), "Stranger")
+        if player_name in self.relationships and self.relationships[player_name].get("type") == "Not Determined Yet":
+            self.update_relationship_status(player_name, decision)
+            print(f"DEBUG: Successfully updated {player_name}'s relationship status to: {decision}")
+
+        self.save_in_memory_json("", f"[REFLECTION: {reflection}]\n[DECISION: {decision}]", "reflection")
+        return reflection, decision
+
     def generate_final_conversation(self, decision, player_message):
         """
-        Generates a new inner thought based on the final decision,
-        then creates the final spoken response that pivots to the outcome.
+        Picks the final inner thought for the decision and opens the stream for the final
+        spoken response that pivots to the outcome. The conversation is concluded by
+        conclude_conversation() once that response has been streamed and saved.
         """
         player_name = "Stranger"
         for name in self.relationships:
@@ -578,11 +687,9 @@ Return only the question, nothing else.
                 break
 
         if decision.lower() == "ally":
-            thought_prompt = f"I have made my choice. {player_name} is worthy of my trust. Ma'at has guided me. I will give them the scroll and entrust them with my mission. Everything depends on this."
+            final_inner_thought = f"I have made my choice. {player_name} is worthy of my trust. Ma'at has guided me. I will give them the scroll and entrust them with my mission. Everything depends on this."
         else: # Enemy
-            thought_prompt = f"My suspicions were correct. This person cannot be trusted. They might even be one of Pamiu's agents. I will give them false information to send them on a fool's errand and then disappear. I must protect the scroll at all costs."
-        
-        final_inner_thought = self.create_backbone(message=thought_prompt, role="assistant")
+            final_inner_thought = f"My suspicions were correct. This person cannot be trusted. They might even be one of Pamiu's agents. I will give them false information to send them on a fool's errand and then disappear. I must protect the scroll at all costs."
 
         if decision.lower() == "ally":
             final_prompt = f"""
@@ -612,49 +719,114 @@ Return only the question, nothing else.
             Your response should be cautious and sound helpful on the surface, but be designed to mislead. 2-4 sentences at most.
             """
         
-        final_response = self.create_backbone(message=final_prompt, role="user")
-        
-        # Save the final spoken response, which is what the NPC "said".
-        # The reflection is already saved separately in generate_reflection().
-        self.save_in_memory_json(player_message, final_response, "model_response")
-        self.data['conversation_completed'] = True
-        self.data['final_decision'] = decision
+        final_stream = self.create_backbone(message=final_prompt, role="user", stream=True, call_type="final")
+        self.pending_final_decision = decision
+
+        return final_inner_thought, final_stream
+
+    def conclude_conversation(self):
+        """Record the final decision once the final response has been streamed and saved"""
+        decision = self.pending_final_decision
+        self.pending_final_decision = None
+        self.memory.set('conversation_completed', True)
+        self.memory.set('final_decision', decision)
+        # The conversation is over: write the complete JSON so Unity sees the final state.
         self.save_json()
-        
-        return final_inner_thought, final_response
 
-# NEW: A helper function to handle the streaming output and save the final result.
-def handle_streaming_response(npc, player_input, inner_thoughts, response_stream):
-    """Prints the response as it streams and saves the full content afterward."""
-    print(f"\n{npc.name}:")
-    if inner_thoughts:
-        print(f"Thinking: {inner_thoughts}\n")
-    
-    print("Response: ", end='')
-    
+def _chunk_text(chunk):
+    """Text of one streamed item: an OpenAI chunk (possibly with no choices) or a plain string."""
+    if isinstance(chunk, str):
+        return chunk
+    if not getattr(chunk, "choices", None):
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+def stream_npc_response(npc, player_input, response_stream, on_token=None, write_file=True, speak_response=True):
+    """
+    Consume a response stream: hand every token to `on_token` and the TTS, then save the full
+    response and run the post-turn bookkeeping. Returns the full response text. Shared by the
+    console loop and the NPC server.
+    """
+    # Sentences are spoken as soon as they are complete, while the rest is still streaming.
+    speaker = None
+    if speak_response:
+        try:
+            speaker = SentenceSpeaker()
+        except Exception as e:
+            print(f"Error starting speech: {e}")
+
     full_response_parts = []
+    sentence_buffer = ""
     try:
         for chunk in response_stream:
-            content = chunk.choices[0].delta.content or ""
-            print(content, end='', flush=True)
+            content = _chunk_text(chunk)
+            if not content:
+                continue
             full_response_parts.append(content)
-        print() # Add a newline after the stream is complete
+            npc.bus.token(content)
+            sentences, sentence_buffer = split_sentences(sentence_buffer + content)
+            for sentence in sentences:
+                npc.bus.sentence(sentence)
+            if on_token:
+                on_token(content)
+            if speaker:
+                speaker.feed(content)
     except Exception as e:
         print(f"\nAn error occurred during streaming: {e}")
 
     # Assemble the complete response string from the streamed parts
     final_response = "".join(full_response_parts)
+    if sentence_buffer.strip():
+        npc.bus.sentence(sentence_buffer.strip())
 
     # Now that the stream is finished and we have the full response, save it to memory.
     if final_response:
         npc.save_in_memory_json(player_input, final_response, "model_response")
-        # Save the response to file (just the raw text, no NPC name)
-        npc.save_response_to_file(final_response.strip())
+        if write_file:
+            # Save the response to file (just the raw text, no NPC name); it is already being spoken
+            npc.save_response_to_file(final_response.strip())
+        # Fold turns that left the verbatim window into the running summary, off the critical path.
+        npc.prompts.update_summary_in_background()
+
+    npc.bus.done(final_response.strip(), player_input=player_input,
+                 completed=bool(npc.pending_final_decision))
+
+    if npc.pending_final_decision:
+        npc.conclude_conversation()
+    elif final_response and player_input:
+        # Re-assess trust from this exchange in the background.
+        npc.trust.update_in_background(player_input, final_response)
+
+    if speaker:
+        speaker.finish()
+    return final_response
+
+# NEW: A helper function to handle the streaming output and save the final result.
+def handle_streaming_response(npc, player_input, inner_thoughts, response_stream, speak_response=True):
+    """Prints the response as it streams and saves the full content afterward."""
+    print(f"\n{npc.name}:")
+    if inner_thoughts:
+        print(f"Thinking: {inner_thoughts}\n")
+    
+    print("Response: ", end='')
+    final_response = stream_npc_response(
+        npc, player_input, response_stream,
+        on_token=lambda content: print(content, end='', flush=True),
+        speak_response=speak_response,
+    )
+    print() # Add a newline after the stream is complete
+    return final_response
 
 # MODIFIED: The main loop now handles the final reflection printout correctly.
 def run_npc_conversation():
     """Run an interactive conversation with the NPC"""
     npc = NPC(name="Neferkare")
+
+    # Load the TTS model and voice once, before the first reply needs them.
+    try:
+        KokoroEngine.shared()
+    except Exception as e:
+        print(f"Error loading TTS engine: {e}")
     
     print("\n=== Ancient Egypt NPC Interaction ===")
     print("You've rescued a trader from the desert, and have now healed his leg.")
@@ -674,24 +846,45 @@ def run_npc_conversation():
         
         if player_input.lower() in ['quit', 'exit']:
             break
+
+        # The player spoke over the NPC: stop the previous reply instead of talking over them.
+        interrupt()
             
         # Renamed 'inner_thoughts' to 'npc_output' for clarity, as it can contain more than just thoughts.
         npc_output, response_stream = npc.process_player_input(player_input)
         
-        # Check for conversation end signal
-        if response_stream == "[CONVERSATION ENDED]":
-            # The 'npc_output' variable now holds the combined final reflection and response.
-            print(f"\n{npc_output}")
-            print("\n(The conversation has concluded. The program will now close.)")
-            time.sleep(4)
-            break
-        
         if response_stream:
             # Pass the regular inner thoughts to the handler
             handle_streaming_response(npc, player_input, npc_output, response_stream)
         elif npc_output:
             print(f"\n{npc_output}")
 
+        # The final reply concludes the conversation once it has been streamed and saved.
+        if npc.data.get('conversation_completed', False):
+            print("\n(The conversation has concluded. The program will now close.)")
+            break
+
+    # Let a trust update still in flight land before the memory is closed.
+    npc.trust.wait_idle(timeout=10)
+    npc.memory.close()
+
+    if AudioOutputQueue._instance is not None:
+        output = AudioOutputQueue._instance
+        output.wait_until_drained(timeout=30)
+        print(f"DEBUG: Audio output stats: {output.stats()}")
+        output.close()
+
 
 if __name__ == "__main__":
-    run_npc_conversation()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Talk to Neferkare, or host many NPCs in one process.")
+    parser.add_argument("--serve", action="store_true", help="run the multi-NPC conversation server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-tts", action="store_true", help="server mode: do not speak replies")
+    args = parser.parse_args()
+
+    if args.serve:
+        from npc_server import serve
+        serve(args.host, args.port, speak=not args.no_tts)
+    else:
+        run_npc_conversation()
\ No newline at end of file
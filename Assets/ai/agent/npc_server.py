@@ -0,0 +1,263 @@
+# npc_server.py
+"""
+Multi-NPC conversation server.
+
+One long-lived asyncio process hosts any number of NPC instances, keyed by memory file (one
+NPC per file, so no two ids ever hold the same journal open), so every NPC in a scene shares one interpreter, one set of imports, one pooled LLM
+gateway and one resident TTS engine instead of each starting its own `python npc4.py`.
+
+Start it with `python npc4.py --serve [--host 127.0.0.1] [--port 8765] [--no-tts]`.
+
+Protocol: every message in both directions is a frame of a 4-byte big-endian length followed
+by that many bytes of UTF-8 JSON (the framing shared with message_bus). Requests carry an "op"
+and, except for "stats", the NPC they are for:
+
+    {"op": "open",  "npc_id": "Neferkare", "memory": "Neferkare_memory.json"}   -> greeting turn
+    {"op": "say",   "npc_id": "Neferkare", "memory": "...", "text": "I am Ahmed"}
+    {"op": "close", "npc_id": "Neferkare", "memory": "..."}
+    {"op": "stats"}                                                             -> NPCs and LLM telemetry
+
+A turn ("open" or "say") is answered with a stream of frames:
+
+    {"type": "thoughts", "text": "..."}              the NPC's inner thoughts (once)
+    {"type": "token", "text": "..."}                 spoken reply, as it streams
+    {"type": "done", "response": "...", "completed": false}
+
+Other requests get a single {"type": "ok", ...} frame, and failures a {"type": "error",
+"message": "..."} frame, including an "open"/"say" whose memory file is already hosted under a
+different npc_id. Turns for the same NPC are serialized; different NPCs run concurrently.
+"""
+
+import os
+import asyncio
+import socket
+import threading
+import time
+
+import npc4
+from message_bus import encode_frame, read_frame, recv_frame
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MEMORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Neferkare_memory.json")
+
+
+class NPCSession:
+    """One hosted NPC plus the lock that serializes its turns."""
+
+    def __init__(self, npc_id, memory_path, npc):
+        self.npc_id = npc_id
+        self.memory_path = memory_path
+        self.npc = npc
+        self.lock = asyncio.Lock()
+        self.turns = 0
+        self.last_used = time.monotonic()
+
+
+class NPCServer:
+    """Hosts NPC instances and serves their conversations over a local socket."""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, speak=True):
+        self.host = host
+        self.port = port
+        self.speak = speak
+        self.sessions = {}
+        self._sessions_lock = asyncio.Lock()
+        self._server = None
+
+    # --- NPC registry ---
+    async def get_session(self, npc_id, memory_path):
+        memory_path = os.path.abspath(memory_path or DEFAULT_MEMORY)
+        async with self._sessions_lock:
+            session = self.sessions.get(memory_path)
+            if session is not None and session.npc_id != npc_id:
+                raise ValueError(f"{memory_path} is already open as NPC {session.npc_id}")
+            if session is None:
+                start = time.perf_counter()
+                # Loading memory is blocking file/database I/O.
+                npc = await asyncio.to_thread(npc4.NPC, npc_id, path_json=memory_path)
+                session = NPCSession(npc_id, memory_path, npc)
+                self.sessions[memory_path] = session
+                print(f"DEBUG: Loaded NPC {npc_id} from {memory_path} in {time.perf_counter() - start:.2f}s")
+            session.last_used = time.monotonic()
+            return session
+
+    async def close_session(self, npc_id, memory_path):
+        memory_path = os.path.abspath(memory_path or DEFAULT_MEMORY)
+        async with self._sessions_lock:
+            session = self.sessions.get(memory_path)
+            if session is None or session.npc_id != npc_id:
+                return False
+            del self.sessions[memory_path]
+        async with session.lock:
+            await asyncio.to_thread(self._close_npc, session.npc)
+        return True
+
+    @staticmethod
+    def _close_npc(npc):
+        npc.trust.wait_idle(timeout=10)
+        npc.memory.close()
+
+    # --- Turns ---
+    async def run_turn(self, session, text, send):
+        """Run one turn for `session`, sending thoughts, tokens and the final frame as they happen."""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def emit(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        def work():
+            try:
+                npc = session.npc
+                thoughts, response_stream = npc.process_player_input(text)
+                emit({"type": "thoughts", "text": thoughts or ""})
+                response = ""
+                if response_stream:
+                    response = npc4.stream_npc_response(
+                        npc, text, response_stream,
+                        on_token=lambda content: emit({"type": "token", "text": content}),
+                        write_file=False, speak_response=self.speak,
+                    )
+                emit({"type": "done", "response": response,
+                      "completed": bool(npc.data.get("conversation_completed", False))})
+            except Exception as e:
+                emit({"type": "error", "message": str(e)})
+            finally:
+                emit(None)
+
+        async with session.lock:
+            session.turns += 1
+            worker = asyncio.ensure_future(asyncio.to_thread(work))
+            try:
+                while True:
+                    event = await events.get()
+                    if event is None:
+                        break
+                    await send(event)
+            finally:
+                # Even if the client went away mid-turn, keep the lock until the turn's thread
+                # has finished with the NPC; its remaining events are just dropped.
+                await worker
+            session.last_used = time.monotonic()
+
+    # --- Connections ---
+    async def handle_client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        print(f"DEBUG: NPC client connected: {peer}")
+
+        async def send(message):
+            writer.write(encode_frame(message))
+            await writer.drain()
+
+        try:
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                try:
+                    await self.dispatch(request, send)
+                except Exception as e:
+                    await send({"type": "error", "message": str(e)})
+        except (ConnectionError, ValueError) as e:
+            print(f"DEBUG: NPC client {peer} dropped: {e}")
+        finally:
+            writer.close()
+            print(f"DEBUG: NPC client disconnected: {peer}")
+
+    async def dispatch(self, request, send):
+        op = request.get("op")
+        if op == "stats":
+            await send({"type": "ok", "npcs": [
+                {"npc_id": session.npc_id, "memory": session.memory_path, "turns": session.turns,
+                 "idle_seconds": round(time.monotonic() - session.last_used, 1)}
+                for session in list(self.sessions.values())
+            ], "llm": npc4.get_telemetry().snapshot()})
+            return
+
+        npc_id = request.get("npc_id") or "Neferkare"
+        memory_path = request.get("memory")
+        if op == "open":
+            session = await self.get_session(npc_id, memory_path)
+            await self.run_turn(session, "", send)
+        elif op == "say":
+            session = await self.get_session(npc_id, memory_path)
+            await self.run_turn(session, request.get("text", ""), send)
+        elif op == "close":
+            closed = await self.close_session(npc_id, memory_path)
+            await send({"type": "ok", "closed": closed})
+        else:
+            await send({"type": "error", "message": f"Unknown op: {op}"})
+
+    # --- Lifecycle ---
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"NPC server listening on {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def shutdown(self):
+        if self._server is not None:
+            self._server.close()
+        for memory_path, session in list(self.sessions.items()):
+            await self.close_session(session.npc_id, memory_path)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, speak=True):
+    """Run the server until interrupted; every hosted NPC's memory is closed on the way out."""
+    if speak:
+        # Load the TTS model and voice once for every NPC the server will host.
+        try:
+            npc4.KokoroEngine.shared()
+        except Exception as e:
+            print(f"Error loading TTS engine: {e}")
+
+    server = NPCServer(host, port, speak=speak)
+
+    async def main():
+        try:
+            await server.serve_forever()
+        finally:
+            await server.shutdown()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("NPC server stopped")
+
+
+class NPCClient:
+    """Small blocking client for scripts and tools talking to the server."""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=120):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self._lock = threading.Lock()
+
+    def _send(self, message):
+        self.sock.sendall(encode_frame(message))
+
+    def _recv(self):
+        return recv_frame(self.sock)
+
+    def turn(self, npc_id, text, memory=None, on_token=None):
+        """Send one player line ("" opens the conversation) and return the final "done" frame."""
+        with self._lock:
+            op = "say" if text else "open"
+            self._send({"op": op, "npc_id": npc_id, "memory": memory, "text": text})
+            while True:
+                frame = self._recv()
+                if frame["type"] == "token" and on_token:
+                    on_token(frame["text"])
+                elif frame["type"] in ("done", "error"):
+                    return frame
+
+    def request(self, message):
+        with self._lock:
+            self._send(message)
+            return self._recv()
+
+    def close(self):
+        self.sock.close()
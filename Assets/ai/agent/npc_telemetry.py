@@ -0,0 +1,363 @@
+# npc_telemetry.py
+"""
+Per-call-type telemetry for the NPC's LLM calls.
+
+Every create_backbone call is tagged with a call type (inner_thoughts, response, combined,
+greeting, extract_name, suspicious, question, reflection, final, summary, trust) and records:
+
+    - queue time (waiting for a gateway concurrency slot), time to first token, total time
+    - prompt and completion tokens, plus an estimated cost
+    - stream chunk cadence: number of chunks, mean and max gap between them
+
+Records are kept in in-process histograms (see Telemetry.snapshot) and appended as one JSON
+line each to npc_telemetry.jsonl, which rotates when it grows past NPC_TELEMETRY_MAX_BYTES.
+The summary command prints p50 / p95 / p99 per call type for a session:
+
+    python npc_telemetry.py                   # latest session
+    python npc_telemetry.py --session all
+    python npc_telemetry.py --session 20261017-101500-4242 --json
+
+Configuration (environment variables, all optional):
+    NPC_TELEMETRY_FILE       - JSONL path (default npc_telemetry.jsonl next to this file)
+    NPC_TELEMETRY_MAX_BYTES  - rotate the file past this size (default 5 MB)
+    NPC_TELEMETRY_BACKUPS    - rotated files kept (default 3)
+    NPC_TELEMETRY_SESSION    - session id (default start time and process id)
+    NPC_TELEMETRY_DISABLED   - set to 1 to turn recording off
+"""
+
+import os
+import json
+import math
+import time
+import argparse
+import threading
+import logging
+import logging.handlers
+from datetime import datetime
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "npc_telemetry.jsonl")
+METRICS = ("queue_ms", "ttft_ms", "total_ms", "prompt_tokens", "completion_tokens", "chunk_gap_ms")
+PERCENTILES = (50, 95, 99)
+
+# USD per million tokens (input, output).
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prices = PRICES.get(model)
+    if prices is None or prompt_tokens is None or completion_tokens is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class Histogram:
+    """Log-bucketed histogram: constant memory, percentiles accurate to one bucket (~10%)."""
+
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, value):
+        return int(math.floor(math.log(value, self.GROWTH))) if value >= 1 else 0
+
+    def add(self, value):
+        bucket = self._bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # Upper edge of the bucket, never above the largest value seen.
+                return min(self.GROWTH ** (bucket + 1), self.max) if bucket else min(1.0, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 2) if self.count else 0.0,
+            **{f"p{p}": round(self.percentile(p), 2) for p in PERCENTILES},
+            "max": round(self.max, 2),
+        }
+
+
+class Telemetry:
+    """Collects LLM call records for one process."""
+
+    def __init__(self, path=None, max_bytes=None, backups=None, session=None, enabled=None):
+        self.path = path or os.environ.get("NPC_TELEMETRY_FILE", DEFAULT_FILE)
+        self.session = session or os.environ.get("NPC_TELEMETRY_SESSION") or \
+            f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        if enabled is None:
+            enabled = os.environ.get("NPC_TELEMETRY_DISABLED", "0") != "1"
+        self.enabled = enabled
+        self.histograms = {}
+        self.calls = {}
+        self.cost = {}
+        self._lock = threading.Lock()
+        self._logger = None
+        if enabled:
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, encoding="utf-8",
+                maxBytes=int(max_bytes or os.environ.get("NPC_TELEMETRY_MAX_BYTES", 5 * 1024 * 1024)),
+                backupCount=int(backups if backups is not None else os.environ.get("NPC_TELEMETRY_BACKUPS", 3)),
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"npc_telemetry.{id(self)}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            self._logger.addHandler(handler)
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    # --- Recording ---
+    def record(self, call_type, model, queue_s=0.0, ttft_s=None, total_s=0.0, usage=None, chunk_gaps=None,
+               chunks=0, error=None):
+        """Store one finished call in the histograms and the JSONL file."""
+        if not self.enabled:
+            return None
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        record = {
+            "ts": time.time(),
+            "session": self.session,
+            "call_type": call_type,
+            "model": model,
+            "queue_ms": round(queue_s * 1000, 2),
+            "ttft_ms": round(ttft_s * 1000, 2) if ttft_s is not None else None,
+            "total_ms": round(total_s * 1000, 2),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens),
+            "chunks": chunks,
+            "chunk_gap_ms_mean": round(sum(chunk_gaps) / len(chunk_gaps) * 1000, 2) if chunk_gaps else None,
+            "chunk_gap_ms_max": round(max(chunk_gaps) * 1000, 2) if chunk_gaps else None,
+            "error": error,
+        }
+
+        with self._lock:
+            histograms = self.histograms.setdefault(call_type, {metric: Histogram() for metric in METRICS})
+            for metric in ("queue_ms", "ttft_ms", "total_ms", "prompt_tokens", "completion_tokens"):
+                if record[metric] is not None:
+                    histograms[metric].add(record[metric])
+            for gap in chunk_gaps or ():
+                histograms["chunk_gap_ms"].add(gap * 1000)
+            self.calls[call_type] = self.calls.get(call_type, 0) + 1
+            self.cost[call_type] = self.cost.get(call_type, 0.0) + (record["cost_usd"] or 0.0)
+            try:
+                self._logger.info(json.dumps(record))
+            except Exception as e:
+                print(f"Error writing NPC telemetry: {e}")
+
+        ttft = f", ttft {record['ttft_ms']:.0f} ms" if record["ttft_ms"] is not None else ""
+        print(f"DEBUG: LLM {call_type}: queue {record['queue_ms']:.0f} ms{ttft}, total {record['total_ms']:.0f} ms, "
+              f"tokens {prompt_tokens}/{completion_tokens}")
+        return record
+
+    def record_completion(self, call_type, model, started, timings, completion=None, error=None):
+        """Record a non-streamed call that started at `started` (perf_counter) and has just returned."""
+        total = time.perf_counter() - started
+        self.record(call_type, model, queue_s=timings.get("queue_s", 0.0), total_s=total,
+                    usage=getattr(completion, "usage", None), error=error)
+
+    def wrap_stream(self, stream, call_type, model, started, timings):
+        """Pass the chunks of `stream` through, recording the call once it is exhausted, closed or dropped."""
+        return RecordedStream(self, stream, call_type, model, started, timings)
+
+    # --- Reading ---
+    def snapshot(self):
+        """Per-call-type histogram summaries for this process."""
+        with self._lock:
+            return {
+                call_type: {
+                    "calls": self.calls.get(call_type, 0),
+                    "cost_usd": round(self.cost.get(call_type, 0.0), 6),
+                    **{metric: histogram.summary() for metric, histogram in histograms.items() if histogram.count},
+                }
+                for call_type, histograms in self.histograms.items()
+            }
+
+
+class RecordedStream:
+    """
+    Iterator over a streamed call's chunks that measures their cadence and records the call
+    exactly once: when the stream ends or fails, on close(), or when it is garbage-collected
+    without having been read (closing the underlying stream gives its gateway slot back).
+    """
+
+    def __init__(self, telemetry, stream, call_type, model, started, timings):
+        self._done = False
+        self.telemetry = telemetry
+        self.stream = stream
+        self.call_type = call_type
+        self.model = model
+        self.started = started
+        self.timings = timings
+        self.first = self.last = None
+        self.gaps = []
+        self.chunks = 0
+        self.usage = None
+        self._chunks = None
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        try:
+            if self._chunks is None:
+                self._chunks = iter(self.stream)
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self.close(error=str(e))
+            raise
+        now = time.perf_counter()
+        self.usage = getattr(chunk, "usage", None) or self.usage
+        if getattr(chunk, "choices", None):
+            if self.first is None:
+                self.first = now
+            else:
+                self.gaps.append(now - self.last)
+            self.last = now
+            self.chunks += 1
+        return chunk
+
+    def close(self, error=None):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        try:
+            close = getattr(self.stream, "close", None)
+            if close:
+                close()
+        finally:
+            self.telemetry.record(self.call_type, self.model, queue_s=self.timings.get("queue_s", 0.0),
+                                  ttft_s=self.first - self.started if self.first is not None else None,
+                                  total_s=time.perf_counter() - self.started, usage=self.usage,
+                                  chunk_gaps=self.gaps, chunks=self.chunks, error=error)
+
+    def __del__(self):
+        if not getattr(self, "_done", True):
+            self.close()
+
+
+def get_telemetry():
+    return Telemetry.shared()
+
+
+# --- Summary command ---
+def read_records(path):
+    """All records in `path` and its rotated backups, oldest first."""
+    paths = [path]
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        paths.append(f"{path}.{index}")
+        index += 1
+    records = []
+    for file_path in reversed(paths):
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+
+def summarize(records):
+    """Exact p50 / p95 / p99 per call type, from stored records."""
+    by_type = {}
+    for record in records:
+        by_type.setdefault(record["call_type"], []).append(record)
+
+    summary = {}
+    for call_type, items in sorted(by_type.items()):
+        entry = {"calls": len(items), "errors": sum(1 for item in items if item.get("error")),
+                 "cost_usd": round(sum(item.get("cost_usd") or 0.0 for item in items), 6)}
+        for metric in ("queue_ms", "ttft_ms", "total_ms", "prompt_tokens", "completion_tokens", "chunk_gap_ms_mean"):
+            values = [item[metric] for item in items if item.get(metric) is not None]
+            if values:
+                entry[metric] = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+        summary[call_type] = entry
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize NPC LLM call telemetry per call type.")
+    parser.add_argument("--file", default=os.environ.get("NPC_TELEMETRY_FILE", DEFAULT_FILE))
+    parser.add_argument("--session", default="latest", help='session id, "latest" (default) or "all"')
+    parser.add_argument("--list", action="store_true", help="list the sessions in the file")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    records = read_records(args.file)
+    if not records:
+        print(f"No telemetry found in {args.file}")
+        return
+
+    if args.list:
+        sessions = {}
+        for record in records:
+            sessions[record["session"]] = sessions.get(record["session"], 0) + 1
+        for session, calls in sessions.items():
+            print(f"{session}  {calls} calls")
+        return
+
+    session = records[-1]["session"] if args.session == "latest" else args.session
+    if session != "all":
+        records = [record for record in records if record["session"] == session]
+    summary = summarize(records)
+
+    if args.json:
+        print(json.dumps({"session": session, "call_types": summary}, indent=2))
+        return
+
+    print(f"Session: {session} ({len(records)} calls, ${sum(entry['cost_usd'] for entry in summary.values()):.4f})")
+    columns = ("queue_ms", "ttft_ms", "total_ms", "prompt_tokens", "completion_tokens", "chunk_gap_ms_mean")
+    for call_type, entry in summary.items():
+        print(f"\n[{call_type}] {entry['calls']} calls, {entry['errors']} errors, ${entry['cost_usd']:.4f}")
+        for metric in columns:
+            if metric in entry:
+                values = entry[metric]
+                print(f"  {metric:<18} p50 {values['p50']:>9.1f}   p95 {values['p95']:>9.1f}   p99 {values['p99']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# prompt_builder.py
+"""
+Token-budgeted prompt assembly for the NPC agent.
+
+Prompts used to embed the whole Conversation_History list (as Python dict reprs) plus the full
+identity / backstory / beliefs / goal text on every call, so each turn's prompt was larger than
+the last. PromptBuilder assembles prompts from:
+
+    - a compact persona block, built once per NPC
+    - a running summary of older turns, stored in NPC memory ("running_summary" and
+      "summarized_upto") and extended incrementally after each turn
+    - the last few turns verbatim, as a plain-text transcript
+
+and keeps every prompt inside a per-call-type token budget. Tokens are counted locally with
+tiktoken, or estimated at four characters per token when tiktoken is not installed.
+
+Budgets can be overridden with NPC_PROMPT_BUDGETS, e.g. "response=1200,inner_thoughts=900".
+"""
+
+import os
+import threading
+import time
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Token budget for the whole prompt of each call type.
+DEFAULT_BUDGETS = {
+    "greeting": 900,
+    "response": 1600,
+    "inner_thoughts": 1300,
+    "combined": 1800,
+    "suspicious": 700,
+    "question": 1000,
+    "reflection": 2500,
+    "summary": 1500,
+}
+
+SUMMARY_KEY = "running_summary"
+SUMMARIZED_UPTO_KEY = "summarized_upto"
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def _encoder(model=DEFAULT_MODEL):
+    """The tiktoken encoding for `model`, or None when tiktoken is unavailable."""
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    _encoders[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encoders[model] = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                print(f"DEBUG: tiktoken unavailable ({e}), estimating tokens from characters")
+                _encoders[model] = None
+        return _encoders[model]
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    if not text:
+        return 0
+    encoder = _encoder(model)
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text))
+
+
+def truncate_tokens(text, max_tokens, model=DEFAULT_MODEL):
+    """Cut `text` down to at most `max_tokens` tokens, keeping the beginning."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoder = _encoder(model)
+    if encoder is None:
+        return text[:max_tokens * 4]
+    tokens = encoder.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens]).rstrip() + "..."
+
+
+def parse_budgets(spec):
+    """Parse "call_type=tokens,call_type=tokens" on top of the defaults."""
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        call_type, tokens = item.split("=", 1)
+        try:
+            budgets[call_type.strip()] = max(100, int(tokens))
+        except ValueError:
+            continue
+    return budgets
+
+
+def format_turns(entries, npc_name):
+    """Render Conversation_History entries as a plain-text transcript."""
+    lines = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        if entry.get("player_message"):
+            lines.append(f"Player: {entry['player_message']}")
+        if entry.get("npc_response"):
+            lines.append(f"{npc_name}: {entry['npc_response']}")
+    return "\n".join(lines)
+
+
+class PromptBuilder:
+    """Builds NPC prompts inside a token budget from a persona block, a running summary and recent turns."""
+
+    def __init__(self, npc, keep_turns=4, budgets=None, model=DEFAULT_MODEL):
+        self.npc = npc
+        self.keep_turns = keep_turns
+        self.budgets = budgets or parse_budgets(os.environ.get("NPC_PROMPT_BUDGETS", ""))
+        self.model = model
+        self._persona = None
+        self._summary_lock = threading.Lock()
+
+    # --- Building blocks ---
+    def persona(self):
+        """Identity, backstory, beliefs, situation and goal as one block (built once)."""
+        if self._persona is None:
+            npc = self.npc
+            fields = [
+                ("Identity", npc.identity),
+                ("Backstory", npc.backstory),
+                ("Beliefs", npc.belief),
+                ("Situation", npc.status),
+                ("Goal", npc.goal),
+            ]
+            self._persona = "\n".join(f"{label}: {value}" for label, value in fields if value)
+        return self._persona
+
+    def relationships(self):
+        """One line per relationship; only the player's entry keeps its description."""
+        lines = []
+        for name, relationship in (self.npc.relationships or {}).items():
+            line = f"- {name} ({relationship.get('type', 'unknown')})"
+            if relationship.get("type") == "Not Determined Yet":
+                line += f": {relationship.get('description', '')}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def history(self, max_tokens):
+        """The running summary plus as many of the last `keep_turns` turns as fit in `max_tokens`."""
+        memory = self.npc.memory
+        with memory.lock:
+            conversation = list(memory.data.get("Conversation_History", []))
+            summary = memory.data.get(SUMMARY_KEY, "")
+            summarized_upto = memory.data.get(SUMMARIZED_UPTO_KEY, 0)
+
+        # Turns not folded into the summary yet are kept verbatim even if that is more than
+        # keep_turns (the summary catches up in the background).
+        recent = conversation[min(summarized_upto, max(0, len(conversation) - self.keep_turns)):]
+
+        parts = []
+        used = 0
+        if summary:
+            summary_text = "Earlier in this conversation: " + summary
+            summary_text = truncate_tokens(summary_text, max_tokens // 3, self.model)
+            parts.append(summary_text)
+            used += count_tokens(summary_text, self.model)
+
+        kept = []
+        for entry in reversed(recent):
+            turn = format_turns([entry], self.npc.name)
+            cost = count_tokens(turn, self.model) + 1
+            if used + cost > max_tokens:
+                break
+            kept.append(turn)
+            used += cost
+        parts.extend(reversed(kept))
+        return "\n".join(parts) if parts else "(no conversation yet)"
+
+    # --- Prompt assembly ---
+    def build(self, call_type, template, **fields):
+        """
+        Fill `template`. `{persona}`, `{relationships}` and `{history}` are provided by the
+        builder; history gets whatever is left of the call type's budget after everything else.
+        """
+        budget = self.budgets.get(call_type, DEFAULT_BUDGETS["response"])
+        fields.setdefault("persona", self.persona())
+        fields.setdefault("relationships", self.relationships())
+
+        fixed = template.format(history="", **fields)
+        remaining = budget - count_tokens(fixed, self.model)
+        if remaining < 50:
+            print(f"DEBUG: {call_type} prompt is {budget - remaining} tokens before history, over its {budget} budget")
+            remaining = 50
+
+        prompt = template.format(history=self.history(remaining), **fields)
+        print(f"DEBUG: {call_type} prompt: {count_tokens(prompt, self.model)}/{budget} tokens")
+        return prompt
+
+    # --- Running summary ---
+    def pending_turns(self):
+        """How many turns have dropped out of the verbatim window without being summarized."""
+        memory = self.npc.memory
+        with memory.lock:
+            total = len(memory.data.get("Conversation_History", []))
+            summarized_upto = memory.data.get(SUMMARIZED_UPTO_KEY, 0)
+        return max(0, total - self.keep_turns - summarized_upto)
+
+    def update_summary(self):
+        """Fold turns that left the verbatim window into the running summary (one LLM call)."""
+        if not self._summary_lock.acquire(blocking=False):
+            return False
+        try:
+            memory = self.npc.memory
+            with memory.lock:
+                conversation = list(memory.data.get("Conversation_History", []))
+                summary = memory.data.get(SUMMARY_KEY, "")
+                summarized_upto = memory.data.get(SUMMARIZED_UPTO_KEY, 0)
+
+            upto = len(conversation) - self.keep_turns
+            if upto <= summarized_upto:
+                return False
+
+            start = time.perf_counter()
+
+            def render(summary_text, new_turns):
+                return f"""You keep {self.npc.name}'s memory of a conversation with the stranger who rescued him.
+Summary so far:
+{summary_text}
+
+New exchanges:
+{new_turns}
+
+Rewrite the summary to include the new exchanges. Keep names, claims the stranger made about
+themselves, promises, anything suspicious, and what {self.npc.name} revealed. At most 120 words,
+plain prose, no preamble."""
+
+            # The budget is spent on the summary and the turns, never on the closing instructions.
+            budget = self.budgets.get("summary", DEFAULT_BUDGETS["summary"]) - count_tokens(render("", ""), self.model)
+            summary_text = truncate_tokens(summary or "(nothing yet)", budget // 3, self.model)
+            budget -= count_tokens(summary_text, self.model)
+
+            # Fold in as many whole turns as fit; the rest wait for the next update.
+            fitted, used = [], 0
+            for entry in conversation[summarized_upto:upto]:
+                text = format_turns([entry], self.npc.name)
+                cost = count_tokens(text, self.model) + 1
+                if used + cost > budget:
+                    if not fitted:
+                        # A single turn larger than the budget: fold in its beginning rather than stall.
+                        fitted.append(truncate_tokens(text, budget, self.model))
+                    break
+                fitted.append(text)
+                used += cost
+            upto = summarized_upto + len(fitted)
+            new_turns = "\n".join(text for text in fitted if text)
+
+            try:
+                new_summary = self.npc.create_backbone(message=render(summary_text, new_turns), role="user",
+                                                       call_type="summary", raise_errors=True).strip()
+            except Exception as e:
+                # Keep the old summary and position; these turns are folded in on the next update.
+                print(f"Error updating conversation summary, will retry: {e}")
+                return False
+            if not new_summary:
+                return False
+
+            with memory.lock:
+                memory.set(SUMMARY_KEY, new_summary)
+                memory.set(SUMMARIZED_UPTO_KEY, upto)
+            print(f"DEBUG: Summarized turns {summarized_upto}-{upto} in {time.perf_counter() - start:.2f}s")
+            return True
+        finally:
+            self._summary_lock.release()
+
+    def update_summary_in_background(self):
+        """Start update_summary() on a daemon thread if any turns are waiting to be folded in."""
+        if self.pending_turns() <= 0:
+            return None
+        thread = threading.Thread(target=self._update_summary_safely, name="npc-summary", daemon=True)
+        thread.start()
+        return thread
+
+    def _update_summary_safely(self):
+        try:
+            self.update_summary()
+        except Exception as e:
+            print(f"Error updating conversation summary: {e}")
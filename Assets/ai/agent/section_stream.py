@@ -0,0 +1,143 @@
+# section_stream.py
+"""
+Incremental parser for the NPC's sectioned output format:
+
+    [INNER THOUGHTS: private analysis the player never hears]
+    [SPOKEN: what the NPC says out loud]
+
+Tokens are fed in as they stream from the model. feed() returns (section, text) pieces as soon
+as they are known to belong to a section, so spoken text can be printed and voiced while the
+model is still writing. A header split across tokens ("[INN" + "ER THOUGHTS:") is held back
+until it can be recognized. Markdown emphasis around a header ("**[SPOKEN: ...]**") is ignored.
+Text outside any section is treated as spoken until a spoken section has been closed, whether the
+model ignores the format entirely or writes its reply without a header after the thoughts.
+"""
+
+import re
+
+THOUGHTS = "thoughts"
+SPOKEN = "spoken"
+
+HEADERS = {
+    "INNER THOUGHTS": THOUGHTS,
+    "SPOKEN": SPOKEN,
+}
+# Markdown emphasis the model sometimes wraps headers in ("**[SPOKEN: ...]**", "[**SPOKEN:** ...]").
+WRAPPERS = "*_"
+HEADER_PATTERN = re.compile(r'\[\s*[*_]*\s*(INNER THOUGHTS|SPOKEN)\s*[*_]*\s*:\s*(?:[*_]+\s+)?', re.IGNORECASE)
+# Longest text that could still turn into a header once more tokens arrive.
+MAX_HEADER_LENGTH = len("[ __INNER THOUGHTS__ : ")
+
+
+class SectionStreamParser:
+    """Splits a streamed completion into inner-thoughts and spoken pieces."""
+
+    def __init__(self):
+        self.section = None
+        self.closed = set()
+        self.text = {THOUGHTS: "", SPOKEN: ""}
+        self._pending = ""
+        self._depth = 0
+
+    def feed(self, chunk):
+        """Consume one streamed fragment and return the (section, text) pieces it completes."""
+        self._pending += chunk
+        pieces = []
+        while self._pending:
+            if self.section is None:
+                if not self._parse_header(pieces):
+                    break
+            elif not self._parse_body(pieces):
+                break
+        return pieces
+
+    def finish(self):
+        """Flush whatever is left once the stream has ended (e.g. a missing closing bracket)."""
+        pieces = []
+        rest = self._pending
+        self._pending = ""
+        match = HEADER_PATTERN.search(rest) if self.section is None else None
+        if match:
+            self.section = HEADERS[match.group(1).upper()]
+            rest = rest[match.end():].lstrip(WRAPPERS)
+        if self.section is None:
+            rest = rest.strip()
+            if rest.strip(WRAPPERS + " \t\r\n") and SPOKEN not in self.closed:
+                # The model ignored the format: whatever it wrote is the reply.
+                self._emit(SPOKEN, rest, pieces)
+        elif rest:
+            self._emit(self.section, rest.rstrip().rstrip("]"), pieces)
+        if self.section is not None:
+            self.closed.add(self.section)
+            self.section = None
+        return pieces
+
+    def thoughts(self):
+        return self.text[THOUGHTS].strip()
+
+    def spoken(self):
+        return self.text[SPOKEN].strip()
+
+    def _parse_header(self, pieces):
+        """Outside a section: look for the next header. Returns False when more input is needed."""
+        match = HEADER_PATTERN.search(self._pending)
+        if match:
+            if not self._pending[match.end():].strip(WRAPPERS):
+                # "[**SPOKEN:" may still be followed by its closing "** "; wait for the text.
+                return False
+            self._pending = self._pending[match.end():]
+            self.section = HEADERS[match.group(1).upper()]
+            return True
+
+        bracket = self._pending.rfind("[")
+        if bracket != -1 and len(self._pending) - bracket < MAX_HEADER_LENGTH:
+            # Might be the start of a header; wait for more tokens.
+            leading, held = self._pending[:bracket], self._pending[bracket:]
+        else:
+            leading, held = self._pending, ""
+
+        if not leading.strip(WRAPPERS + " \t\r\n"):
+            # Only whitespace or emphasis markers so far, possibly opening a "**[HEADER:"; wait.
+            return False
+        if SPOKEN not in self.closed:
+            # Unheaded text: either the model is not using the format at all, or it wrote its
+            # reply without a [SPOKEN:] header after the thoughts.
+            self.section = SPOKEN
+            self._pending = leading.lstrip() + held
+            return True
+        # Stray text after the reply has been spoken is dropped.
+        self._pending = held
+        return False
+
+    def _parse_body(self, pieces):
+        """Inside a section: emit text up to the closing bracket. Returns False when more input is needed."""
+        # Brackets opened inside the section ("[sighs]") are matched before the closing one.
+        end = -1
+        for index, char in enumerate(self._pending):
+            if char == "[":
+                self._depth += 1
+            elif char == "]":
+                if self._depth == 0:
+                    end = index
+                    break
+                self._depth -= 1
+        if end == -1:
+            self._emit(self.section, self._pending, pieces)
+            self._pending = ""
+            return False
+
+        self._emit(self.section, self._pending[:end], pieces)
+        self._pending = self._pending[end + 1:]
+        self.closed.add(self.section)
+        self.section = None
+        return True
+
+    def _emit(self, section, text, pieces):
+        if not text:
+            return
+        if not self.text[section]:
+            text = text.lstrip()
+            if not text:
+                return
+        self.text[section] += text
+        pieces.append((section, text))
@@ -0,0 +1,62 @@
+# test_section_stream.py
+import pytest
+
+from section_stream import SectionStreamParser, THOUGHTS, SPOKEN
+
+
+def parse(text, step=None):
+    """Feed `text` whole, or `step` characters at a time like a token stream."""
+    parser = SectionStreamParser()
+    chunks = [text] if step is None else [text[i:i + step] for i in range(0, len(text), step)]
+    pieces = []
+    for chunk in chunks:
+        pieces += parser.feed(chunk)
+    pieces += parser.finish()
+    return parser, pieces
+
+
+@pytest.mark.parametrize("step", [None, 1, 3])
+def test_headed_sections(step):
+    parser, _ = parse("[INNER THOUGHTS: He hides something.]\n[SPOKEN: Welcome, traveler.]", step)
+    assert parser.thoughts() == "He hides something."
+    assert parser.spoken() == "Welcome, traveler."
+
+
+@pytest.mark.parametrize("step", [None, 1, 3])
+def test_unheaded_reply_after_thoughts_is_spoken(step):
+    parser, pieces = parse("[INNER THOUGHTS: He hides something.]\nHello there.", step)
+    assert parser.thoughts() == "He hides something."
+    assert parser.spoken() == "Hello there."
+    assert all(section == SPOKEN for section, text in pieces if "Hello" in text)
+
+
+@pytest.mark.parametrize("step", [None, 1, 3])
+@pytest.mark.parametrize("text", [
+    "**[INNER THOUGHTS: He hides something.]**\n**[SPOKEN: Hello there.]**",
+    "__[INNER THOUGHTS: He hides something.]__\n__[SPOKEN: Hello there.]__",
+    "[**INNER THOUGHTS:** He hides something.]\n[**SPOKEN:** Hello there.]",
+])
+def test_markdown_wrapped_headers(text, step):
+    parser, pieces = parse(text, step)
+    assert parser.thoughts() == "He hides something."
+    assert parser.spoken() == "Hello there."
+    # Inner thoughts never reach the display or TTS.
+    assert "hides" not in "".join(text for section, text in pieces if section == SPOKEN)
+
+
+@pytest.mark.parametrize("step", [None, 1])
+def test_unformatted_reply_is_spoken(step):
+    parser, _ = parse("*bows* Welcome to Thebes [sighs], stranger.", step)
+    assert parser.thoughts() == ""
+    assert parser.spoken() == "*bows* Welcome to Thebes [sighs], stranger."
+
+
+def test_text_after_spoken_section_is_dropped():
+    parser, _ = parse("[SPOKEN: Leave now.] (end of reply)")
+    assert parser.spoken() == "Leave now."
+
+
+def test_missing_closing_bracket():
+    parser, pieces = parse("[INNER THOUGHTS: hmm]\n[SPOKEN: Go on")
+    assert parser.spoken() == "Go on"
+    assert (THOUGHTS, "hmm") in pieces
@@ -0,0 +1,164 @@
+# trust_reflection.py
+"""
+Incremental trust reflection for the NPC's final decision.
+
+Instead of one long reflection over the whole conversation on the final turn, a background
+worker folds every finished exchange into a running trust assessment stored in NPC memory:
+
+    "trust_assessment": {"score": 0-100, "rationale": "...", "turns_assessed": 5, "updated_at": "..."}
+
+Each update is one short LLM call made off the critical path, right after the reply has been
+streamed. On the final turn the decision is just a read of that state (Ally when the score
+reaches NPC_TRUST_THRESHOLD, default 60), so only the final spoken reply stays on the player's
+critical path. An exchange whose update failed (API error or an unreadable reply) is not
+counted, so a conversation nothing could be assessed on falls back to the full reflection.
+"""
+
+import os
+import re
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+
+ASSESSMENT_KEY = "trust_assessment"
+DEFAULT_THRESHOLD = 60
+
+INITIAL_ASSESSMENT = {
+    "score": 50,
+    "rationale": "They saved my life and healed my leg, but I know nothing else about them yet.",
+    "turns_assessed": 0,
+}
+
+
+def parse_assessment(text, previous):
+    """Read {"score": .., "rationale": ..} from a model reply; None when it holds no score."""
+    match = re.search(r'\{.*\}', text or "", re.DOTALL)
+    if match:
+        try:
+            parsed = json.loads(match.group(0))
+            score = int(parsed.get("score", previous["score"]))
+            rationale = str(parsed.get("rationale", "")).strip() or previous["rationale"]
+            return max(0, min(100, score)), rationale
+        except (ValueError, TypeError):
+            pass
+    score_match = re.search(r'score\D{0,5}(\d{1,3})', text or "", re.IGNORECASE)
+    if score_match:
+        return max(0, min(100, int(score_match.group(1)))), previous["rationale"]
+    return None
+
+
+class TrustReflector:
+    """Keeps the NPC's trust assessment of the player up to date in the background."""
+
+    def __init__(self, npc, threshold=None):
+        self.npc = npc
+        self.threshold = threshold if threshold is not None else int(os.environ.get("NPC_TRUST_THRESHOLD", DEFAULT_THRESHOLD))
+        self._exchanges = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._worker = None
+
+    # --- State ---
+    def assessment(self):
+        with self.npc.memory.lock:
+            current = self.npc.memory.data.get(ASSESSMENT_KEY)
+        return dict(current) if current else dict(INITIAL_ASSESSMENT)
+
+    def decision(self):
+        """Ally or Enemy from the current assessment; no LLM call."""
+        return "Ally" if self.assessment()["score"] >= self.threshold else "Enemy"
+
+    def turns_assessed(self):
+        return self.assessment().get("turns_assessed", 0)
+
+    # --- Updates ---
+    def update_in_background(self, player_message, npc_response):
+        """Queue the exchange that just finished; the worker folds it into the assessment."""
+        with self._idle:
+            self._pending += 1
+        self._exchanges.put((player_message, npc_response))
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="trust-reflection", daemon=True)
+            self._worker.start()
+
+    def wait_idle(self, timeout=None):
+        """Wait for queued updates to finish. Returns False if they are still running at the timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            exchanges = [self._exchanges.get()]
+            # Exchanges that piled up while the last update ran are folded in with one call.
+            while True:
+                try:
+                    exchanges.append(self._exchanges.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.update(exchanges)
+            except Exception as e:
+                print(f"Error updating trust assessment: {e}")
+            finally:
+                with self._idle:
+                    self._pending -= len(exchanges)
+                    self._idle.notify_all()
+
+    def update(self, exchanges):
+        """
+        Fold `exchanges` ([(player_message, npc_response), ...]) into the assessment (one LLM call).
+        Returns the new assessment, or None when the call failed and nothing was stored.
+        """
+        npc = self.npc
+        start = time.perf_counter()
+        previous = self.assessment()
+
+        thoughts = {entry.get("player_message"): entry.get("inner_thoughts")
+                    for entry in npc.memory.recent("inner_thoughts", len(exchanges) + 2)}
+        suspicions = {entry.get("suspicious_message"): entry.get("reason")
+                      for entry in npc.memory.recent("suspicious", len(exchanges) + 2)}
+
+        transcript = ""
+        for player_message, npc_response in exchanges:
+            transcript += f"Player: {player_message}\n{npc.name}: {npc_response}\n"
+            if thoughts.get(player_message):
+                transcript += f"({npc.name} thought: {thoughts[player_message]})\n"
+            if suspicions.get(player_message):
+                transcript += f"(Suspicious: {suspicions[player_message]})\n"
+
+        prompt = f"""You are {npc.name}, a trader carrying proof of High Priest Pamiu's conspiracy against the pharaoh.
+You are deciding whether the stranger who rescued you can be trusted to deliver your scroll to Kemet.
+
+Your assessment so far (after {previous.get('turns_assessed', 0)} exchanges):
+Trust score: {previous['score']}/100
+Rationale: {previous['rationale']}
+
+Newest exchange:
+{transcript}
+Update the assessment. Raise the score for genuine concern for you, respect for Ma'at and
+consistent answers; lower it for suspicious questions about your mission, knowledge they should
+not have, evasiveness or signs of working for Pamiu. Move the score gradually.
+Reply with JSON only: {{"score": <0-100>, "rationale": "<2-3 sentences covering the whole conversation>"}}"""
+
+        try:
+            reply = npc.create_backbone(message=prompt, role="user", call_type="trust", raise_errors=True)
+        except Exception as e:
+            print(f"Error updating trust assessment, {len(exchanges)} exchange(s) not assessed: {e}")
+            return None
+        parsed = parse_assessment(reply, previous)
+        if parsed is None:
+            print(f"DEBUG: Unreadable trust assessment, {len(exchanges)} exchange(s) not assessed: {reply!r}")
+            return None
+        score, rationale = parsed
+        assessment = {
+            "score": score,
+            "rationale": rationale,
+            "turns_assessed": previous.get("turns_assessed", 0) + len(exchanges),
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        npc.memory.set(ASSESSMENT_KEY, assessment)
+        print(f"DEBUG: Trust {previous['score']} -> {score} after {assessment['turns_assessed']} exchanges "
+              f"({time.perf_counter() - start:.2f}s)")
+        return assessment
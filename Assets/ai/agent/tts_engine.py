@@ -0,0 +1,163 @@
+# tts_engine.py
+"""
+Resident Kokoro TTS engine for NPC replies.
+
+The Kokoro pipeline and the `am_onyx` voice are loaded once per process and reused for every
+reply. Text is synthesized in memory, sentence by sentence: SentenceSpeaker collects streamed
+LLM tokens, cuts them at sentence boundaries and hands each finished sentence to a worker
+thread, so the first sentence is being spoken while the model is still writing the rest.
+Phonemes for sentences that come up again ("Ma'at guide you", greetings, refusals) are served
+from an LRU cache instead of running grapheme-to-phoneme conversion again. Audio goes to the
+shared gapless AudioOutputQueue.
+"""
+
+import os
+import sys
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from audio_output import AudioOutputQueue
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sentence_split import split_sentences, split_text
+
+SAMPLE_RATE = 24000
+DEFAULT_VOICE = "am_onyx"
+
+class KokoroEngine:
+    """Kokoro pipeline kept resident, with a phoneme cache for repeated phrases."""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, lang_code="a", repo_id="hexgrad/Kokoro-82M", voice=DEFAULT_VOICE, cache_size=512):
+        from kokoro import KPipeline
+
+        start = time.perf_counter()
+        self.pipeline = KPipeline(lang_code=lang_code, repo_id=repo_id)  # "a" = auto-detect
+        self.voice = voice
+        # Loading the voice pack up front keeps the first reply from paying for it.
+        self.pipeline.load_voice(voice)
+        self.cache_size = cache_size
+        self._phonemes = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        print(f"Kokoro engine loaded in {time.perf_counter() - start:.2f}s")
+
+    @classmethod
+    def shared(cls):
+        """The process-wide engine, loaded on first use."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _phonemize(self, sentence):
+        key = sentence.strip().lower()
+        with self._lock:
+            phonemes = self._phonemes.get(key)
+            if phonemes is not None:
+                self._phonemes.move_to_end(key)
+                self.cache_hits += 1
+                return phonemes
+
+        phonemes, _ = self.pipeline.g2p(sentence)
+        with self._lock:
+            self.cache_misses += 1
+            self._phonemes[key] = phonemes
+            if len(self._phonemes) > self.cache_size:
+                self._phonemes.popitem(last=False)
+        return phonemes
+
+    def synthesize(self, sentence):
+        """Yield float32 audio chunks for one sentence."""
+        phonemes = self._phonemize(sentence)
+        for result in self.pipeline.generate_from_tokens(phonemes, voice=self.voice):
+            audio = result.audio
+            if audio is None:
+                continue
+            if not isinstance(audio, np.ndarray):
+                audio = audio.cpu().numpy()
+            audio = audio.astype(np.float32)
+            audio /= np.max(np.abs(audio) + 1e-9)  # normalize safely
+            yield audio
+
+    def synthesize_text(self, text):
+        """Yield audio chunks for a whole text, sentence by sentence."""
+        for sentence in split_text(text):
+            yield from self.synthesize(sentence)
+
+
+class SentenceSpeaker:
+    """
+    Turns a stream of text fragments into speech as soon as each sentence is complete.
+
+    feed() is called with every streamed token; finish() queues whatever is left once the
+    last sentence has been synthesized. By default audio goes to the shared output queue, which
+    keeps playing after finish() returns unless wait=True. The speaker holds the queue's
+    producer_lock from its first chunk to its last, so concurrent speakers take turns.
+    """
+
+    def __init__(self, engine=None, output=None, sink=None):
+        self.engine = engine or KokoroEngine.shared()
+        self.output = output or (None if sink else AudioOutputQueue.shared())
+        self.sink = sink or self.output.write
+        self._buffer = ""
+        self._sentences = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="tts-speaker", daemon=True)
+        self._worker.start()
+
+    def feed(self, text):
+        self._buffer += text
+        sentences, self._buffer = split_sentences(self._buffer)
+        for sentence in sentences:
+            self._sentences.put(sentence)
+
+    def finish(self, wait=False):
+        if self._buffer.strip():
+            self._sentences.put(self._buffer.strip())
+        self._buffer = ""
+        self._sentences.put(None)
+        self._worker.join()
+        if self.output and wait:
+            self.output.wait_until_drained()
+
+    def _run(self):
+        holding = False
+        try:
+            while True:
+                sentence = self._sentences.get()
+                if sentence is None:
+                    break
+                try:
+                    for i, audio in enumerate(self.engine.synthesize(sentence)):
+                        if self.output and not holding:
+                            # Taken at the first chunk, so synthesis can start while another speaker plays.
+                            self.output.producer_lock.acquire()
+                            holding = True
+                        print(f"[TTS] '{sentence[:40]}' chunk {i+1} ({len(audio)} samples)")
+                        self.sink(audio)
+                except Exception as e:
+                    print(f"Error synthesizing speech: {e}")
+        finally:
+            if holding:
+                self.output.end_utterance()
+                self.output.producer_lock.release()
+
+
+def speak(text, engine=None, wait=True):
+    """Speak a complete text with the shared engine and, by default, wait until it has played."""
+    speaker = SentenceSpeaker(engine=engine)
+    speaker.feed(text)
+    speaker.finish(wait=wait)
+
+
+def interrupt():
+    """Cut off whatever the NPC is currently saying."""
+    if AudioOutputQueue._instance is not None:
+        AudioOutputQueue._instance.flush()
@@ -0,0 +1,180 @@
+# turn_planner.py
+"""
+Asyncio turn planner for the NPC agent.
+
+A player turn is described as a small dependency graph of steps (name extraction, suspicion
+check, inner thoughts, response stream). Every step starts as soon as the steps it depends on
+have finished, so independent LLM calls overlap instead of running back to back. The NPC
+methods are blocking, so each step runs in a worker thread; the shared LLM gateway bounds how
+many of them hit the API at once.
+"""
+
+import asyncio
+import threading
+import time
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _planner_loop():
+    """Event loop on a daemon thread; background steps keep running on it after a turn returns."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="turn-planner", daemon=True).start()
+        return _loop
+
+
+class Step:
+    """One node of the turn graph: a callable plus the names of the steps it needs."""
+
+    def __init__(self, name, func, depends_on=(), optional=False, background=False):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        # Optional steps may fail without failing the turn; their result becomes None.
+        self.optional = optional
+        # Background steps are not waited for: the turn returns once every other step is done.
+        self.background = background
+
+
+class TurnPlanner:
+    """Runs a set of steps concurrently while respecting their dependencies."""
+
+    def __init__(self, steps):
+        self.steps = {step.name: step for step in steps}
+        self.results = {}
+        self.timings = {}
+        self.wall_time = 0.0
+        self._validate()
+
+    def _validate(self):
+        for step in self.steps.values():
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step '{step.name}' depends on unknown step '{dependency}'")
+                if self.steps[dependency].background and not step.background:
+                    raise ValueError(f"Step '{step.name}' cannot depend on background step '{dependency}'")
+
+    async def _run_step(self, step, tasks, turn_start):
+        if step.depends_on:
+            await asyncio.gather(*(tasks[name] for name in step.depends_on))
+        inputs = {name: self.results.get(name) for name in step.depends_on}
+
+        started = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(step.func, **inputs)
+        except Exception as e:
+            if not step.optional:
+                raise
+            print(f"DEBUG: Optional step '{step.name}' failed: {e}")
+            result = None
+        finished = time.perf_counter()
+
+        self.results[step.name] = result
+        self.timings[step.name] = {
+            "start": started - turn_start,
+            "duration": finished - started,
+            "end": finished - turn_start,
+        }
+        return result
+
+    async def run_async(self):
+        turn_start = time.perf_counter()
+        tasks = {}
+        # Tasks are created in dependency order so a step can await the tasks it depends on.
+        for step in self._ordered_steps():
+            tasks[step.name] = asyncio.create_task(self._run_step(step, tasks, turn_start))
+        await asyncio.gather(*(task for name, task in tasks.items() if not self.steps[name].background))
+        self.wall_time = time.perf_counter() - turn_start
+        return self.results
+
+    def run(self):
+        """Run the plan from synchronous code and return once the foreground steps are done."""
+        return asyncio.run_coroutine_threadsafe(self.run_async(), _planner_loop()).result()
+
+    def _ordered_steps(self):
+        ordered, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle detected at step '{name}'")
+            visiting.add(name)
+            for dependency in self.steps[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+            ordered.append(self.steps[name])
+
+        for name in self.steps:
+            visit(name)
+        return ordered
+
+    def report(self):
+        """Per-step timings and how much wall-clock time the overlap saved."""
+        serial_time = sum(timing["duration"] for timing in list(self.timings.values()))
+        lines = [f"Turn plan: {self.wall_time:.2f}s wall, {serial_time:.2f}s if run serially"]
+        for name, timing in sorted(list(self.timings.items()), key=lambda item: item[1]["start"]):
+            lines.append(f"  {name:<20} start {timing['start']:.2f}s  took {timing['duration']:.2f}s")
+        for name in self.steps:
+            if name not in self.timings:
+                lines.append(f"  {name:<20} still running in the background")
+        return "\n".join(lines)
+
+
+def plan_npc_turn(npc, player_message, screen_suspicious=True, combined=False):
+    """
+    Build the dependency graph for a normal conversation turn.
+
+    Name extraction (only while the NPC is waiting for a name) and the suspicion check run
+    alongside inner-thought generation. The response stream needs the inner thoughts and the
+    player's name, and is opened as soon as both are ready. The suspicion check is a background
+    step, so a slow check never delays the reply.
+
+    With `combined`, inner thoughts and the reply come from one streamed completion: a single
+    "turn" step (after name extraction) returns the (inner_thoughts, response_stream) pair.
+    """
+    steps = []
+    response_inputs = ["inner_thoughts"]
+
+    if npc.conversation_stage == "awaiting_name":
+        def extract_name():
+            possible_name = npc.extract_name(player_message)
+            if possible_name:
+                npc.modify_json_memory_for_protagonist(possible_name)
+                print(f"\n(System: Player identified as {possible_name})")
+                npc.conversation_stage = "post_introduction"
+            return possible_name
+
+        steps.append(Step("extract_name", extract_name))
+        response_inputs.append("extract_name")
+
+    if screen_suspicious:
+        steps.append(Step("check_for_suspicious", lambda: npc.check_for_suspicious(player_message),
+                          optional=True, background=True))
+
+    if combined:
+        def open_turn(**inputs):
+            name_context = ""
+            if "extract_name" in inputs:
+                if inputs["extract_name"]:
+                    name_context = f"The stranger just told me their name is {inputs['extract_name']}."
+                else:
+                    name_context = "The stranger avoided telling me their name, which is suspicious."
+                    npc.conversation_stage = "suspicious_of_player"
+            return npc.generate_thoughts_and_response(player_message, name_context)
+
+        steps.append(Step("turn", open_turn, depends_on=response_inputs[1:]))
+        return TurnPlanner(steps)
+
+    steps.append(Step("inner_thoughts", lambda: npc.generate_inner_thoughts(player_message)))
+
+    def open_response(inner_thoughts, **_):
+        return npc.generate_response(player_message, inner_thoughts)
+
+    steps.append(Step("response", open_response, depends_on=response_inputs))
+    return TurnPlanner(steps)
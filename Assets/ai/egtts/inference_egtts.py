@@ -1,5 +1,10 @@
+import os
+import sys
 import requests
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from message_bus import BusPublisher, subscribe
+
 # FastAPI server URL
 FASTAPI_URL = "http://127.0.0.1:8002"  # Or the IP address where your server is running
 
@@ -7,18 +12,30 @@ FASTAPI_URL = "http://127.0.0.1:8002"  # Or the IP address where your server is
 TEXT_FILE_PATH = "C:/Developer/Unity Projects/ChronoRelic/Assets/ai/gbt/gbt_output.txt"
 AUDIO_OUTPUT_PATH = "C:/Developer/Unity Projects/ChronoRelic/Assets/ai/egtts/egtts_output.wav"
 
+# Audio is published on the message bus in chunks of this many bytes; the WAV file is still written.
+AUDIO_CHUNK_BYTES = 32 * 1024
+bus = BusPublisher("egtts")
+
+def publish_audio(audio_bytes):
+    """Publish the synthesized WAV on the message bus as audio_chunk events followed by done."""
+    for seq, start in enumerate(range(0, len(audio_bytes), AUDIO_CHUNK_BYTES)):
+        bus.audio_chunk(audio_bytes[start:start + AUDIO_CHUNK_BYTES], seq=seq, audio_format="wav")
+    bus.done(path=AUDIO_OUTPUT_PATH, bytes=len(audio_bytes))
+
 def perform_inference(text_content: str):
     """
     Sends the text content to the FastAPI server for inference and saves the audio.
     """
     headers = {"Content-Type": "application/json"}
     payload = {"text": text_content}
+    response = None
 
     print(f"Sending text for inference to {FASTAPI_URL}/infer...")
     try:
         response = requests.post(f"{FASTAPI_URL}/infer", headers=headers, json=payload)
         response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
 
+        publish_audio(response.content)
         with open(AUDIO_OUTPUT_PATH, "wb") as f:
             f.write(response.content)
         print(f"Audio successfully saved to {AUDIO_OUTPUT_PATH}")
@@ -32,7 +49,18 @@ def perform_inference(text_content: str):
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+def run_from_bus():
+    """Synthesize every Hemdan response as soon as it is published, instead of reading gbt_output.txt"""
+    print("Waiting for Hemdan responses on the message bus...")
+    for event in subscribe(["hemdan"]):
+        if event.get("type") == "done" and event.get("text"):
+            perform_inference(event["text"])
+
 if __name__ == "__main__":
+    if "--from-bus" in sys.argv:
+        run_from_bus()
+        sys.exit(0)
+
     try:
         with open(TEXT_FILE_PATH, "r", encoding="utf-8") as f:
             text_to_infer = f.read().strip()
@@ -47,4 +75,4 @@ if __name__ == "__main__":
     if text_to_infer:
         perform_inference(text_to_infer)
     else:
-        print("No text to infer. Please check the text file.")
\ No newline at end of file
+        print("No text to infer. Please check the text file.")
@@ -0,0 +1,161 @@
+# bench_retrieval.py
+"""
+Latency and recall of Hemdan's lore retrieval: vector-only against hybrid BM25 + vector.
+
+The lore file is chunked into an in-memory Chroma collection (embeddings go through the
+embedding cache, so only the first run calls the API). Every query is then answered by both
+modes and each returned chunk is judged relevant when it contains one of the query's expected
+terms. The report lists, per mode, mean/p50/p95 latency and mean recall@k, plus how often the
+hybrid retriever took the lexical-only fast path and so made no embedding call.
+
+    python bench_retrieval.py
+    python bench_retrieval.py --queries my_queries.json --k 3 --runs 5 --no-embedding-cache
+
+A queries file is a list of {"query": "...", "expected": ["term", ...]}; expected terms are
+matched case-insensitively against the lore chunks. Pass --no-embedding-cache to measure the
+query embedding round-trip the fast path saves.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Any, Dict, List
+
+import chromadb
+from dotenv import load_dotenv
+
+from rag_system import OpenAIEmbeddingFunction
+from lore_ingest import chunk_lore, chunk_id, ingest_chunks
+from lexical_index import HybridRetriever
+
+DEFAULT_LORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lore.txt")
+
+# Questions players ask Hemdan, with the lore terms a useful answer has to contain.
+DEFAULT_QUERIES = [
+    {"query": "يعني ايه الأنخ؟", "expected": ["ankh"]},
+    {"query": "احنا دورنا على العنخ فين قبل كده؟", "expected": ["ankh"]},
+    {"query": "آلة الزمن اشتغلت ازاي؟", "expected": ["time machine"]},
+    {"query": "حمدان مات ازاي؟", "expected": ["died", "sacrific"]},
+    {"query": "احنا في أنهي عصر دلوقتي؟", "expected": ["dynastic", "3100"]},
+    {"query": "ليه مصر مختلفة عن اللي كنت متوقعه؟", "expected": ["unfamiliar", "early dynastic"]},
+    {"query": "هتعرف تترجم اللهجة هنا؟", "expected": ["dialect", "translation"]},
+    {"query": "ليه العالم كان بيموت؟", "expected": ["dying", "technological"]},
+    {"query": "Why did Lorenzo rebuild Hemdan as an AI?", "expected": ["consciousness", "ai matrix"]},
+    {"query": "What energy does the Ankh have?", "expected": ["energy"]},
+    {"query": "Where did the time machine take us?", "expected": ["early dynastic", "egypt"]},
+    {"query": "How do we avoid paradoxes?", "expected": ["paradox"]},
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def relevant(chunk: str, expected: List[str]) -> bool:
+    chunk = chunk.lower()
+    return any(term.lower() in chunk for term in expected)
+
+
+def recall_at_k(retrieved: List[str], chunks: List[str], expected: List[str], k: int) -> float:
+    """Relevant chunks retrieved, out of the relevant chunks that fit in k results."""
+    total = sum(relevant(chunk, expected) for chunk in chunks)
+    if not total:
+        return 1.0
+    return sum(relevant(chunk, expected) for chunk in retrieved[:k]) / min(total, k)
+
+
+def build_collection(lore_path: str, embedding_function, chunk_words: int, overlap: int):
+    with open(lore_path, "r", encoding="utf-8") as file:
+        chunks = list(dict.fromkeys(chunk_lore(file.read(), max_words=chunk_words, overlap=overlap)))
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(name="bench_lore", embedding_function=embedding_function)
+    ingest_chunks(collection, chunks, [chunk_id(chunk) for chunk in chunks], embedding_function,
+                  model=embedding_function.model_name)
+    return collection, chunks
+
+
+def run(retriever: HybridRetriever, chunks: List[str], queries: List[Dict[str, Any]], k: int, runs: int) -> Dict[str, Any]:
+    modes = {"vector": {"latency_ms": [], "recall": []}, "hybrid": {"latency_ms": [], "recall": [], "paths": {}}}
+    for _ in range(runs):
+        for item in queries:
+            for mode, stats in modes.items():
+                start = time.perf_counter()
+                retrieved = retriever.retrieve(item["query"], n_results=k, mode=mode)
+                stats["latency_ms"].append((time.perf_counter() - start) * 1000)
+                stats["recall"].append(recall_at_k(retrieved, chunks, item["expected"], k))
+                if mode == "hybrid":
+                    path = retriever.last_info["path"]
+                    stats["paths"][path] = stats["paths"].get(path, 0) + 1
+
+    report = {}
+    for mode, stats in modes.items():
+        latencies = stats["latency_ms"]
+        report[mode] = {
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            f"recall@{k}": round(sum(stats["recall"]) / len(stats["recall"]), 3),
+        }
+    paths = modes["hybrid"]["paths"]
+    report["hybrid"]["paths"] = paths
+    report["hybrid"]["fast_path_rate"] = round(paths.get("lexical", 0) / sum(paths.values()), 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vector-only and hybrid lore retrieval.")
+    parser.add_argument("--lore", default=DEFAULT_LORE, help="lore file to index")
+    parser.add_argument("--queries", help="JSON file of queries (default: built-in set)")
+    parser.add_argument("--k", type=int, default=3, help="results per query")
+    parser.add_argument("--runs", type=int, default=3, help="repeat every query this many times")
+    parser.add_argument("--chunk-words", type=int, default=60, help="words per lore chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=10)
+    parser.add_argument("--no-embedding-cache", action="store_true", help="embed every query through the API")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("OPENAI_API_KEY is not set.")
+        sys.exit(1)
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as file:
+            queries = json.load(file)
+
+    embedding_function = OpenAIEmbeddingFunction(api_key=api_key)
+    collection, chunks = build_collection(args.lore, embedding_function, args.chunk_words, args.chunk_overlap)
+    retriever = HybridRetriever(collection)
+    if args.no_embedding_cache:
+        os.environ["EMBEDDING_CACHE_DISABLED"] = "1"
+    else:
+        # Warm the cache so vector latency is the cached lookup, not the first API call.
+        for item in queries:
+            retriever.retrieve(item["query"], n_results=args.k, mode="vector")
+
+    report = {"lore": args.lore, "chunks": len(chunks), "queries": len(queries), "k": args.k, "runs": args.runs,
+              "embedding_cache": not args.no_embedding_cache}
+    report.update(run(retriever, chunks, queries, args.k, args.runs))
+
+    print(f"{len(chunks)} lore chunks, {len(queries)} queries x {args.runs} runs, k={args.k}")
+    for mode in ("vector", "hybrid"):
+        stats = report[mode]
+        print(f"  {mode:<7} mean {stats['mean_ms']:8.2f} ms  p50 {stats['p50_ms']:8.2f} ms  "
+              f"p95 {stats['p95_ms']:8.2f} ms  recall@{args.k} {stats[f'recall@{args.k}']:.3f}")
+    print(f"  hybrid paths: {report['hybrid']['paths']} (fast path {report['hybrid']['fast_path_rate']:.0%})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# embedding_cache.py
+"""
+Persistent, size-bounded cache of text embeddings for Hemdan's embedding functions.
+
+Every query and lore chunk used to be sent to the embeddings API, including repeated player
+questions and re-ingestion of unchanged lore. Vectors are now cached on disk, keyed by
+(model name, SHA-1 of the normalized text). Normalization is Unicode NFC with whitespace
+collapsed. Each model gets its own cache directory with:
+
+    vectors.f32   memory-mapped float32 array, capacity x dim
+    keys.bin      the 20-byte key digest stored in each slot, to validate hits
+    index.json    key -> slot in least-recently-used order, plus a generation counter
+
+Lookups are served from the in-process index; on a miss index.json is parsed again only if its
+stat (mtime, size, inode) changed. Writes take a file lock, pick up entries other worker
+processes added since the last write, evict the least recently used slots when full, and bump
+the generation. Readers don't take the file lock, so a slot is rewritten key-last: its key is
+zeroed, the vector written, then the new key. A reader checks the slot's key before and after
+copying the vector and treats any mismatch (a slot reused by another process) as a miss.
+
+Configuration (environment variables, all optional):
+    EMBEDDING_CACHE_DIR          - cache root (default embedding_cache/ next to this file)
+    EMBEDDING_CACHE_MAX_ENTRIES  - vectors kept per model (default 20000)
+    EMBEDDING_CACHE_DISABLED     - set to 1 to always call the API
+"""
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = os.environ.get("EMBEDDING_CACHE_DIR",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache"))
+DEFAULT_CAPACITY = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 20000))
+DIGEST_SIZE = 20
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """Disk-backed LRU of embeddings for one model, shared safely by several processes."""
+
+    _instances: Dict[str, "EmbeddingCache"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, model_name: str, directory: str = DEFAULT_DIR, capacity: int = DEFAULT_CAPACITY):
+        self.model_name = model_name
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.capacity = capacity
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.bin")
+        self._file_lock = FileLock(os.path.join(self.directory, "cache.lock"))
+        self._lock = threading.RLock()
+
+        self.dim: Optional[int] = None
+        self.generation = -1
+        self._index_stat = None
+        self.index: "OrderedDict[bytes, int]" = OrderedDict()
+        self._vectors = None
+        self._keys = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._lock:
+            self._reload()
+
+    @classmethod
+    def shared(cls, model_name: str) -> "EmbeddingCache":
+        """One cache per model per process."""
+        with cls._instances_lock:
+            if model_name not in cls._instances:
+                cls._instances[model_name] = cls(model_name)
+            return cls._instances[model_name]
+
+    # --- Storage ---
+    def _open_arrays(self, mode: str):
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(self.capacity, self.dim))
+        self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode=mode, shape=(self.capacity, DIGEST_SIZE))
+
+    def _read_index(self) -> Optional[dict]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Embedding cache index unreadable, starting empty: {e}")
+            return None
+
+    def _index_signature(self):
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _reload(self):
+        """Load index.json if another process has written since we last read it."""
+        signature = self._index_signature()
+        if signature is not None and signature == self._index_stat:
+            return
+        self._index_stat = signature
+        data = self._read_index()
+        if data is None or data.get("generation") == self.generation:
+            return
+        if data.get("capacity") != self.capacity:
+            # Capacity changed between runs: start over rather than remap slots.
+            logger.info(f"Embedding cache capacity changed to {self.capacity}; clearing {self.directory}")
+            self.dim, self.generation, self.index = None, -1, OrderedDict()
+            return
+        self.dim = data["dim"]
+        self.generation = data["generation"]
+        self.index = OrderedDict((bytes.fromhex(key), slot) for key, slot in data["entries"])
+        if self._vectors is None:
+            self._open_arrays("r+")
+
+    def _write_index(self):
+        tmp_path = self.index_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"model": self.model_name, "dim": self.dim, "capacity": self.capacity,
+                       "generation": self.generation,
+                       "entries": [[key.hex(), slot] for key, slot in self.index.items()]}, file)
+        os.replace(tmp_path, self.index_path)
+        # Our own write doesn't need to be parsed again on the next miss.
+        self._index_stat = self._index_signature()
+
+    # --- Lookups ---
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for `texts` in order, None where there is no valid entry."""
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            if any(key not in self.index for key in keys):
+                self._reload()
+            results = []
+            for key in keys:
+                slot = self.index.get(key)
+                vector = self._read_slot(slot, key) if slot is not None else None
+                if vector is not None:
+                    self.index.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                results.append(vector)
+            return results
+
+    def _read_slot(self, slot: int, key: bytes) -> Optional[List[float]]:
+        """The slot's vector if it holds `key` before and after the copy (no file lock taken)."""
+        if bytes(self._keys[slot]) != key:
+            return None
+        vector = self._vectors[slot].tolist()
+        if bytes(self._keys[slot]) != key:
+            return None
+        return vector
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        if not texts:
+            return
+        with self._lock, self._file_lock:
+            self._reload()
+            if self.dim is None:
+                self.dim = len(vectors[0])
+                self._open_arrays("w+")
+                self.index = OrderedDict()
+            used = set(self.index.values())
+            free = (slot for slot in range(self.capacity) if slot not in used)
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                if key in self.index or len(vector) != self.dim:
+                    continue
+                slot = next(free, None)
+                if slot is None:
+                    _, slot = self.index.popitem(last=False)
+                    self.evictions += 1
+                # Key last, so lock-free readers never pair the new vector with the old key.
+                self._keys[slot] = 0
+                self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self.index[key] = slot
+            self._vectors.flush()
+            self._keys.flush()
+            self.generation += 1
+            self._write_index()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"model": self.model_name, "entries": len(self.index), "capacity": self.capacity,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+def cached_embed(texts: Sequence[str], model_name: str, embed: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+    """
+    Embed `texts` through the cache: only texts without a cached vector are sent to `embed`,
+    once each, and the results are stored for next time.
+    """
+    texts = list(texts)
+    if os.environ.get("EMBEDDING_CACHE_DISABLED", "0") == "1" or not texts:
+        return embed(texts)
+
+    cache = EmbeddingCache.shared(model_name)
+    results = cache.get_many(texts)
+    missing: Dict[bytes, str] = {}
+    for text, vector in zip(texts, results):
+        if vector is None:
+            missing.setdefault(text_key(text), text)
+    if missing:
+        fresh = embed(list(missing.values()))
+        cache.put_many(list(missing.values()), fresh)
+        by_key = dict(zip(missing.keys(), fresh))
+        results = [vector if vector is not None else by_key[text_key(text)] for text, vector in zip(texts, results)]
+    logger.debug(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits ({cache.stats()})")
+    return results
+
+
+async def cached_aembed(texts: Sequence[str], model_name: str,
+                        aembed: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[List[float]]:
+    """
+    Async counterpart of cached_embed: misses are awaited through `aembed`. The lookup (which
+    may re-read the index) and the write to disk (which takes the file lock) run in a worker thread.
+    """
+    texts = list(texts)
+    if os.environ.get("EMBEDDING_CACHE_DISABLED", "0") == "1" or not texts:
+        return await aembed(texts)
+
+    cache = EmbeddingCache.shared(model_name)
+    results = await asyncio.to_thread(cache.get_many, texts)
+    missing: Dict[bytes, str] = {}
+    for text, vector in zip(texts, results):
+        if vector is None:
+            missing.setdefault(text_key(text), text)
+    if missing:
+        fresh = await aembed(list(missing.values()))
+        await asyncio.to_thread(cache.put_many, list(missing.values()), fresh)
+        by_key = dict(zip(missing.keys(), fresh))
+        results = [vector if vector is not None else by_key[text_key(text)] for text, vector in zip(texts, results)]
+    return results
@@ -0,0 +1,155 @@
+# eval_intent.py
+"""
+Accuracy and latency of Hemdan's intent classifiers on a labeled set of player utterances.
+
+Three classifiers are compared:
+
+    embedding  nearest centroid only (never calls the chat model)
+    hybrid     nearest centroid, LLM fallback below the confidence threshold (what
+               determine_user_intent now does)
+    llm        the JSON-mode gpt-4o-mini call on every utterance (the old behavior)
+
+Embeddings go through the embedding cache, so embedding latency after the first run is the
+cache lookup; pass --no-embedding-cache to measure API round-trips instead. Memoization is
+cleared before every pass so each utterance is really classified.
+
+    python eval_intent.py
+    python eval_intent.py --testset my_utterances.json --threshold 0.7 --output intent_report.json
+    python eval_intent.py --skip-llm
+
+A test set file is a list of {"utterance": "...", "intent": "..."}.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Any, Callable, Dict, List
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_gateway import get_gateway
+from rag_system import OpenAIEmbeddingFunction
+from intent_classifier import INTENTS, CONFIDENCE_THRESHOLD, IntentClassifier, llm_intent, load_examples
+
+# Held-out utterances; none of them is in the seed examples.
+DEFAULT_TESTSET = [
+    {"utterance": "المكان ده اسمه ايه؟", "intent": "place_identification"},
+    {"utterance": "احنا دلوقتي في انهي حتة؟", "intent": "place_identification"},
+    {"utterance": "ايه البتاع الكبير اللي قدامي ده؟", "intent": "place_identification"},
+    {"utterance": "المعبد ده بتاع مين؟", "intent": "place_identification"},
+    {"utterance": "ايه الهرم اللي هناك ده؟", "intent": "place_identification"},
+    {"utterance": "هو احنا فين بالظبط يا همدان؟", "intent": "place_identification"},
+    {"utterance": "تعرف المبنى اللي ورايا؟", "intent": "place_identification"},
+    {"utterance": "ايه المنطقة دي؟", "intent": "place_identification"},
+    {"utterance": "انت مين يا همدان؟", "intent": "lore_query"},
+    {"utterance": "ليه رجعنا في الزمن؟", "intent": "lore_query"},
+    {"utterance": "الأنخ ده بيعمل ايه بالظبط؟", "intent": "lore_query"},
+    {"utterance": "احنا في سنة كام؟", "intent": "lore_query"},
+    {"utterance": "مين اللي كان بيحكم مصر في الوقت ده؟", "intent": "lore_query"},
+    {"utterance": "ايه اللي حصل لعالمنا؟", "intent": "lore_query"},
+    {"utterance": "ليه البيانات عندك ناقصة؟", "intent": "lore_query"},
+    {"utterance": "احكيلي عن المهمة بتاعتنا", "intent": "lore_query"},
+    {"utterance": "اهلا يا صاحبي", "intent": "general_conversation"},
+    {"utterance": "يلا بينا", "intent": "general_conversation"},
+    {"utterance": "انا جعان", "intent": "general_conversation"},
+    {"utterance": "تفتكر نروح يمين ولا شمال؟", "intent": "general_conversation"},
+    {"utterance": "متشكر على مساعدتك", "intent": "general_conversation"},
+    {"utterance": "اسكت شوية", "intent": "general_conversation"},
+    {"utterance": "ايه الخطة دلوقتي؟", "intent": "general_conversation"},
+    {"utterance": "انت كويس؟", "intent": "general_conversation"},
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def evaluate(name: str, classify: Callable[[str], Dict[str, Any]], testset: List[Dict[str, str]], runs: int,
+             reset: Callable[[], None] = lambda: None) -> Dict[str, Any]:
+    latencies, correct, llm_calls = [], 0, 0
+    confusion = {expected: {predicted: 0 for predicted in INTENTS} for expected in INTENTS}
+    mistakes = []
+    for _ in range(runs):
+        reset()
+        for item in testset:
+            start = time.perf_counter()
+            result = classify(item["utterance"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            predicted = result.get("intent")
+            if result.get("source", "llm") == "llm":
+                llm_calls += 1
+            if predicted == item["intent"]:
+                correct += 1
+            elif len(mistakes) < len(testset):
+                mistakes.append({"utterance": item["utterance"], "expected": item["intent"], "predicted": predicted})
+            if predicted in INTENTS:
+                confusion[item["intent"]][predicted] += 1
+    total = len(testset) * runs
+    return {"classifier": name, "accuracy": round(correct / total, 3), "mean_ms": round(sum(latencies) / total, 2),
+            "p50_ms": round(percentile(latencies, 50), 2), "p95_ms": round(percentile(latencies, 95), 2),
+            "llm_call_rate": round(llm_calls / total, 3), "confusion": confusion, "mistakes": mistakes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the local intent classifier with the LLM classifier.")
+    parser.add_argument("--testset", help="JSON file of labeled utterances (default: built-in set)")
+    parser.add_argument("--examples", help="JSON file of extra training examples (see intent_classifier.py)")
+    parser.add_argument("--threshold", type=float, default=CONFIDENCE_THRESHOLD, help="confidence needed to skip the LLM")
+    parser.add_argument("--runs", type=int, default=1, help="repeat the test set this many times")
+    parser.add_argument("--skip-llm", action="store_true", help="only evaluate the embedding classifier")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="embed every utterance through the API")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("OPENAI_API_KEY is not set.")
+        sys.exit(1)
+    if args.no_embedding_cache:
+        os.environ["EMBEDDING_CACHE_DISABLED"] = "1"
+
+    testset = DEFAULT_TESTSET
+    if args.testset:
+        with open(args.testset, "r", encoding="utf-8") as file:
+            testset = json.load(file)
+
+    gateway = get_gateway(api_key)
+    embed = OpenAIEmbeddingFunction(api_key=api_key)
+    examples = load_examples(args.examples)
+
+    def classifier(threshold: float, fallback=None) -> IntentClassifier:
+        model = IntentClassifier(embed, fallback=fallback, examples=examples, threshold=threshold, learn_from_fallback=False)
+        model.fit()
+        return model
+
+    embedding_only = classifier(0.0)
+    reports = [evaluate("embedding", lambda text: embedding_only.classify(text, use_fallback=False), testset, args.runs,
+                        embedding_only.memo.clear)]
+    if not args.skip_llm:
+        hybrid = classifier(args.threshold, fallback=lambda text: llm_intent(gateway, text, raise_errors=True))
+        reports.append(evaluate("hybrid", hybrid.classify, testset, args.runs, hybrid.memo.clear))
+        reports.append(evaluate("llm", lambda text: llm_intent(gateway, text), testset, args.runs))
+
+    print(f"{len(testset)} utterances x {args.runs} run(s), threshold {args.threshold}")
+    for report in reports:
+        print(f"  {report['classifier']:<10} accuracy {report['accuracy']:.3f}  mean {report['mean_ms']:8.2f} ms  "
+              f"p50 {report['p50_ms']:8.2f} ms  p95 {report['p95_ms']:8.2f} ms  LLM calls {report['llm_call_rate']:.0%}")
+        for mistake in report["mistakes"][:5]:
+            print(f"      ✗ {mistake['utterance']}  expected {mistake['expected']}, got {mistake['predicted']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"threshold": args.threshold, "runs": args.runs, "testset": len(testset), "reports": reports},
+                      file, indent=2, ensure_ascii=False)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
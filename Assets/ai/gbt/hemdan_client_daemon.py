@@ -0,0 +1,266 @@
+# hemdan_client_daemon.py
+"""
+Long-running Hemdan client, replacing one inference_rag_system.py run per utterance.
+
+Each run of inference_rag_system.py started a new interpreter and imported requests, mss, PIL
+and numpy. It then made four extra HTTP round-trips before /chat: the status check, the places
+and object diagnostics, and a forced identification that ran ResNet on the screenshot a second
+time. The daemon starts once and:
+
+    - keeps one pooled HTTP session (keep-alive connections) to the service
+    - watches asr_output.txt for new transcripts, reading each one once the file has stopped
+      changing between two polls (so a transcript still being written is not sent half-done)
+    - checks the service once at startup; diagnostics run at startup with --diagnostics or
+      on demand from the console
+    - sends exactly one request per utterance: /chat/stream with a screenshot captured up front
+      and image_for_places_only set, so the service's intent classifier decides whether the
+      image is analyzed (a screenshot that was not analyzed, including after a failed
+      request, is deleted)
+    - logs each utterance's end-to-end latency, from the transcript being written to the final
+      answer, to the console and hemdan_asr_log.txt
+
+    python hemdan_client_daemon.py
+    python hemdan_client_daemon.py --watch path/to/asr_output.txt --screenshot keywords
+
+Screenshot modes: always (default; one request, the service decides), keywords (capture only
+when the local keyword check matches), never (text only).
+
+Console commands: diag, status, stats, quit.
+"""
+
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from inference_rag_system import (BASE_URL, ASR_OUTPUT_FILE, bus, wait_for_service, debug_places_database,
+                                  debug_hemdan_object, has_place_keywords, take_screenshot, stream_message_to_hemdan,
+                                  read_asr_output, print_sources, publish_response, write_gbt_output, log_conversation)
+
+SCREENSHOT_MODES = ("always", "keywords", "never")
+
+
+class Transcript:
+    """One utterance and when it was produced (wall-clock seconds)."""
+
+    def __init__(self, text: str, produced_at: float, source: str):
+        self.text = text
+        self.produced_at = produced_at
+        self.source = source
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def watch_asr_file(path: str, work: "queue.Queue", stop: threading.Event, poll_s: float):
+    """
+    Queue the transcript every time the ASR output file is rewritten (not what is there at
+    startup). A change is read only once the file's signature is the same on two polls in a row,
+    so a write in progress is not read early and then queued again once it completes.
+    """
+    handled = file_signature(path)
+    previous = handled
+    while not stop.wait(poll_s):
+        signature = file_signature(path)
+        if signature is None or signature == handled:
+            previous = signature
+            continue
+        if signature != previous:
+            # Still changing (or just changed): wait for it to settle
+            previous = signature
+            continue
+        handled = signature
+        content, error = read_asr_output(path)
+        if content:
+            work.put(("transcript", Transcript(content, signature[0] / 1e9, "file")))
+
+
+def read_console(work: "queue.Queue"):
+    """Console commands; stops quietly when there is no console (e.g. launched from Unity)."""
+    while True:
+        try:
+            line = input().strip().lower()
+        except (EOFError, OSError):
+            return
+        if line:
+            work.put(("command", line))
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class HemdanClientDaemon:
+    def __init__(self, screenshot_mode: str = "always"):
+        self.screenshot_mode = screenshot_mode
+        # One keep-alive connection pool for every request the daemon makes
+        self.http = requests.Session()
+        self.http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session_id = None
+        self.latencies: List[float] = []
+
+    # --- Diagnostics (startup / on demand only) ---
+    def status(self) -> Optional[Dict[str, Any]]:
+        try:
+            res = self.http.get(f"{BASE_URL}/status", timeout=5)
+            return res.json() if res.status_code == 200 else None
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Error checking status: {e}")
+            return None
+
+    def print_status(self):
+        status = self.status()
+        if status is None:
+            print("❌ Hemdan service is not reachable.")
+            return
+        print(f"✅ Model loaded: {status.get('model_loaded')} | lore: {status.get('lore_count')} | places: {status.get('places_count')}")
+        for key in ("sessions", "response_cache", "intent_classifier"):
+            if status.get(key):
+                print(f"   - {key}: {status[key]}")
+
+    def diagnostics(self):
+        print("🐛 DEBUG: Checking places database...")
+        if not debug_places_database():
+            print("⚠️ WARNING: Places database appears to be empty or inaccessible!")
+        print("🔍 DEBUG: Checking Hemdan object structure...")
+        if not debug_hemdan_object():
+            print("⚠️ WARNING: Hemdan object is missing critical methods!")
+
+    def print_stats(self):
+        if not self.latencies:
+            print("📊 No utterances handled yet.")
+            return
+        print(f"📊 {len(self.latencies)} utterance(s): mean {sum(self.latencies) / len(self.latencies):.2f}s, "
+              f"p50 {percentile(self.latencies, 50):.2f}s, p95 {percentile(self.latencies, 95):.2f}s end to end")
+
+    # --- Utterances ---
+    def capture(self, text: str) -> Optional[str]:
+        if self.screenshot_mode == "always" or (self.screenshot_mode == "keywords" and has_place_keywords(text)):
+            screenshot = take_screenshot()
+            # The service resolves paths from its own working directory
+            return os.path.abspath(screenshot) if screenshot else None
+        return None
+
+    def handle(self, transcript: Transcript) -> bool:
+        started = time.time()
+        print(f"\n📢 ASR Input ({transcript.source}): {transcript.text}")
+
+        capture_start = time.perf_counter()
+        screenshot = self.capture(transcript.text)
+        capture_ms = (time.perf_counter() - capture_start) * 1000
+
+        fields = {"image_for_places_only": True}
+        if self.session_id:
+            fields["session_id"] = self.session_id
+        request_start = time.perf_counter()
+        result = stream_message_to_hemdan(transcript.text, screenshot, http=self.http, **fields)
+        request_s = time.perf_counter() - request_start
+
+        intent = (result.get("intent") or {}).get("intent")
+        if screenshot and not (result["success"] and intent == "place_identification"):
+            # Not analyzed (other intent, no intent or a failed request): don't keep it around
+            try:
+                os.remove(screenshot)
+            except OSError:
+                pass
+            screenshot = None
+
+        if result["success"]:
+            response = result["response"]
+            self.session_id = result.get("session_id") or self.session_id
+            print(f"📤 Hemdan Response: {response}")
+            print_sources(result["chunks"])
+            if not result.get("published"):
+                publish_response(response, result.get("session_id"))
+            write_gbt_output(response)
+            log_conversation(f"ASR Input: {transcript.text}")
+            if screenshot:
+                log_conversation(f"Screenshot analyzed: {screenshot}")
+            log_conversation(f"Hemdan Response: {response}")
+        else:
+            print(f"❌ Error: {result['error']}")
+            log_conversation(f"Error: {result['error']}")
+
+        end_to_end = time.time() - transcript.produced_at
+        self.latencies.append(end_to_end)
+        first_sentence = result.get("first_sentence_s")
+        latency = (f"{end_to_end:.2f}s end to end (queued {started - transcript.produced_at:.2f}s, "
+                   f"screenshot {capture_ms:.0f} ms, request {request_s:.2f}s"
+                   + (f", first sentence {first_sentence:.2f}s" if first_sentence is not None else "")
+                   + f", intent {intent or 'n/a'})")
+        print(f"⏱️ Utterance latency: {latency}")
+        log_conversation(f"Latency: {latency}")
+        return result["success"]
+
+    def close(self):
+        self.http.close()
+        bus.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer every new ASR transcript with Hemdan, without restarting.")
+    parser.add_argument("--watch", default=ASR_OUTPUT_FILE, help="ASR output file to watch (default: %(default)s)")
+    parser.add_argument("--no-watch", action="store_true", help="don't watch the ASR output file")
+    parser.add_argument("--screenshot", choices=SCREENSHOT_MODES, default="always", help="when to capture a screenshot")
+    parser.add_argument("--diagnostics", action="store_true", help="run the places/object diagnostics at startup")
+    parser.add_argument("--poll", type=float, default=0.05, help="file watch interval in seconds")
+    args = parser.parse_args()
+
+    print("🎤 Hemdan Client Daemon")
+    print("=" * 50)
+    if not wait_for_service():
+        sys.exit(1)
+
+    daemon = HemdanClientDaemon(args.screenshot)
+    if args.diagnostics:
+        daemon.diagnostics()
+
+    work: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+    if not args.no_watch:
+        threading.Thread(target=watch_asr_file, args=(args.watch, work, stop, args.poll), daemon=True).start()
+        print(f"👀 Watching {args.watch}")
+    threading.Thread(target=read_console, args=(work,), daemon=True).start()
+    print("⌨️ Commands: diag, status, stats, quit")
+
+    try:
+        while True:
+            try:
+                kind, item = work.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if kind == "transcript":
+                daemon.handle(item)
+            elif item == "diag":
+                daemon.diagnostics()
+            elif item == "status":
+                daemon.print_status()
+            elif item == "stats":
+                daemon.print_stats()
+            elif item in ("quit", "exit"):
+                break
+            else:
+                print(f"❓ Unknown command '{item}' (diag, status, stats, quit)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        daemon.print_stats()
+        daemon.close()
+        print("👋 Hemdan client daemon stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# hemdan_sessions.py
+"""
+Per-player session state for the Hemdan service.
+
+The service used to keep one global session id and one conversation history, shared by every
+request. SessionManager keys state by session id instead:
+
+    - each Session has its own history and an asyncio.Lock, so turns of one session run one at
+      a time while different sessions proceed concurrently
+    - sessions are kept in LRU order and bounded; the least recently used idle session is
+      dropped when a new one would exceed the limit
+    - sessions idle for longer than the timeout are evicted by a background task
+    - a history keeps at most the last N turns
+
+The manager is used from the service's event loop only, so it needs no thread locks.
+
+Configuration (environment variables, all optional):
+    HEMDAN_MAX_SESSIONS      - sessions kept in memory (default 256)
+    HEMDAN_SESSION_IDLE_S    - seconds of inactivity before a session is evicted (default 1800)
+    HEMDAN_HISTORY_TURNS     - turns kept per session history (default 50)
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = int(os.environ.get("HEMDAN_MAX_SESSIONS", 256))
+IDLE_TIMEOUT_S = float(os.environ.get("HEMDAN_SESSION_IDLE_S", 1800))
+HISTORY_TURNS = int(os.environ.get("HEMDAN_HISTORY_TURNS", 50))
+
+
+class Session:
+    """One player's conversation with Hemdan."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.history: List[Dict[str, Any]] = []
+        self.lock = asyncio.Lock()
+        self.created = time.time()
+        self.last_active = time.monotonic()
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    def touch(self, max_turns: int = HISTORY_TURNS):
+        """Mark the session active and trim its history to the last `max_turns` turns."""
+        self.last_active = time.monotonic()
+        if len(self.history) > max_turns:
+            del self.history[:-max_turns]
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_active
+
+
+class SessionManager:
+    """Bounded LRU of sessions with idle eviction."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_timeout_s: float = IDLE_TIMEOUT_S,
+                 history_turns: int = HISTORY_TURNS):
+        self.max_sessions = max_sessions
+        self.idle_timeout_s = idle_timeout_s
+        self.history_turns = history_turns
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def create(self, session_id: Optional[str] = None) -> Session:
+        session = Session(session_id or str(uuid.uuid4()))
+        self.sessions[session.session_id] = session
+        self._enforce_limit()
+        return session
+
+    def get_or_create(self, session_id: Optional[str]) -> Session:
+        """The session with this id, creating it (under that id) if unknown; a new one when None."""
+        if session_id:
+            session = self.get(session_id)
+            if session is not None:
+                return session
+        return self.create(session_id)
+
+    def remove(self, session_id: str) -> bool:
+        return self.sessions.pop(session_id, None) is not None
+
+    def touch(self, session: Session):
+        session.touch(self.history_turns)
+        if session.session_id in self.sessions:
+            self.sessions.move_to_end(session.session_id)
+
+    def _enforce_limit(self):
+        # Oldest first; sessions with a request in flight and the newest session are kept.
+        for session_id in list(self.sessions)[:-1]:
+            if len(self.sessions) <= self.max_sessions:
+                break
+            if not self.sessions[session_id].busy:
+                del self.sessions[session_id]
+                self.evicted += 1
+
+    def evict_idle(self) -> int:
+        idle = [session_id for session_id, session in self.sessions.items()
+                if not session.busy and session.idle_seconds() > self.idle_timeout_s]
+        for session_id in idle:
+            del self.sessions[session_id]
+        self.evicted += len(idle)
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle session(s); {len(self.sessions)} active.")
+        return len(idle)
+
+    async def evict_forever(self, interval_s: float = 60.0):
+        """Background task: evict idle sessions every `interval_s` seconds."""
+        while True:
+            await asyncio.sleep(interval_s)
+            self.evict_idle()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self.sessions), "max_sessions": self.max_sessions,
+                "busy": sum(1 for session in self.sessions.values() if session.busy),
+                "idle_timeout_s": self.idle_timeout_s, "evicted": self.evicted}
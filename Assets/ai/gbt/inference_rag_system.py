@@ -10,10 +10,18 @@ import mss
 from PIL import Image
 import numpy as np
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from message_bus import BusPublisher
+from sentence_split import split_text
+
 BASE_URL = "http://127.0.0.1:8001"
 ASR_OUTPUT_FILE = "asr_output.txt"  # Default ASR output file
 LOG_FILE = "hemdan_asr_log.txt"
 
+# Responses are published on the local message bus as soon as they arrive;
+# gbt_output.txt is still written for consumers that read the file.
+bus = BusPublisher("hemdan")
+
 def check_service_status():
     """Check if the loader service is running and model is loaded"""
     try:
@@ -146,7 +154,19 @@ def force_test_identification(image_path, threshold=0.5):
         return False
 
 def should_take_screenshot(message: str) -> bool:
-    """Determine if the message requires a screenshot for place identification"""
+    """Determine if the message requires a screenshot, using the service's intent classifier"""
+    try:
+        res = requests.post(f"{BASE_URL}/intent", json={"message": message}, timeout=10)
+        if res.status_code == 200:
+            intent = res.json()
+            print(f"🧭 Intent: {intent.get('intent')} ({intent.get('source')}, confidence {intent.get('confidence')})")
+            return intent.get("intent") == "place_identification"
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ Intent classifier unavailable, using keyword check: {e}")
+    return has_place_keywords(message)
+
+def has_place_keywords(message: str) -> bool:
+    """Keyword check for place questions, used when the intent classifier is unavailable"""
     place_keywords = [
         # Arabic place-related keywords
         "فين", "مكان", "هنا", "ده", "دي", "المبنى", "البناية", "المعبد", "القصر",
@@ -197,22 +217,26 @@ def wait_for_service():
     print("❌ Service did not become ready within the timeout period.")
     return False
 
-def send_message_to_hemdan(message, image_path=None):
-    """Send message to the loaded Hemdan model"""
-    payload = {"message": message}
+def send_message_to_hemdan(message, image_path=None, http=requests, **fields):
+    """
+    Send message to the loaded Hemdan model. `http` may be a requests.Session to reuse its
+    connections; extra `fields` (session_id, image_for_places_only) go into the request body.
+    """
+    payload = {"message": message, **fields}
     if image_path:
         payload["image_path"] = image_path
         print(f"🔗 Sending screenshot to Hemdan for comparison with Game Screenshots database")
     
     try:
-        res = requests.post(f"{BASE_URL}/chat", json=payload, timeout=30)
+        res = http.post(f"{BASE_URL}/chat", json=payload, timeout=30)
         if res.status_code == 200:
             result = res.json()
             return {
                 "success": True,
                 "response": result.get("hemdan_response", "No response"),
                 "chunks": result.get("retrieved_chunks", []),
-                "session_id": result.get("session_id")
+                "session_id": result.get("session_id"),
+                "intent": result.get("intent")
             }
         else:
             error_detail = res.json().get('detail', 'Unknown error')
@@ -236,6 +260,78 @@ def send_message_to_hemdan(message, image_path=None):
             "error": f"Unexpected error: {str(e)}"
         }
 
+def stream_message_to_hemdan(message, image_path=None, http=requests, **fields):
+    """
+    Send message to Hemdan over /chat/stream and publish each sentence on the bus as soon as it
+    is finished, so TTS can start after the first sentence instead of the whole answer.
+    Falls back to /chat when the service has no streaming endpoint. `http` and `fields` are
+    as for send_message_to_hemdan.
+    """
+    payload = {"message": message, **fields}
+    if image_path:
+        payload["image_path"] = image_path
+        print("🔗 Sending screenshot to Hemdan for comparison with Game Screenshots database")
+    
+    start = time.time()
+    try:
+        with http.post(f"{BASE_URL}/chat/stream", json=payload, stream=True, timeout=30) as res:
+            if res.status_code == 404:
+                print("⚠️ Streaming endpoint not available, using /chat")
+                return send_message_to_hemdan(message, image_path, http, **fields)
+            if res.status_code != 200:
+                return {
+                    "success": False,
+                    "error": res.json().get('detail', 'Unknown error')
+                }
+            
+            first_sentence_at = None
+            for line in res.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "retrieval":
+                    print(f"⏱️ Retrieval done in {time.time() - start:.2f}s")
+                elif event["type"] == "token":
+                    bus.token(event["text"])
+                elif event["type"] == "sentence":
+                    if first_sentence_at is None:
+                        first_sentence_at = time.time() - start
+                        print(f"🗣️ First sentence after {first_sentence_at:.2f}s")
+                    bus.sentence(event["text"])
+                elif event["type"] == "error":
+                    print(f"❌ Stream error: {event.get('message')}")
+                elif event["type"] == "final":
+                    response = event.get("response", "No response")
+                    bus.done(response.strip(), session_id=event.get("session_id"))
+                    return {
+                        "success": True,
+                        "response": response,
+                        "chunks": event.get("retrieved_chunks", []),
+                        "session_id": event.get("session_id"),
+                        "intent": event.get("intent"),
+                        "first_sentence_s": first_sentence_at,
+                        "published": True
+                    }
+            return {
+                "success": False,
+                "error": "Stream ended without a final response."
+            }
+    except requests.exceptions.Timeout:
+        return {
+            "success": False,
+            "error": "Request timed out. The model might be processing a complex query."
+        }
+    except requests.exceptions.ConnectionError:
+        return {
+            "success": False,
+            "error": "Lost connection to Hemdan service."
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Unexpected error: {str(e)}"
+        }
+
 def read_asr_output(file_path):
     """Read ASR output from file"""
     try:
@@ -277,6 +373,13 @@ def print_sources(chunks):
                 print(f"      الوصف: {place_info.get('description', 'N/A')}")
         print("------------------------------------------")
 
+def publish_response(response_text, session_id=None):
+    """Publish the response on the message bus, sentence by sentence, then as a whole"""
+    clean_response = response_text.strip()
+    for sentence in split_text(clean_response):
+        bus.sentence(sentence)
+    bus.done(clean_response, session_id=session_id)
+
 def write_gbt_output(response_text):
     """Write only the pure model response to gbt_output.txt, overwriting each time"""
     try:
@@ -339,7 +442,7 @@ def process_once_and_exit(file_path, image_path=None):
     if final_image_path:
         print(f"🎯 Hemdan will use identify_building() to compare screenshot with known places...")
     
-    result = send_message_to_hemdan(content, final_image_path)
+    result = stream_message_to_hemdan(content, final_image_path)
     
     if result["success"]:
         response = result['response']
@@ -362,6 +465,11 @@ def process_once_and_exit(file_path, image_path=None):
         # Show sources for debugging
         print_sources(result['chunks'])
         
+        # Stream the response to bus subscribers (e.g. the EGTTS client) first,
+        # unless it was already published sentence by sentence while streaming
+        if not result.get('published'):
+            publish_response(response, result.get('session_id'))
+
         # Write ONLY the pure response to gbt_output.txt (overwrite)
         write_gbt_output(response)
         
@@ -421,6 +529,7 @@ def main():
         print("  python asr_inference.py                    # Process default ASR file once")
         print("  python asr_inference.py <asr_file>         # Process single ASR file once")
         print("  python asr_inference.py <asr_file> <image> # Process ASR file with image once")
+        print("For continuous use, run hemdan_client_daemon.py instead of one process per utterance.")
         sys.exit(1)
 
 if __name__ == "__main__":
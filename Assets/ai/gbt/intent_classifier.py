@@ -0,0 +1,265 @@
+# intent_classifier.py
+"""
+In-process intent classifier for Hemdan, in place of a JSON-mode LLM call per utterance.
+
+determine_user_intent only has to choose between three labels (place_identification,
+lore_query, general_conversation). A nearest-centroid classifier over sentence embeddings
+handles that locally:
+
+    - training: the labeled examples (seeded from the examples in the old classification
+      prompt, optionally extended from a JSON file) are embedded through the embedding cache,
+      and each intent's centroid is the normalized mean of its example vectors
+    - classification: cosine similarity to each centroid, turned into probabilities with a
+      softmax; the top intent is used when its probability reaches the threshold
+    - fallback: below the threshold the LLM classifier is asked, and its answer is added to the
+      training set so similar utterances are answered locally next time. If the LLM call
+      fails, the embedding guess is used but neither learned nor memoized
+    - memoization: results are kept per normalized utterance (Arabic letter and diacritic
+      normalization from lexical_index), so a repeated question costs nothing
+
+eval_intent.py compares accuracy and latency with the LLM-only classifier.
+
+Configuration (environment variables, all optional):
+    INTENT_CONFIDENCE_THRESHOLD - probability needed to skip the LLM (default 0.6)
+    INTENT_TEMPERATURE          - softmax temperature over cosine similarities (default 0.02)
+    INTENT_EXAMPLES_FILE        - JSON {"intent": ["utterance", ...]} merged into the seed set
+    INTENT_MEMO_SIZE            - memoized utterances (default 2048)
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from lexical_index import normalize_text
+
+logger = logging.getLogger(__name__)
+
+INTENTS = ("place_identification", "lore_query", "general_conversation")
+CONFIDENCE_THRESHOLD = float(os.environ.get("INTENT_CONFIDENCE_THRESHOLD", 0.6))
+TEMPERATURE = float(os.environ.get("INTENT_TEMPERATURE", 0.02))
+MEMO_SIZE = int(os.environ.get("INTENT_MEMO_SIZE", 2048))
+
+# Seeded from the examples in determine_user_intent's prompt, plus a few more of each kind.
+SEED_EXAMPLES: Dict[str, List[str]] = {
+    "place_identification": [
+        "ايه المكان ده؟", "احنا فين؟", "ايه المبنى اللي هناك ده؟", "ايه المكان ده احنا فين",
+        "ايه قصة المكان ده؟", "ايه اسم المكان ده؟", "ايه اسم المبنى ده؟",
+        "ايه المعبد اللي قدامنا ده؟", "احنا واقفين فين دلوقتي؟", "المبنى ده اسمه ايه يا همدان؟",
+    ],
+    "lore_query": [
+        "احنا وصلنا هنا ازاي", "ايه اللي حصل قبل كده؟", "ايه اللي حصل في الماضي؟",
+        "ايه العصر اللي احنا فيه ده", "ايه الي حصل علشان نوصل العصر ده؟",
+        "يعني ايه الأنخ؟", "آلة الزمن اشتغلت ازاي؟", "حمدان انت مت ازاي؟", "ليه العالم كان بيموت؟",
+    ],
+    "general_conversation": [
+        "ازيك يا همدان", "نعمل ايه دلوقتي؟", "شكرا يا همدان", "انا تعبت", "ايه رأيك نمشي من هنا؟",
+        "صباح الخير", "خليك معايا", "انا خايف يا همدان",
+    ],
+}
+
+
+# The JSON-mode prompt determine_user_intent used for every utterance; now only the fallback.
+LLM_PROMPT = """
+مهمتك يا همدان هي تحليل سؤال اللاعب وتصنيف قصده الأساسي بدقة عالية. أنت المساعد الذكي في لعبة مغامرات.
+
+علشان تطلع تصنيف دقيق، اتبع خطوات التفكير دي:
+1.  **حدد الموضوع الأساسي للسؤال:** هل اللاعب بيسأل عن حاجة مادية وملموسة شايفها بعينه (زي مكان أو مبنى)، ولا بيسأل عن حاجة معنوية أو مفهوم (زي فترة زمنية، حدث تاريخي، أو قصة شخصية)؟
+2.  **ركز في سياق الكلام:** سؤال زي "احنا فين؟" غالبًا بيقصد بيه مكان حقيقي. لكن سؤال زي "احنا في انهي عصر؟" بيقصد بيه فترة زمنية في قصة اللعبة.
+3.  **بناءً على التحليل ده،** صنّف القصد حسب التعريفات اللي جاية.
+
+التصنيفات الممكنة هي:
+- "place_identification": اللاعب بيسأل عن **المكان اللي هو فيه دلوقتي، أو حاجة مادية شايفها بعينه**. ده يشمل المكان الحالي، مبنى قدامه، أو اسم المنطقة. السؤال بيكون عن "هنا ودلوقتي".
+    - مثال: "ايه المكان ده؟"
+    - مثال: "احنا فين؟"
+    - مثال: "ايه المبنى اللي هناك ده؟"
+    - مثال دقيق: "ايه المكان ده احنا فين"
+    - مثال: "ايه قصة المكان ده؟"
+    - مثال: "ايه اسم المكان ده؟"
+    - مثال: "ايه اسم المبنى ده؟"
+
+- "lore_query": اللاعب بيسأل عن **معلومات، خلفية تاريخية، أو تفاصيل عن قصة اللعبة**. ده يشمل مفاهيم، شخصيات، أحداث، أو الخط الزمني للعبة. كمان بيشمل السؤال عن *تاريخ أو قصة* مكان معين. السؤال بيكون عن "مين، ليه، امتى، أو إيه حكاية...".
+    -مثال: " احنا وصلنا هنا ازاي"
+    - مثال: "ايه اللي حصل قبل كده؟"
+    - مثال: "ايه اللي حصل في الماضي؟"
+    - مثال دقيق: "ايه العصر اللي احنا فيه ده"
+    - مثال: "ايه الي حصل علشان نوصل العصر ده؟"
+
+- "general_conversation": اللاعب بيكلّمك كلام عام، بيسأل عن رأيك، بيدي أمر، أو بيسأل عن استراتيجية اللعب. ده أي حاجة مش مرتبطة مباشرةً بالمكان أو قصة اللعبة.
+    - مثال: "ازيك يا همدان"
+    - مثال: "نعمل ايه دلوقتي؟"
+    
+
+سؤال اللاعب: "{user_message}"
+
+مطلوب منك ترد بملف JSON فقط، فيه مفتاحين: "intent" و "subject". قيمة "subject" ممكن تكون null لو التصنيف "general_conversation" أو لو مفيش موضوع واضح في السؤال.
+"""
+
+
+def llm_intent(gateway, user_message: str, model: str = "gpt-4o-mini", raise_errors: bool = False) -> Dict[str, Any]:
+    """
+    Classify with one JSON-mode chat completion. When the call fails this answers lore_query,
+    or re-raises with `raise_errors` so a caller with its own fallback can tell the difference.
+    """
+    try:
+        response = gateway.chat(model=model, messages=[{"role": "system", "content": LLM_PROMPT.format(user_message=user_message)}],
+                                max_tokens=50, temperature=0.0, response_format={"type": "json_object"})
+        return json.loads(response.choices[0].message.content)
+    except Exception as e:
+        if raise_errors:
+            raise
+        logger.error(f"Error classifying intent: {e}")
+        return {"intent": "lore_query", "subject": user_message}
+
+
+def load_examples(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """Seed examples merged with the JSON file at `path` (or INTENT_EXAMPLES_FILE)."""
+    examples = {intent: list(utterances) for intent, utterances in SEED_EXAMPLES.items()}
+    path = path or os.environ.get("INTENT_EXAMPLES_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as file:
+            for intent, utterances in json.load(file).items():
+                if intent not in INTENTS:
+                    raise ValueError(f"Unknown intent '{intent}' in {path}")
+                examples[intent].extend(utterances)
+    return examples
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class IntentClassifier:
+    """Nearest-centroid intent classifier over cached embeddings, with an LLM fallback."""
+
+    def __init__(self, embed: Callable[[List[str]], List[Sequence[float]]],
+                 fallback: Optional[Callable[[str], Dict[str, Any]]] = None,
+                 examples: Optional[Dict[str, List[str]]] = None,
+                 threshold: float = CONFIDENCE_THRESHOLD, temperature: float = TEMPERATURE,
+                 learn_from_fallback: bool = True, memo_size: int = MEMO_SIZE):
+        self.embed = embed
+        self.fallback = fallback
+        self.examples = examples
+        self.threshold = threshold
+        self.temperature = temperature
+        self.learn_from_fallback = learn_from_fallback
+        self.memo_size = memo_size
+        self.memo: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.intents: List[str] = []
+        self._sums: Optional[np.ndarray] = None
+        self._counts: Optional[np.ndarray] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.counters = {"memo": 0, "embedding": 0, "llm": 0}
+        self._lock = threading.RLock()
+
+    # --- Training ---
+    def fit(self, examples: Optional[Dict[str, List[str]]] = None):
+        """Embed the labeled examples (one batch) and compute each intent's centroid."""
+        examples = examples or self.examples or load_examples()
+        texts, labels = [], []
+        for intent, utterances in examples.items():
+            for utterance in utterances:
+                texts.append(utterance)
+                labels.append(intent)
+        vectors = _unit(np.asarray(self.embed(texts), dtype=np.float32))
+        intents = [intent for intent in INTENTS if intent in examples] + \
+                  [intent for intent in examples if intent not in INTENTS]
+        sums = np.zeros((len(intents), vectors.shape[1]), dtype=np.float32)
+        counts = np.zeros(len(intents), dtype=np.float32)
+        for vector, label in zip(vectors, labels):
+            index = intents.index(label)
+            sums[index] += vector
+            counts[index] += 1
+        with self._lock:
+            self.intents, self._sums, self._counts = intents, sums, counts
+            self.centroids = _unit(sums)
+            self.memo.clear()
+        logger.info(f"Intent classifier trained on {len(texts)} examples: "
+                    f"{dict(zip(intents, counts.astype(int).tolist()))}")
+
+    def learn(self, utterance: str, intent: str, vector: Optional[Sequence[float]] = None):
+        """Add one labeled utterance and update its intent's centroid."""
+        if intent not in self.intents:
+            return
+        vector = _unit(np.asarray(vector if vector is not None else self.embed([utterance])[0], dtype=np.float32))
+        with self._lock:
+            index = self.intents.index(intent)
+            self._sums[index] += vector
+            self._counts[index] += 1
+            self.centroids[index] = _unit(self._sums[index])
+
+    # --- Classification ---
+    def scores(self, vector: Sequence[float]) -> Dict[str, float]:
+        """Probability of each intent for an embedded utterance."""
+        with self._lock:
+            similarities = self.centroids @ _unit(np.asarray(vector, dtype=np.float32))
+            intents = list(self.intents)
+        logits = (similarities - similarities.max()) / self.temperature
+        probabilities = np.exp(logits) / np.exp(logits).sum()
+        return dict(zip(intents, probabilities.tolist()))
+
+    def _remember(self, key: str, result: Dict[str, Any]):
+        with self._lock:
+            self.memo[key] = result
+            self.memo.move_to_end(key)
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+
+    def classify(self, utterance: str, use_fallback: bool = True,
+                 embed_query: Optional[Callable[[str], Sequence[float]]] = None) -> Dict[str, Any]:
+        """
+        {"intent", "subject", "confidence", "source", "latency_ms"} for an utterance. source is
+        "memo", "embedding" or "llm". subject is the utterance for place and lore questions, as
+        the LLM classifier would give, and None for general conversation. Pass a query's
+        `embed_query` to share its embedding of the utterance with the retrieval lookups.
+        """
+        start = time.perf_counter()
+        key = normalize_text(utterance)
+        with self._lock:
+            cached = self.memo.get(key)
+            if cached is not None:
+                self.memo.move_to_end(key)
+                self.counters["memo"] += 1
+                return {**cached, "source": "memo", "latency_ms": round((time.perf_counter() - start) * 1000, 3)}
+            if self.centroids is None:
+                self.fit()
+
+        vector = embed_query(utterance) if embed_query is not None else self.embed([utterance])[0]
+        probabilities = self.scores(vector)
+        intent = max(probabilities, key=probabilities.get)
+        result = {"intent": intent, "subject": None if intent == "general_conversation" else utterance,
+                  "confidence": round(probabilities[intent], 4), "source": "embedding"}
+
+        settled = True
+        if probabilities[intent] < self.threshold and use_fallback and self.fallback is not None:
+            try:
+                llm_result = self.fallback(utterance)
+            except Exception as e:
+                logger.warning(f"Intent LLM fallback failed, using the embedding result: {e}")
+                llm_result = None
+            if llm_result is not None and llm_result.get("intent") in self.intents:
+                result = {"intent": llm_result["intent"], "subject": llm_result.get("subject"),
+                          "confidence": round(probabilities.get(llm_result["intent"], 0.0), 4), "source": "llm"}
+                if self.learn_from_fallback:
+                    self.learn(utterance, llm_result["intent"], vector)
+            else:
+                # An unsure guess is used this once; the LLM is asked again next time.
+                settled = False
+
+        with self._lock:
+            self.counters[result["source"]] += 1
+        if settled:
+            self._remember(key, result)
+        return {**result, "latency_ms": round((time.perf_counter() - start) * 1000, 3)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"threshold": self.threshold, "trained": self.centroids is not None,
+                    "examples": dict(zip(self.intents, (self._counts.astype(int).tolist() if self._counts is not None else []))),
+                    "memoized": len(self.memo), **self.counters}
@@ -0,0 +1,264 @@
+# lexical_index.py
+"""
+In-process BM25 index over lore chunks, fused with vector search for Hemdan's retrieval.
+
+retrieve_relevant_lore used to rely only on the Chroma vector query, so every lookup waited for
+an embeddings round-trip. Many player questions name an entity directly (Pamiu, Kemet, a temple
+or obelisk), and a lexical match finds those in microseconds. The pieces:
+
+    - normalize_text / tokenize: the ASR transcript normalization from
+      docker_image/ASR_for_egyptian_dialect/utils/transcript_normalization.py (Arabic numerals to
+      digits, diacritics and punctuation removed), plus alef/ya/ta-marbuta folding and stripping
+      of the definite article
+    - ALIASES: Egyptian-Arabic spellings of lore entities mapped to the lore's own terms, so an
+      Arabic question can match English lore
+    - BM25Index: inverted index with BM25 scoring; lexical_confidence rates the top hit
+    - reciprocal_rank_fusion: merges the BM25 and vector rankings
+    - HybridRetriever: answers from BM25 alone when lexical confidence is high, otherwise runs
+      the vector query and fuses both rankings
+
+bench_retrieval.py compares latency and recall against vector-only retrieval.
+
+Configuration (environment variables, all optional):
+    LEXICAL_FAST_PATH_CONFIDENCE - confidence needed to skip the vector query (default 0.6)
+    LEXICAL_RRF_K                - reciprocal-rank fusion constant (default 60)
+"""
+
+import os
+import sys
+import math
+import re
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "docker_image", "ASR_for_egyptian_dialect"))
+from utils.transcript_normalization import convert_numerals_to_digit, remove_diacritics, remove_punctuation
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_CONFIDENCE = float(os.environ.get("LEXICAL_FAST_PATH_CONFIDENCE", 0.6))
+RRF_K = int(os.environ.get("LEXICAL_RRF_K", 60))
+
+_LETTER_FOLDING = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي", "ـ": None})
+_ARTICLE_PREFIXES = ("وال", "بال", "فال", "كال", "لل", "ال")
+
+STOPWORDS = {
+    # Egyptian Arabic, already normalized. Hemdan's own name is how players address him, so it only
+    # counts through ALIASES.
+    "في", "من", "علي", "على", "الي", "عن", "مع", "ده", "دي", "دا", "اللي", "هو", "هي", "احنا", "انا", "انت",
+    "انتي", "ايه", "ازاي", "فين", "امتي", "ليه", "مين", "كان", "كانت", "يا", "و", "او", "بس", "كده", "دلوقتي",
+    "هنا", "هناك", "عاوز", "عايز", "ممكن", "قولي", "قول", "احكيلي", "اعرف", "يعني", "طيب", "حمدان", "همدان",
+    # English
+    "the", "a", "an", "of", "and", "or", "to", "in", "on", "at", "is", "was", "were", "be", "it", "its",
+    "his", "her", "he", "she", "they", "them", "that", "this", "with", "for", "as", "by", "from", "had",
+    "has", "have", "not", "but", "what", "who", "where", "when", "how", "why",
+}
+
+# Egyptian-Arabic words players use (normalized, article stripped) -> the terms the lore is written in.
+ALIASES = {
+    "لورنزو": ["lorenzo"], "حمدان": ["hemdan"], "همدان": ["hemdan"],
+    "عنخ": ["ankh"], "انخ": ["ankh"], "اله": ["machine"], "زمن": ["time"], "طاقه": ["energy"],
+    "مصر": ["egypt"], "مصريه": ["egyptian"], "صحرا": ["desert"], "صحراء": ["desert"], "عالم": ["world"],
+    "ارض": ["earth"], "مملكه": ["kingdom"], "حديثه": ["new"], "اسرات": ["dynastic"], "حضاره": ["civilization"],
+    "ماضي": ["past"], "تاريخ": ["history"], "مهمه": ["mission"], "ترجمه": ["translation"], "لهجه": ["dialect"],
+    "ذكاء": ["ai"], "صديق": ["friend"], "صاحب": ["friend"], "تضحيه": ["sacrifice"], "مات": ["died"],
+    "معبد": ["temple"], "مسله": ["obelisk"], "هرم": ["pyramid"], "فرعون": ["pharaoh"], "نيل": ["nile"],
+    "كيميت": ["kemet"], "باميو": ["pamiu"],
+}
+
+
+def normalize_text(text: str) -> str:
+    text = re.sub(r"['’]s\b", "", convert_numerals_to_digit(text))
+    text = remove_diacritics(text)
+    text = remove_punctuation(text)
+    return re.sub(r"\s+", " ", text.translate(_LETTER_FOLDING)).strip()
+
+
+def _strip_article(token: str) -> str:
+    for prefix in _ARTICLE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+def tokenize(text: str, expand_aliases: bool = False) -> List[str]:
+    """Normalized index terms of `text`; with expand_aliases, lore terms for Arabic entity names are added."""
+    terms = []
+    for token in normalize_text(text).split():
+        stripped = token if token in ALIASES else _strip_article(token)
+        if expand_aliases and stripped in ALIASES:
+            terms.extend(ALIASES[stripped])
+        if token not in STOPWORDS and stripped not in STOPWORDS:
+            terms.append(stripped)
+    return terms
+
+
+class BM25Index:
+    """Inverted index over documents with BM25 scoring."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.documents: Dict[str, str] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id: str, text: str):
+        with self._lock:
+            if doc_id in self.documents:
+                self.remove(doc_id)
+            counts = Counter(tokenize(text))
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = count
+            self.lengths[doc_id] = sum(counts.values())
+            self.documents[doc_id] = text
+            self._total_length += self.lengths[doc_id]
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            if doc_id not in self.documents:
+                return
+            for term in set(tokenize(self.documents[doc_id])):
+                postings = self.postings.get(term, {})
+                postings.pop(doc_id, None)
+                if not postings:
+                    self.postings.pop(term, None)
+            self._total_length -= self.lengths.pop(doc_id)
+            del self.documents[doc_id]
+
+    def rebuild(self, ids: Sequence[str], texts: Sequence[str]):
+        with self._lock:
+            self.postings, self.lengths, self.documents, self._total_length = {}, {}, {}, 0
+            for doc_id, text in zip(ids, texts):
+                self.add(doc_id, text)
+
+    @classmethod
+    def from_collection(cls, collection) -> "BM25Index":
+        """Index every document currently stored in a Chroma collection."""
+        index = cls()
+        stored = collection.get(include=["documents"])
+        index.rebuild(stored["ids"], stored["documents"])
+        return index
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, {}))
+        n = len(self.documents)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 3) -> Tuple[List[Tuple[str, float]], List[str]]:
+        """Top `k` (doc id, score) pairs for `query`, and the query terms the index knows."""
+        terms = [term for term in dict.fromkeys(tokenize(query, expand_aliases=True))]
+        with self._lock:
+            known = [term for term in terms if term in self.postings]
+            if not known or not self.documents:
+                return [], known
+            average = self._total_length / len(self.documents)
+            scores: Dict[str, float] = {}
+            for term in known:
+                idf = self.idf(term)
+                for doc_id, tf in self.postings[term].items():
+                    norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average))
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return ranked, known
+
+    def matched_terms(self, doc_id: str, terms: Iterable[str]) -> List[str]:
+        with self._lock:
+            return [term for term in terms if doc_id in self.postings.get(term, {})]
+
+
+def lexical_confidence(index: BM25Index, results: List[Tuple[str, float]], known_terms: List[str]) -> float:
+    """
+    How sure the BM25 ranking is, in [0, 1]: the share of known query terms the top document
+    contains times how far it leads the runner-up. With no known terms there is no confidence.
+    """
+    if not results or not known_terms:
+        return 0.0
+    top_id, top_score = results[0]
+    coverage = len(index.matched_terms(top_id, known_terms)) / len(known_terms)
+    runner_up = results[1][1] if len(results) > 1 else 0.0
+    margin = top_score / (top_score + runner_up) if top_score > 0 else 0.0
+    return coverage * margin
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse several rankings of ids: each id scores sum(1 / (k + rank))."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever:
+    """BM25 plus vector retrieval over one Chroma collection, with a lexical-only fast path."""
+
+    def __init__(self, collection, index: Optional[BM25Index] = None,
+                 fast_path_confidence: float = FAST_PATH_CONFIDENCE, rrf_k: int = RRF_K):
+        self.collection = collection
+        self.index = index or BM25Index.from_collection(collection)
+        self.fast_path_confidence = fast_path_confidence
+        self.rrf_k = rrf_k
+        self.last_info: Dict[str, Any] = {}
+
+    def refresh(self):
+        """Re-read the collection, e.g. after the lore was re-synced."""
+        stored = self.collection.get(include=["documents"])
+        self.index.rebuild(stored["ids"], stored["documents"])
+
+    def vector_search(self, query: str, n_results: int,
+                      embed_query: Optional[Callable[[str], Sequence[float]]] = None) -> List[Tuple[str, str]]:
+        if embed_query is not None:
+            results = self.collection.query(query_embeddings=[list(embed_query(query))], n_results=n_results,
+                                            include=["documents"])
+        else:
+            results = self.collection.query(query_texts=[query], n_results=n_results, include=["documents"])
+        if not results or not results.get("ids") or not results["ids"][0]:
+            return []
+        return list(zip(results["ids"][0], results["documents"][0]))
+
+    def retrieve(self, query: str, n_results: int = 3, mode: str = "hybrid",
+                 embed_query: Optional[Callable[[str], Sequence[float]]] = None) -> List[str]:
+        """
+        Documents for `query`. mode "hybrid" (default) takes the lexical fast path when it is
+        confident and fuses BM25 with vector results otherwise; "vector" and "lexical" use one side.
+        `embed_query` supplies the query vector (e.g. a shared QueryEmbedder); without it Chroma
+        embeds the query text itself. Details of the last call (path, confidence, timings) are
+        kept in `last_info`.
+        """
+        start = time.perf_counter()
+        lexical: List[Tuple[str, float]] = []
+        confidence = 0.0
+        if mode in ("hybrid", "lexical"):
+            lexical, known = self.index.search(query, k=max(n_results, 10))
+            confidence = lexical_confidence(self.index, lexical, known)
+        lexical_ms = (time.perf_counter() - start) * 1000
+
+        if mode == "lexical" or (mode == "hybrid" and confidence >= self.fast_path_confidence):
+            ids = [doc_id for doc_id, _ in lexical[:n_results]]
+            self.last_info = {"path": "lexical", "confidence": round(confidence, 3), "lexical_ms": round(lexical_ms, 3),
+                              "vector_ms": 0.0, "ids": ids}
+            return [self.index.documents[doc_id] for doc_id in ids]
+
+        vector_start = time.perf_counter()
+        vector = self.vector_search(query, max(n_results, 10) if mode == "hybrid" else n_results, embed_query)
+        vector_ms = (time.perf_counter() - vector_start) * 1000
+        documents = dict(vector)
+        if mode == "vector" or not lexical:
+            ids = [doc_id for doc_id, _ in vector[:n_results]]
+        else:
+            fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in lexical], [doc_id for doc_id, _ in vector]], self.rrf_k)
+            ids = [doc_id for doc_id, _ in fused[:n_results]]
+        self.last_info = {"path": "vector" if mode == "vector" or not lexical else "hybrid",
+                          "confidence": round(confidence, 3), "lexical_ms": round(lexical_ms, 3),
+                          "vector_ms": round(vector_ms, 3), "ids": ids}
+        return [documents.get(doc_id) or self.index.documents.get(doc_id, "") for doc_id in ids]
@@ -1,11 +1,15 @@
 # model_loader.py
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
-import uuid
 import json
+import asyncio
+from typing import Optional
 from datetime import datetime
 from visionplore import HemdanRAGSystem  # Import your HemdanRAGSystem class
+from hemdan_sessions import SessionManager
+from llm_gateway import aclose_all  # importable once visionplore has put Assets/ai on sys.path
 
 # === Define FastAPI App ===
 app = FastAPI(title="Hemdan RAG Model Loader API")
@@ -18,12 +22,17 @@ IMAGES_ROOT_PATH = "C:/Developer/Unity Projects/ChronoRelic/Assets/ai/gbt/Game_S
 
 # === Global variables ===
 hemdan = None
-current_session_id = None
+current_session_id = None  # default session, for clients that don't send a session_id
+sessions = SessionManager()
 
 # === Request Schemas ===
 class UserMessage(BaseModel):
     message: str
     image_path: str = None
+    session_id: Optional[str] = None
+    # Use image_path only if the message is classified as a place question (lets a client
+    # capture the screenshot speculatively and still make a single request)
+    image_for_places_only: bool = False
 
 class SessionResponse(BaseModel):
     session_id: str
@@ -59,7 +68,7 @@ def initialize_hemdan_system():
             raise Exception("Could not initialize places collection properly.")
         
         # Start a new session
-        current_session_id = str(uuid.uuid4())
+        current_session_id = sessions.create().session_id
         hemdan.current_session_id = current_session_id
         hemdan.conversation_history = []
         
@@ -80,6 +89,22 @@ async def startup_event():
     success = initialize_hemdan_system()
     if not success:
         print("⚠️ Warning: Failed to load model on startup. Service will still run but chat will fail.")
+    asyncio.create_task(sessions.evict_forever())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the pooled async OpenAI connections this event loop opened"""
+    await aclose_all()
+
+async def resolve_image(user_input: UserMessage):
+    """The image to analyze for this message and, when it had to be classified, its intent"""
+    if not user_input.image_path or not user_input.image_for_places_only:
+        return user_input.image_path, None
+    intent = await asyncio.to_thread(hemdan.determine_user_intent, user_input.message)
+    if intent.get("intent") != "place_identification":
+        print(f"🧭 Intent '{intent.get('intent')}' ({intent.get('source')}): ignoring the speculative screenshot")
+        return None, intent
+    return user_input.image_path, intent
 
 # === Endpoints ===
 @app.get("/status")
@@ -98,33 +123,33 @@ def get_status():
             "session_id": current_session_id,
             "message": "Hemdan RAG System is loaded and ready",
             "lore_count": hemdan.lore_collection.count(),
-            "places_count": hemdan.places_collection.count()
+            "places_count": hemdan.places_collection.count(),
+            "response_cache": hemdan.response_cache.stats(),
+            "sessions": sessions.stats(),
+            "intent_classifier": hemdan.intent_classifier.stats()
         }
 
 @app.post("/chat")
-def chat(user_input: UserMessage):
+async def chat(user_input: UserMessage):
     """Chat with Hemdan using the loaded model"""
     if hemdan is None:
         raise HTTPException(status_code=500, detail="Model not loaded. Please restart the service.")
     
-    if current_session_id is None:
+    if current_session_id is None and user_input.session_id is None:
         raise HTTPException(status_code=500, detail="No active session. Please restart the service.")
     
+    session = sessions.get_or_create(user_input.session_id or current_session_id)
     try:
-        # Debug: Check if image_path is provided
-        if user_input.image_path:
-            print(f"🔍 DEBUG: Received image path: {user_input.image_path}")
-            print(f"🔍 DEBUG: Image exists: {os.path.exists(user_input.image_path)}")
-            
-            # Force place identification intent when image is provided
-            print("🎯 DEBUG: Image provided - forcing place identification analysis")
-            
-            # Test building identification directly
-            print("🧠 DEBUG: Testing identify_building method...")
-            building_result = hemdan.identify_building(user_input.image_path)
-            print(f"🔍 DEBUG: Building identification result: {building_result}")
-            
-        result = hemdan.process_query(user_input.message, image_path=user_input.image_path)
+        image_path, intent = await resolve_image(user_input)
+        # Debug: Check if image_path is provided (identification itself runs once, in the query)
+        if image_path:
+            print(f"🔍 DEBUG: Received image path: {image_path}")
+            print(f"🔍 DEBUG: Image exists: {os.path.exists(image_path)}")
+        
+        # One turn at a time per session; other sessions are not blocked
+        async with session.lock:
+            result = await hemdan.aprocess_query(user_input.message, image_path=image_path, history=session.history)
+            sessions.touch(session)
         
         # Debug: Check what was returned
         print(f"📋 DEBUG: Process query returned: {len(result.get('retrieved_chunks', []))} chunks")
@@ -132,9 +157,12 @@ def chat(user_input: UserMessage):
             print(f"📋 DEBUG: Chunk type: {chunk.get('type')}, source: {chunk.get('source')}")
             
         return {
-            "session_id": current_session_id,
+            "session_id": session.session_id,
             "hemdan_response": result["response"],
-            "retrieved_chunks": result["retrieved_chunks"]
+            "retrieved_chunks": result["retrieved_chunks"],
+            "cache": result.get("cache"),
+            "retrieval": result.get("retrieval"),
+            "intent": intent
         }
     except Exception as e:
         print(f"❌ ERROR in chat endpoint: {str(e)}")
@@ -142,46 +170,105 @@ def chat(user_input: UserMessage):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(user_input: UserMessage, format: str = "ndjson"):
+    """
+    Chat with Hemdan, streaming as the answer is produced: retrieval results first, then tokens,
+    finished sentences and a final record with the retrieved chunks. format=ndjson (default) sends
+    one JSON object per line; format=sse sends server-sent events.
+    """
+    if hemdan is None:
+        raise HTTPException(status_code=500, detail="Model not loaded. Please restart the service.")
+    
+    if current_session_id is None and user_input.session_id is None:
+        raise HTTPException(status_code=500, detail="No active session. Please restart the service.")
+    
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'.")
+    
+    session = sessions.get_or_create(user_input.session_id or current_session_id)
+
+    def encode(event):
+        payload = json.dumps(event, ensure_ascii=False)
+        if format == "sse":
+            return f"event: {event['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    async def events():
+        async with session.lock:
+            try:
+                image_path, intent = await resolve_image(user_input)
+                async for event in hemdan.astream_query(user_input.message, image_path=image_path, history=session.history):
+                    if event["type"] == "final":
+                        event["session_id"] = session.session_id
+                        event["intent"] = intent
+                        print(f"📋 DEBUG: Streamed response finished: first token {event.get('first_token_ms')} ms, total {event.get('total_ms')} ms")
+                    yield encode(event)
+            except Exception as e:
+                print(f"❌ ERROR in chat stream: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                yield encode({"type": "error", "message": f"Error generating response: {str(e)}"})
+            finally:
+                sessions.touch(session)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/intent")
+async def classify_intent(user_input: UserMessage):
+    """Classify an utterance as place_identification, lore_query or general_conversation"""
+    if hemdan is None:
+        raise HTTPException(status_code=500, detail="Model not loaded. Please restart the service.")
+    
+    return await asyncio.to_thread(hemdan.determine_user_intent, user_input.message)
+
 @app.post("/new_session", response_model=SessionResponse)
-def new_session():
-    """Start a new conversation session"""
+async def new_session(default: bool = True):
+    """
+    Start a new conversation session. By default it also becomes the session used by clients
+    that don't send a session_id; pass default=false to only create one for a new player.
+    """
     global current_session_id
     
     if hemdan is None:
         raise HTTPException(status_code=500, detail="Model not loaded. Please restart the service.")
     
-    current_session_id = str(uuid.uuid4())
-    hemdan.current_session_id = current_session_id
-    hemdan.conversation_history = []
+    session = sessions.create()
+    if default:
+        current_session_id = session.session_id
+        hemdan.current_session_id = current_session_id
     
     return SessionResponse(
-        session_id=current_session_id,
+        session_id=session.session_id,
         message="تم بدء جلسة جديدة مع همدان."
     )
 
 @app.get("/summary")
-def session_summary():
-    """Get summary of current session"""
+async def session_summary(session_id: Optional[str] = None):
+    """Get summary of a session (the default session when no session_id is given)"""
     if hemdan is None:
         raise HTTPException(status_code=500, detail="Model not loaded. Please restart the service.")
     
-    if current_session_id is None:
+    session_id = session_id or current_session_id
+    if session_id is None:
         raise HTTPException(status_code=500, detail="No active session.")
     
-    if not hemdan.conversation_history:
+    session = sessions.get(session_id)
+    if session is None or not session.history:
         return {
-            "session_id": current_session_id,
+            "session_id": session_id,
             "summary": "لا توجد محادثات في هذه الجلسة بعد."
         }
     
     # Simple summary - last 3 exchanges
-    recent_history = hemdan.conversation_history[-3:]
+    recent_history = session.history[-3:]
     summary = "ملخص آخر المحادثات:\n"
     for i, turn in enumerate(recent_history, 1):
         summary += f"{i}. لورنزو: {turn['user']}\n   همدان: {turn['assistant']}\n"
     
     return {
-        "session_id": current_session_id,
+        "session_id": session_id,
         "summary": summary
     }
 
@@ -0,0 +1,392 @@
+# lore_ingest.py
+"""
+Chunking and incremental, batched ingestion of lore into Chroma.
+
+Both RAG modules chunk the lore file with chunk_lore and index it with sync_lore. Chunk ids are
+content-addressed ("lore_" + hash of the normalized chunk). A manifest next to the database
+records the file hash, each chunk's hash and position, and the ids stored in the collection
+(including the "_part<n>" pieces of split chunks). On startup sync_lore does one of two things:
+
+    - returns at once when the file hash matches and the collection holds as many entries as
+      the manifest's stored ids
+    - otherwise diffs the current chunks against the collection, embeds only new chunks,
+      deletes stale ids and updates the positions of chunks that moved
+
+A small lore edit costs a few embeddings instead of a full rebuild, and ids from older chunking
+schemes are simply stale and removed.
+
+load_lore used to pass every chunk to collection.add in one call, so the embedding function sent
+them all in a single embeddings request. For a large lore file that runs into per-request input
+limits and cannot overlap network round-trips. Ingestion now runs in four steps:
+
+    1. chunks longer than the model's input limit are split on token boundaries
+    2. chunks are grouped into batches of at most LORE_INGEST_BATCH_TOKENS tokens
+    3. batches are embedded concurrently (LORE_INGEST_CONCURRENCY at a time), retrying with
+       exponential backoff when the API rate-limits
+    4. embedded chunks are written to Chroma in pages of LORE_INGEST_PAGE_SIZE
+
+ingest_chunks returns an IngestReport with throughput in chunks per second.
+
+Configuration (environment variables, all optional):
+    LORE_CHUNK_WORDS         - longest chunk in words before it is windowed (default 300)
+    LORE_CHUNK_OVERLAP       - words shared by consecutive windows (default 50)
+    LORE_INGEST_CONCURRENCY  - embedding requests in flight (default 4)
+    LORE_INGEST_BATCH_TOKENS - tokens per embeddings request (default 8000)
+    LORE_INGEST_PAGE_SIZE    - chunks per collection.add call (default 256)
+    LORE_INGEST_MAX_RETRIES  - retries per batch on rate limiting (default 5)
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "text-embedding-ada-002"
+# Bumped whenever chunk_lore's boundaries change, so existing manifests are re-synced.
+CHUNKING_VERSION = 2
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_ITEMS = 2048
+
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _encoder(model: str):
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    _encoders[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encoders[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning(f"tiktoken unavailable ({e}); estimating tokens from characters")
+                _encoders[model] = None
+        return _encoders[model]
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    encoder = _encoder(model)
+    if encoder is None:
+        # Arabic text runs close to two characters per token, so estimate on the safe side.
+        return len(text) // 2 + 1
+    return len(encoder.encode(text))
+
+
+def split_to_token_limit(text: str, max_tokens: int = MAX_INPUT_TOKENS, model: str = DEFAULT_MODEL) -> List[str]:
+    """Split `text` into pieces of at most `max_tokens` tokens, on word boundaries where possible."""
+    if count_tokens(text, model) <= max_tokens:
+        return [text]
+    encoder = _encoder(model)
+    if encoder is not None:
+        tokens = encoder.encode(text)
+        return [encoder.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+    pieces, current = [], []
+    for word in text.split():
+        if current and count_tokens(" ".join(current + [word]), model) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def make_batches(token_counts: Sequence[int], max_tokens: int, max_items: int = MAX_BATCH_ITEMS) -> List[List[int]]:
+    """Group item indexes, in order, into batches under both the token and the item limit."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for index, tokens in enumerate(token_counts):
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        if retry_after is not None:
+            return float(retry_after)
+    except ValueError:
+        pass
+    return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def embed_with_retry(embed: Callable[[List[str]], List[List[float]]], texts: List[str],
+                     max_retries: int) -> Tuple[List[List[float]], int]:
+    """Embed one batch, backing off on rate limiting. Returns (vectors, retries used)."""
+    for attempt in range(max_retries + 1):
+        try:
+            return embed(texts), attempt
+        except openai.RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning(f"Embedding batch rate-limited, retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+# --- Chunking ---
+def chunk_lore(text: str, max_words: Optional[int] = None, overlap: Optional[int] = None) -> List[str]:
+    """
+    Split lore into paragraphs separated by blank lines; lines wrapped inside a paragraph are
+    joined. Paragraphs longer than `max_words` are split into overlapping word windows. Chunk
+    boundaries depend only on the paragraph itself, so editing one paragraph leaves the other
+    chunks unchanged.
+    """
+    max_words = max_words or _env_int("LORE_CHUNK_WORDS", 300)
+    overlap = overlap if overlap is not None else _env_int("LORE_CHUNK_OVERLAP", 50)
+    step = max(1, max_words - overlap)
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if len(words) <= max_words:
+            chunks.append(" ".join(words))
+            continue
+        for start in range(0, len(words), step):
+            chunks.append(" ".join(words[start:start + max_words]))
+            if start + max_words >= len(words):
+                break
+    return chunks
+
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha1(re.sub(r"\s+", " ", chunk).strip().encode("utf-8")).hexdigest()
+
+
+def chunk_id(chunk: str) -> str:
+    return f"lore_{chunk_hash(chunk)[:20]}"
+
+
+def base_id(stored_id: str) -> str:
+    """The chunk id of a stored id, without the "_part<n>" suffix of a split chunk."""
+    return stored_id.split("_part")[0]
+
+
+class IngestReport:
+    """Outcome of one ingestion run."""
+
+    def __init__(self, chunks: int, batches: int, pages: int, retries: int, seconds: float,
+                 ids: Optional[List[str]] = None):
+        self.chunks = chunks
+        self.ids = ids or []
+        self.batches = batches
+        self.pages = pages
+        self.retries = retries
+        self.seconds = seconds
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"chunks": self.chunks, "batches": self.batches, "pages": self.pages, "retries": self.retries,
+                "seconds": round(self.seconds, 3), "chunks_per_second": round(self.chunks_per_second, 1)}
+
+    def __repr__(self):
+        return (f"IngestReport({self.chunks} chunks in {self.seconds:.2f}s = {self.chunks_per_second:.1f}/s, "
+                f"{self.batches} batches, {self.pages} pages, {self.retries} retries)")
+
+
+def ingest_chunks(collection, documents: Sequence[str], ids: Sequence[str],
+                  embed: Callable[[List[str]], List[List[float]]],
+                  metadatas: Optional[Sequence[Dict[str, Any]]] = None, model: str = DEFAULT_MODEL,
+                  concurrency: Optional[int] = None, batch_tokens: Optional[int] = None,
+                  page_size: Optional[int] = None, max_retries: Optional[int] = None) -> IngestReport:
+    """
+    Embed `documents` in token-bounded batches on a bounded thread pool and add them to
+    `collection` in pages. Documents over the model's input limit are split, and each piece gets
+    the id "<id>_part<n>" and a "part" metadata field.
+    """
+    concurrency = concurrency or _env_int("LORE_INGEST_CONCURRENCY", 4)
+    batch_tokens = batch_tokens or _env_int("LORE_INGEST_BATCH_TOKENS", 8000)
+    page_size = page_size or _env_int("LORE_INGEST_PAGE_SIZE", 256)
+    max_retries = max_retries if max_retries is not None else _env_int("LORE_INGEST_MAX_RETRIES", 5)
+    start = time.perf_counter()
+
+    # 1. Token-aware splitting of oversized documents.
+    texts: List[str] = []
+    text_ids: List[str] = []
+    text_metadatas: List[Dict[str, Any]] = []
+    for index, document in enumerate(documents):
+        metadata = dict(metadatas[index]) if metadatas else {}
+        pieces = split_to_token_limit(document, min(batch_tokens, MAX_INPUT_TOKENS), model)
+        for part, piece in enumerate(pieces):
+            texts.append(piece)
+            text_ids.append(ids[index] if len(pieces) == 1 else f"{ids[index]}_part{part}")
+            text_metadatas.append(metadata if len(pieces) == 1 else {**metadata, "part": part})
+
+    # 2. Token-bounded batches.
+    batches = make_batches([count_tokens(text, model) for text in texts], batch_tokens)
+
+    # 3 + 4. Embed concurrently; write finished chunks to Chroma a page at a time.
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    pending: List[int] = []
+    pages = retries = 0
+
+    def write_page(indexes: List[int]):
+        collection.add(
+            ids=[text_ids[i] for i in indexes],
+            documents=[texts[i] for i in indexes],
+            embeddings=[vectors[i] for i in indexes],
+            metadatas=[text_metadatas[i] for i in indexes] if metadatas else None,
+        )
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lore-embed") as pool:
+        futures = {pool.submit(embed_with_retry, embed, [texts[i] for i in batch], max_retries): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            batch_vectors, batch_retries = future.result()
+            retries += batch_retries
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+            pending.extend(batch)
+            while len(pending) >= page_size:
+                write_page(pending[:page_size])
+                pending = pending[page_size:]
+                pages += 1
+        if pending:
+            write_page(pending)
+            pages += 1
+
+    report = IngestReport(len(texts), len(batches), pages, retries, time.perf_counter() - start, ids=text_ids)
+    logger.info(f"Lore ingestion: {report}")
+    return report
+
+
+# --- Incremental sync ---
+class SyncReport:
+    """What sync_lore changed."""
+
+    def __init__(self, added: int, removed: int, moved: int, unchanged: int, seconds: float,
+                 skipped: bool = False, ingest: Optional[IngestReport] = None):
+        self.added = added
+        self.removed = removed
+        self.moved = moved
+        self.unchanged = unchanged
+        self.seconds = seconds
+        self.skipped = skipped
+        self.ingest = ingest
+
+    def __repr__(self):
+        if self.skipped:
+            return f"SyncReport(up to date, {self.unchanged} chunks, {self.seconds:.3f}s)"
+        return (f"SyncReport(+{self.added} -{self.removed} ~{self.moved} ={self.unchanged} chunks "
+                f"in {self.seconds:.2f}s)")
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(path: str, manifest: Dict[str, Any]):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def sync_lore(collection, file_path: str, embed: Callable[[List[str]], List[List[float]]],
+              manifest_path: str, model: str = DEFAULT_MODEL, metadata: Optional[Dict[str, Any]] = None) -> SyncReport:
+    """
+    Bring `collection` in line with the lore file: embed new chunks, delete stale ids and
+    update moved positions, then record the result in the manifest at `manifest_path`.
+    """
+    start = time.perf_counter()
+    file_hash = _file_hash(file_path)
+    manifest = read_manifest(manifest_path)
+    params = {"max_words": _env_int("LORE_CHUNK_WORDS", 300), "overlap": _env_int("LORE_CHUNK_OVERLAP", 50)}
+    chunking = {**params, "version": CHUNKING_VERSION}
+    if (manifest.get("file_hash") == file_hash and manifest.get("chunking") == chunking
+            and manifest.get("collection") == collection.name and "stored_ids" in manifest
+            and collection.count() == len(manifest["stored_ids"])):
+        return SyncReport(0, 0, 0, len(manifest["chunks"]), time.perf_counter() - start, skipped=True)
+
+    with open(file_path, "r", encoding="utf-8") as file:
+        chunks = chunk_lore(file.read(), **params)
+
+    current: Dict[str, Tuple[str, int]] = {}
+    for position, chunk in enumerate(chunks):
+        current.setdefault(chunk_id(chunk), (chunk, position))
+
+    # The collection, not the manifest, is the truth about what is stored.
+    existing = collection.get(include=["metadatas"])
+    stored = {id_: (meta or {}) for id_, meta in zip(existing["ids"], existing["metadatas"] or [None] * len(existing["ids"]))}
+
+    # Chunks split by ingest_chunks are stored as "<id>_part<n>".
+    stored_bases = {base_id(id_) for id_ in stored}
+    stale = [id_ for id_ in stored if base_id(id_) not in current]
+    new = [id_ for id_ in current if id_ not in stored_bases]
+    moved = [id_ for id_ in stored if base_id(id_) in current
+             and stored[id_].get("position") != current[base_id(id_)][1]]
+
+    def chunk_metadata(id_: str) -> Dict[str, Any]:
+        chunk, position = current[id_]
+        return {**(metadata or {}), "chunk_hash": chunk_hash(chunk), "position": position}
+
+    def stored_metadata(id_: str) -> Dict[str, Any]:
+        part = stored[id_].get("part")
+        return {**chunk_metadata(base_id(id_)), **({"part": part} if part is not None else {})}
+
+    if stale:
+        collection.delete(ids=stale)
+    ingest = None
+    if new:
+        ingest = ingest_chunks(collection, [current[id_][0] for id_ in new], new, embed,
+                               metadatas=[chunk_metadata(id_) for id_ in new], model=model)
+    if moved:
+        collection.update(ids=moved, metadatas=[stored_metadata(id_) for id_ in moved])
+    stale_ids = set(stale)
+    stored_ids = [id_ for id_ in stored if id_ not in stale_ids] + (ingest.ids if ingest else [])
+
+    write_manifest(manifest_path, {
+        "source": os.path.basename(file_path),
+        "file_hash": file_hash,
+        "collection": collection.name,
+        "chunking": chunking,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "chunks": {id_: {"hash": chunk_hash(chunk), "position": position} for id_, (chunk, position) in current.items()},
+        "stored_ids": sorted(stored_ids),
+    })
+    report = SyncReport(len(new), len(stale), len(moved), len(current) - len(new), time.perf_counter() - start,
+                        ingest=ingest)
+    logger.info(f"Lore sync for {collection.name}: {report}")
+    return report
@@ -1,14 +1,22 @@
 import os
+import sys
 import json
 import numpy as np
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Sequence
 import openai
 import chromadb
 from chromadb.utils import embedding_functions
 import uuid
 import logging
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_gateway import get_gateway
+from embedding_cache import cached_embed
+from lore_ingest import sync_lore
+from lexical_index import HybridRetriever
+from retrieval_coordinator import RetrievalCoordinator
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,7 +29,7 @@ class OpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
     def __init__(self, api_key: str, model_name: str = "text-embedding-ada-002"):
         if not api_key:
             raise ValueError("OpenAI API key is required for OpenAIEmbeddingFunction.")
-        self.client = openai.OpenAI(api_key="sk-proj-oBIOgX0aO6YzaLlAldnpT3BlbkFJbdDbSEEoomYGNFVC9A2l")
+        self.gateway = get_gateway(api_key)
         self.model_name = model_name
         logger.info(f"Initialized OpenAI Embedding Function with model: {self.model_name}")
 
@@ -30,12 +38,8 @@ class OpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
         Embeds a list of documents using the OpenAI embedding API.
         """
         try:
-            response = self.client.embeddings.create(
-                input=input,
-                model=self.model_name
-            )
-            embeddings = [data.embedding for data in response.data]
-            return embeddings
+            # Cached vectors are reused; only new texts go to the API.
+            return cached_embed(input, self.model_name, self._embed_uncached)
         except openai.APIStatusError as e:
             logger.error(f"OpenAI API error during embedding: {e.status_code} - {e.response}")
             raise
@@ -46,6 +50,9 @@ class OpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
             logger.error(f"Unexpected error during embedding with OpenAI: {e}")
             raise
 
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        return self.gateway.embed(texts, model=self.model_name)
+
 
 class HemdanRAGSystem:
     """
@@ -65,16 +72,21 @@ class HemdanRAGSystem:
         if not os.path.exists(lore_file_path):
             raise FileNotFoundError(f"Lore file not found at: {lore_file_path}")
 
-        # Initialize OpenAI client
-        self.client = openai.OpenAI(api_key=openai_api_key)
-        logger.info("OpenAI client initialized.")
+        # Shared OpenAI gateway (pooled keep-alive connections)
+        self.gateway = get_gateway(openai_api_key)
+        self.client = self.gateway.client
+        logger.info("OpenAI gateway initialized.")
         
         # Initialize embedding model (now using OpenAI)
         self.openai_ef = OpenAIEmbeddingFunction(api_key=openai_api_key, model_name="text-embedding-ada-002")
+        # Runs lore and memory lookups concurrently, embedding the user message once for both
+        self.retrieval = RetrievalCoordinator(self.openai_ef)
+        self.last_retrieval = None
         
         # Initialize ChromaDB
         try:
-            self.chroma_client = chromadb.PersistentClient(path="./hemdan_db")
+            self.db_path = "./hemdan_db"
+            self.chroma_client = chromadb.PersistentClient(path=self.db_path)
             logger.info("ChromaDB client initialized.")
         except Exception as e:
             logger.critical(f"Failed to initialize ChromaDB PersistentClient: {e}")
@@ -96,6 +108,7 @@ class HemdanRAGSystem:
             raise
         
         # Load and process lore
+        self.lore_retriever = None
         self.load_lore(lore_file_path)
         
         # Conversation memory storage
@@ -130,25 +143,22 @@ class HemdanRAGSystem:
         logger.info("HemdanRAGSystem initialized successfully.")
 
     def load_lore(self, file_path: str):
-        """Load and chunk the lore file into the vector database."""
+        """Bring the lore collection in line with the lore file, embedding only new or changed chunks."""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                lore_text = file.read()
-            
-            chunks = self._chunk_text(lore_text)
-            
-            existing_docs = self.lore_collection.get(limit=1) # Just check if any docs exist
-            if not existing_docs['ids']: # If the collection is empty
-                ids = [f"lore_chunk_{i}" for i in range(len(chunks))]
-                self.lore_collection.add(
-                    documents=chunks,
-                    ids=ids,
-                    metadatas=[{"type": "lore", "chunk_id": i} for i in range(len(chunks))]
-                )
-                logger.info(f"Loaded {len(chunks)} lore chunks into database.")
+            report = sync_lore(
+                self.lore_collection,
+                file_path,
+                self.openai_ef,
+                manifest_path=os.path.join(self.db_path, "game_lore_manifest.json"),
+                model=self.openai_ef.model_name,
+                metadata={"type": "lore"},
+            )
+            if report.skipped:
+                logger.info("Lore is up to date in database. Skipping re-ingestion.")
             else:
-                logger.info("Lore already exists in database. Skipping re-ingestion.")
-                
+                logger.info(f"Synced lore chunks into database: {report}")
+            self.lore_retriever = HybridRetriever(self.lore_collection)
+            logger.info(f"Lexical lore index built over {len(self.lore_retriever.index)} chunks.")
         except FileNotFoundError:
             logger.error(f"Lore file not found: {file_path}")
             raise
@@ -156,24 +166,17 @@ class HemdanRAGSystem:
             logger.error(f"Error loading lore into ChromaDB: {e}")
             raise
 
-    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks."""
-        chunks = []
-        words = text.split()
-        
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
-                
-        logger.debug(f"Chunked text into {len(chunks)} chunks.")
-        return chunks
-
-    def retrieve_relevant_lore(self, query: str, n_results: int = 3) -> List[str]:
-        """Retrieve relevant lore based on query."""
+    def retrieve_relevant_lore(self, query: str, n_results: int = 3,
+                               embed_query: Optional[Callable[[str], Sequence[float]]] = None) -> List[str]:
+        """Retrieve relevant lore based on query (BM25 fast path, otherwise BM25 fused with vector search)."""
         try:
+            if self.lore_retriever is not None:
+                relevant_docs = self.lore_retriever.retrieve(query, n_results=n_results, embed_query=embed_query)
+                logger.info(f"Retrieved {len(relevant_docs)} lore documents for query: '{query[:50]}...'")
+                logger.debug(f"Lore retrieval: {self.lore_retriever.last_info}")
+                return relevant_docs
             results = self.lore_collection.query(
-                query_texts=[query],
+                **self._query_input(query, embed_query),
                 n_results=n_results,
                 include=['documents', 'distances']
             )
@@ -185,11 +188,19 @@ class HemdanRAGSystem:
             logger.error(f"Error retrieving lore from ChromaDB: {e}")
             return []
 
-    def retrieve_conversation_memory(self, query: str, n_results: int = 5) -> List[Dict]:
+    @staticmethod
+    def _query_input(query: str, embed_query: Optional[Callable[[str], Sequence[float]]]) -> Dict[str, Any]:
+        """Chroma query arguments: the shared query vector when one is available, else the text."""
+        if embed_query is not None:
+            return {"query_embeddings": [list(embed_query(query))]}
+        return {"query_texts": [query]}
+
+    def retrieve_conversation_memory(self, query: str, n_results: int = 5,
+                                     embed_query: Optional[Callable[[str], Sequence[float]]] = None) -> List[Dict]:
         """Retrieve relevant conversation history."""
         try:
             results = self.memory_collection.query(
-                query_texts=[query],
+                **self._query_input(query, embed_query),
                 n_results=n_results,
                 include=['documents', 'metadatas', 'distances'],
                 where={"session_id": self.current_session_id}
@@ -241,8 +252,14 @@ class HemdanRAGSystem:
         """Generate Hemdan's response using RAG."""
         logger.info(f"Generating response for user message: '{user_message[:100]}...'")
         try:
-            relevant_lore = self.retrieve_relevant_lore(user_message)
-            relevant_memories = self.retrieve_conversation_memory(user_message)
+            retrieval = self.retrieval.run({
+                "lore": lambda embed_query: self.retrieve_relevant_lore(user_message, embed_query=embed_query),
+                "memory": lambda embed_query: self.retrieve_conversation_memory(user_message, embed_query=embed_query),
+            })
+            self.last_retrieval = retrieval
+            logger.info(f"Retrieval: {retrieval}")
+            relevant_lore = retrieval.get("lore", [])
+            relevant_memories = retrieval.get("memory", [])
             
             context_parts = []
             
@@ -273,7 +290,7 @@ class HemdanRAGSystem:
                 {"role": "user", "content": user_message}
             ]
             
-            response = self.client.chat.completions.create(
+            response = self.gateway.chat(
                 model="gpt-4o-mini", # Consider other models based on cost/performance needs
                 messages=messages,
                 max_tokens=1000,
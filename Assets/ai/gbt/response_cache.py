@@ -0,0 +1,196 @@
+# response_cache.py
+"""
+Semantic cache of Hemdan's answers, so repeated player questions skip the chat completion.
+
+Players ask the same few things again and again ("احنا فين", "ايه المكان ده", "نعمل ايه دلوقتي").
+An answer is reused when a new query meets two conditions:
+
+    - its context fingerprint is the same: the identified building and the ids of the retrieved
+      lore chunks, so the answer was grounded in the same context
+    - its embedding has cosine similarity >= the threshold with the cached query (vectors are
+      L2-normalized, so this is a dot product)
+
+Entries expire after a time-to-live and the least recently used ones are evicted once the cache
+is full. The cache is persisted next to the Chroma database as two files written atomically:
+
+    response_cache.json   entries (id, fingerprint, query, response, timestamps, hits), LRU order
+    response_cache.npy    the matching query embeddings, one row per entry
+
+Configuration (environment variables, all optional):
+    RESPONSE_CACHE_THRESHOLD    - minimum cosine similarity for a hit (default 0.95)
+    RESPONSE_CACHE_TTL_S        - seconds an answer stays valid (default 86400)
+    RESPONSE_CACHE_MAX_ENTRIES  - answers kept (default 500)
+    RESPONSE_CACHE_DISABLED     - set to 1 to always call the model
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", 0.95))
+DEFAULT_TTL_S = float(os.environ.get("RESPONSE_CACHE_TTL_S", 86400))
+DEFAULT_CAPACITY = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 500))
+
+
+def context_fingerprint(building: Optional[str], chunk_ids: Iterable[str]) -> str:
+    """Fingerprint of the retrieval context an answer was generated from."""
+    payload = json.dumps({"building": building or None, "chunks": sorted(chunk_ids)}, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class CacheHit:
+    """A cached answer and which entry it came from."""
+
+    def __init__(self, entry_id: str, response: str, query: str, similarity: float, age_s: float, lookup_ms: float):
+        self.entry_id = entry_id
+        self.response = response
+        self.query = query
+        self.similarity = similarity
+        self.age_s = age_s
+        self.lookup_ms = lookup_ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"hit": True, "entry_id": self.entry_id, "cached_query": self.query,
+                "similarity": round(self.similarity, 4), "age_s": round(self.age_s, 1),
+                "lookup_ms": round(self.lookup_ms, 3)}
+
+
+class SemanticResponseCache:
+    """LRU of (query embedding, context fingerprint) -> answer, with a TTL and a JSON/npy snapshot."""
+
+    def __init__(self, path: str, threshold: float = DEFAULT_THRESHOLD, ttl_s: float = DEFAULT_TTL_S,
+                 capacity: int = DEFAULT_CAPACITY):
+        self.path = path
+        self.vectors_path = os.path.splitext(path)[0] + ".npy"
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.capacity = capacity
+        self.enabled = os.environ.get("RESPONSE_CACHE_DISABLED", "0") != "1"
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    # --- Storage ---
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            vectors = np.load(self.vectors_path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Response cache unreadable, starting empty: {e}")
+            return
+        if len(data.get("entries", [])) != len(vectors):
+            logger.warning("Response cache entries and vectors disagree, starting empty.")
+            return
+        for entry, vector in zip(data["entries"], vectors):
+            self.entries[entry["id"]] = entry
+            self.vectors[entry["id"]] = vector
+        self._expire(time.time())
+        logger.info(f"Response cache loaded with {len(self.entries)} answers from {self.path}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        ids = list(self.entries)
+        tmp_path = self.path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"entries": [self.entries[id_] for id_ in ids]}, file, ensure_ascii=False)
+        tmp_vectors = self.vectors_path + f".{os.getpid()}.tmp.npy"
+        if ids:
+            np.save(tmp_vectors, np.stack([self.vectors[id_] for id_ in ids]))
+        else:
+            np.save(tmp_vectors, np.zeros((0, 0), dtype=np.float32))
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_path, self.path)
+
+    def _remove(self, entry_id: str):
+        self.entries.pop(entry_id, None)
+        self.vectors.pop(entry_id, None)
+
+    def _expire(self, now: float) -> int:
+        expired = [id_ for id_, entry in self.entries.items() if now - entry["created"] > self.ttl_s]
+        for entry_id in expired:
+            self._remove(entry_id)
+        return len(expired)
+
+    # --- Lookups ---
+    def lookup(self, embedding: Sequence[float], fingerprint: str) -> Optional[CacheHit]:
+        """Best unexpired answer for the same context whose query is similar enough, if any."""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        query = _unit(embedding)
+        now = time.time()
+        with self._lock:
+            best_id, best_similarity = None, self.threshold
+            for entry_id, entry in self.entries.items():
+                if entry["fingerprint"] != fingerprint or now - entry["created"] > self.ttl_s:
+                    continue
+                vector = self.vectors[entry_id]
+                if vector.shape != query.shape:
+                    continue
+                similarity = float(np.dot(vector, query))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_id)
+            entry = self.entries[best_id]
+            entry["hits"] += 1
+            entry["last_used"] = now
+            self.hits += 1
+        return CacheHit(best_id, entry["response"], entry["query"], best_similarity, now - entry["created"],
+                        (time.perf_counter() - start) * 1000)
+
+    def put(self, query: str, embedding: Sequence[float], fingerprint: str, response: str) -> Optional[str]:
+        """Cache an answer and persist the cache; returns the new entry id."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        entry_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._expire(now)
+            while len(self.entries) >= self.capacity:
+                self._remove(next(iter(self.entries)))
+            self.entries[entry_id] = {"id": entry_id, "fingerprint": fingerprint, "query": query, "response": response,
+                                      "created": now, "last_used": now, "hits": 0}
+            self.vectors[entry_id] = _unit(embedding)
+            try:
+                self._save()
+            except OSError as e:
+                logger.warning(f"Could not persist response cache: {e}")
+        return entry_id
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.vectors.clear()
+            self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"entries": len(self.entries), "capacity": self.capacity, "threshold": self.threshold,
+                    "ttl_s": self.ttl_s, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0, "enabled": self.enabled}
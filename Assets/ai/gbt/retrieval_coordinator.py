@@ -0,0 +1,157 @@
+# retrieval_coordinator.py
+"""
+Concurrent retrieval across Hemdan's collections with one embedding per query text.
+
+generate_response and process_query used to run their lookups one after another, and each
+Chroma query passed query_texts, so the same player message was embedded once per collection.
+A RetrievalCoordinator runs named lookups (lore, conversation memory, image identification, ...)
+on a shared thread pool. All lookups of one query share a QueryEmbedder. It embeds each
+distinct text at most once, on first use, and the vector is then passed to Chroma via
+query_embeddings. Lookups that never need a vector (a lexical fast path, the image search) make
+no embedding call at all.
+
+Every run returns the per-source results, wall-clock timings in milliseconds, errors, and the
+embedding calls made. start() submits lookups without waiting, for callers that only learn later
+which of them they need (speculative prefetch): the needed ones are collected and the rest
+discarded.
+
+Configuration (environment variables, all optional):
+    RETRIEVAL_WORKERS - threads shared by all lookups (default 4)
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", 4))
+
+
+class QueryEmbedder:
+    """Embeds each distinct text at most once; shared by all lookups of one query."""
+
+    def __init__(self, embed: Callable[[List[str]], List[Sequence[float]]]):
+        self._embed = embed
+        self._vectors: Dict[str, Sequence[float]] = {}
+        self._text_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __call__(self, text: str) -> Sequence[float]:
+        with self._lock:
+            text_lock = self._text_locks.setdefault(text, threading.Lock())
+        with text_lock:
+            if text not in self._vectors:
+                start = time.perf_counter()
+                self._vectors[text] = self._embed([text])[0]
+                with self._lock:
+                    self.calls += 1
+                    self.seconds += time.perf_counter() - start
+            return self._vectors[text]
+
+    def prime(self, text: str, vector: Sequence[float]):
+        """Supply a vector computed elsewhere (e.g. by an async embedding call) for `text`."""
+        with self._lock:
+            self._vectors.setdefault(text, vector)
+
+
+class RetrievalResult:
+    """Results of the lookups of one query, by source name."""
+
+    def __init__(self):
+        self.results: Dict[str, Any] = {}
+        self.timings_ms: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.embed_calls = 0
+        self.embed_ms = 0.0
+        self.total_ms = 0.0
+
+    def get(self, source: str, default: Any = None) -> Any:
+        value = self.results.get(source)
+        return default if value is None else value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"timings_ms": {source: round(ms, 2) for source, ms in self.timings_ms.items()},
+                "total_ms": round(self.total_ms, 2), "embed_calls": self.embed_calls,
+                "embed_ms": round(self.embed_ms, 2), "errors": dict(self.errors)}
+
+    def __repr__(self):
+        timings = ", ".join(f"{source} {ms:.0f}ms" for source, ms in self.timings_ms.items())
+        return f"RetrievalResult({timings}; total {self.total_ms:.0f}ms, {self.embed_calls} embedding call(s))"
+
+
+class PendingRetrieval:
+    """Lookups submitted by RetrievalCoordinator.start; collect the ones needed, discard the rest."""
+
+    def __init__(self, futures: Dict[str, Future], embedder: QueryEmbedder):
+        self.futures = futures
+        self.embedder = embedder
+        self.started = time.perf_counter()
+
+    def done(self, source: str) -> bool:
+        return self.futures[source].done()
+
+    def collect(self, sources: Optional[Sequence[str]] = None, result: Optional[RetrievalResult] = None) -> RetrievalResult:
+        """Wait for `sources` (default: all) and record them in `result` as run() would."""
+        result = result or RetrievalResult()
+        for source in (self.futures if sources is None else sources):
+            try:
+                result.results[source], result.timings_ms[source] = self.futures[source].result()
+            except Exception as e:
+                logger.error(f"Retrieval lookup '{source}' failed: {e}")
+                result.results[source] = None
+                result.errors[source] = str(e)
+        result.total_ms += (time.perf_counter() - self.started) * 1000
+        result.embed_calls = self.embedder.calls
+        result.embed_ms = self.embedder.seconds * 1000
+        return result
+
+    def discard(self, sources: Sequence[str]) -> Dict[str, str]:
+        """
+        Drop lookups that turned out not to be needed: queued ones are cancelled, running ones
+        finish in the background and their results are ignored. Returns what happened to each.
+        """
+        return {source: "cancelled" if self.futures[source].cancel() else
+                        "finished" if self.futures[source].done() else "ignored"
+                for source in sources}
+
+
+class RetrievalCoordinator:
+    """Runs named lookups concurrently; each lookup is called with the query's QueryEmbedder."""
+
+    def __init__(self, embed: Callable[[List[str]], List[Sequence[float]]], max_workers: int = RETRIEVAL_WORKERS):
+        self.embed = embed
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+
+    def embedder(self) -> QueryEmbedder:
+        return QueryEmbedder(self.embed)
+
+    @staticmethod
+    def _timed(lookup: Callable[[QueryEmbedder], Any], embedder: QueryEmbedder):
+        start = time.perf_counter()
+        value = lookup(embedder)
+        return value, (time.perf_counter() - start) * 1000
+
+    def start(self, lookups: Dict[str, Callable[[QueryEmbedder], Any]],
+              embedder: Optional[QueryEmbedder] = None) -> PendingRetrieval:
+        """Submit `lookups` and return immediately."""
+        embedder = embedder or self.embedder()
+        futures = {source: self._executor.submit(self._timed, lookup, embedder) for source, lookup in lookups.items()}
+        return PendingRetrieval(futures, embedder)
+
+    def run(self, lookups: Dict[str, Callable[[QueryEmbedder], Any]], embedder: Optional[QueryEmbedder] = None,
+            result: Optional[RetrievalResult] = None) -> RetrievalResult:
+        """
+        Run `lookups` concurrently and wait for all of them. A failed lookup yields None and
+        its error is recorded. Pass the `embedder` and `result` of an earlier stage to chain a
+        dependent stage onto the same query.
+        """
+        return self.start(lookups, embedder).collect(result=result)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
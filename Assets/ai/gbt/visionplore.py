@@ -1,11 +1,12 @@
 # visionplore.py
 
 import os
-import json
+import sys
+import time
+import asyncio
 import numpy as np
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-import openai
+from typing import List, Dict, Any, Optional, Callable, Sequence, AsyncIterator
 import chromadb
 from chromadb.utils import embedding_functions
 from chromadb.api.types import EmbeddingFunction, Documents, Images
@@ -20,18 +21,74 @@ from dotenv import load_dotenv
 import traceback
 from collections import Counter # <-- Added this import
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_gateway import get_gateway
+from embedding_cache import cached_embed, cached_aembed
+from lore_ingest import sync_lore, chunk_id
+from lexical_index import HybridRetriever
+from response_cache import SemanticResponseCache, context_fingerprint
+from retrieval_coordinator import RetrievalCoordinator, RetrievalResult, QueryEmbedder
+from intent_classifier import IntentClassifier, llm_intent
+from sentence_split import split_sentences
+
+# Speculative prefetch in the chat loop (set HEMDAN_SPECULATE=0 to classify the intent first)
+SPECULATE = os.environ.get("HEMDAN_SPECULATE", "1") != "0"
+
+class StreamAssembler:
+    """Turns streamed text pieces into token and sentence events and keeps the whole response."""
+    def __init__(self, start: float):
+        self.start = start
+        self.parts = []
+        self.buffer = ""
+        self.sentence_count = 0
+        self.first_token_ms = None
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self.start) * 1000
+        self.parts.append(text)
+        events = [{"type": "token", "text": text}]
+        sentences, self.buffer = split_sentences(self.buffer + text)
+        for sentence in sentences:
+            events.append({"type": "sentence", "index": self.sentence_count, "text": sentence})
+            self.sentence_count += 1
+        return events
+
+    def flush(self) -> List[Dict[str, Any]]:
+        remainder, self.buffer = self.buffer.strip(), ""
+        return [{"type": "sentence", "index": self.sentence_count, "text": remainder}] if remainder else []
+
+    @property
+    def response(self) -> str:
+        return "".join(self.parts)
+
+    def final_event(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        result["first_token_ms"] = round(self.first_token_ms, 1) if self.first_token_ms is not None else None
+        result["total_ms"] = round((time.perf_counter() - self.start) * 1000, 1)
+        return {"type": "final", **result}
+
 # --- Class Definition: OpenAIEmbeddingFunction ---
 class OpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
     """Custom embedding function using OpenAI's text-embedding models."""
     def __init__(self, api_key: str, model_name: str = "text-embedding-ada-002"):
         if not api_key:
             raise ValueError("OpenAI API key must be provided.")
-        self.client = openai.OpenAI(api_key=api_key)
+        self.gateway = get_gateway(api_key)
         self.model_name = model_name
 
     def __call__(self, input: Documents) -> embedding_functions.Embeddings:
-        response = self.client.embeddings.create(input=input, model=self.model_name)
-        return [data.embedding for data in response.data]
+        # Cached vectors are reused; only new texts go to the API.
+        return cached_embed(input, self.model_name, self._embed_uncached)
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        return self.gateway.embed(texts, model=self.model_name)
+
+    async def acall(self, input: Documents) -> embedding_functions.Embeddings:
+        """Async variant of __call__, for the service's event loop."""
+        return await cached_aembed(input, self.model_name, self._aembed_uncached)
+
+    async def _aembed_uncached(self, texts: List[str]) -> List[List[float]]:
+        return await self.gateway.aembed(texts, model=self.model_name)
 
 # --- Class Definition: ResNet50EmbeddingFunction ---
 class ResNet50EmbeddingFunction(EmbeddingFunction):
@@ -78,19 +135,27 @@ class HemdanRAGSystem:
         if not openai_api_key:
             raise ValueError("OpenAI API key must be provided.")
             
-        self.client = openai.OpenAI(api_key=openai_api_key)
+        self.gateway = get_gateway(openai_api_key)
+        self.client = self.gateway.client
         self.openai_ef = OpenAIEmbeddingFunction(api_key=openai_api_key)
+        self.retrieval = RetrievalCoordinator(self.openai_ef)
         self.resnet_ef = ResNet50EmbeddingFunction()
         
-        db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hemdan_db")
-        self.chroma_client = chromadb.PersistentClient(path=db_path)
+        self.db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hemdan_db")
+        self.chroma_client = chromadb.PersistentClient(path=self.db_path)
         
         self.lore_collection = self.chroma_client.get_or_create_collection(name="game_lore", embedding_function=self.openai_ef)
         self.memory_collection = self.chroma_client.get_or_create_collection(name="conversation_memory", embedding_function=self.openai_ef)
         self.places_collection = self.chroma_client.get_or_create_collection(name="game_places")
         
+        self.lore_retriever = None
         self.load_lore(lore_file_path)
         self.ingest_places_data(places_csv_path, images_root_path)
+        self.response_cache = SemanticResponseCache(os.path.join(self.db_path, "response_cache.json"))
+        # Intent is classified locally from embeddings; the LLM is asked only when unsure
+        # The fallback raises on API errors so a failed call is never learned or memoized as a label
+        self.intent_classifier = IntentClassifier(
+            self.openai_ef, fallback=lambda user_message: llm_intent(self.gateway, user_message, raise_errors=True))
         
         self.current_session_id = str(uuid.uuid4())
         self.conversation_history = []
@@ -108,61 +173,49 @@ class HemdanRAGSystem:
 -  خليك ذكي في الرد لو ملقتش المعلومة بظبط قول ان احنا مش متاكدين من الي حصل وادي نظريات من عندك بس متبقاش مختلفة اوي 
 - اتاكد ان السوال ليه علاقة بلاكلام الي تحته لو ملقتش علاقة رد علي اد السوال و خلاص 
 """
-    def determine_user_intent(self, user_message: str) -> Dict[str, Any]:
-        classification_prompt = f"""
-مهمتك يا همدان هي تحليل سؤال اللاعب وتصنيف قصده الأساسي بدقة عالية. أنت المساعد الذكي في لعبة مغامرات.
-
-علشان تطلع تصنيف دقيق، اتبع خطوات التفكير دي:
-1.  **حدد الموضوع الأساسي للسؤال:** هل اللاعب بيسأل عن حاجة مادية وملموسة شايفها بعينه (زي مكان أو مبنى)، ولا بيسأل عن حاجة معنوية أو مفهوم (زي فترة زمنية، حدث تاريخي، أو قصة شخصية)؟
-2.  **ركز في سياق الكلام:** سؤال زي "احنا فين؟" غالبًا بيقصد بيه مكان حقيقي. لكن سؤال زي "احنا في انهي عصر؟" بيقصد بيه فترة زمنية في قصة اللعبة.
-3.  **بناءً على التحليل ده،** صنّف القصد حسب التعريفات اللي جاية.
-
-التصنيفات الممكنة هي:
-- "place_identification": اللاعب بيسأل عن **المكان اللي هو فيه دلوقتي، أو حاجة مادية شايفها بعينه**. ده يشمل المكان الحالي، مبنى قدامه، أو اسم المنطقة. السؤال بيكون عن "هنا ودلوقتي".
-    - مثال: "ايه المكان ده؟"
-    - مثال: "احنا فين؟"
-    - مثال: "ايه المبنى اللي هناك ده؟"
-    - مثال دقيق: "ايه المكان ده احنا فين"
-    - مثال: "ايه قصة المكان ده؟"
-    - مثال: "ايه اسم المكان ده؟"
-    - مثال: "ايه اسم المبنى ده؟"
-
-- "lore_query": اللاعب بيسأل عن **معلومات، خلفية تاريخية، أو تفاصيل عن قصة اللعبة**. ده يشمل مفاهيم، شخصيات، أحداث، أو الخط الزمني للعبة. كمان بيشمل السؤال عن *تاريخ أو قصة* مكان معين. السؤال بيكون عن "مين، ليه، امتى، أو إيه حكاية...".
-    -مثال: " احنا وصلنا هنا ازاي"
-    - مثال: "ايه اللي حصل قبل كده؟"
-    - مثال: "ايه اللي حصل في الماضي؟"
-    - مثال دقيق: "ايه العصر اللي احنا فيه ده"
-    - مثال: "ايه الي حصل علشان نوصل العصر ده؟"
-
-- "general_conversation": اللاعب بيكلّمك كلام عام، بيسأل عن رأيك، بيدي أمر، أو بيسأل عن استراتيجية اللعب. ده أي حاجة مش مرتبطة مباشرةً بالمكان أو قصة اللعبة.
-    - مثال: "ازيك يا همدان"
-    - مثال: "نعمل ايه دلوقتي؟"
-    
-
-سؤال اللاعب: "{user_message}"
-
-مطلوب منك ترد بملف JSON فقط، فيه مفتاحين: "intent" و "subject". قيمة "subject" ممكن تكون null لو التصنيف "general_conversation" أو لو مفيش موضوع واضح في السؤال.
-"""
+    def determine_user_intent(self, user_message: str,
+                              embed_query: Optional[Callable[[str], Sequence[float]]] = None) -> Dict[str, Any]:
         try:
-            response = self.client.chat.completions.create(model="gpt-4o-mini",messages=[{"role": "system", "content": classification_prompt}],max_tokens=50,temperature=0.0,response_format={"type": "json_object"})
-            return json.loads(response.choices[0].message.content)
+            return self.intent_classifier.classify(user_message, embed_query=embed_query)
         except Exception as e:
-            print(f"Error classifying intent: {e}")
-            return {"intent": "lore_query", "subject": user_message}
+            print(f"Local intent classification failed, asking the LLM: {e}")
+            return self._llm_intent(user_message)
 
-    # <<< MODIFIED METHOD >>>
-    def process_query(self, user_message: str, image_path: Optional[str] = None) -> Dict[str, Any]:
+    def _llm_intent(self, user_message: str) -> Dict[str, Any]:
+        return llm_intent(self.gateway, user_message)
+
+    def _prepare_query(self, user_message: str, image_path: Optional[str] = None,
+                       embedder: Optional[QueryEmbedder] = None,
+                       prefetched: Optional[RetrievalResult] = None) -> Dict[str, Any]:
         """
-        Processes a user query, retrieves context, generates a response, and returns both the
-        response and the sources used.
+        Runs retrieval for a query and checks the response cache. Returns the chat messages, the
+        sources used, the retrieval timings and, on a cache hit, the cached answer. Lookups
+        already in `prefetched` (see speculate) are not run again.
         """
         context_parts = []
         retrieved_chunks = []  # List to store the sources
+        building_name = None
+
+        # --- Concurrent Retrieval ---
+        # Image identification (or lore for the message) runs alongside the query embedding for the
+        # response cache; the message is embedded at most once and reused by every lookup.
+        lookups = {}
+        if image_path:
+            lookups["place"] = lambda embed_query: self.identify_building(image_path)
+        else:
+            lookups["lore"] = lambda embed_query: self.retrieve_relevant_lore(user_message, embed_query=embed_query)
+        if self.response_cache.enabled:
+            lookups["query_embedding"] = lambda embed_query: embed_query(user_message)
+        if prefetched is not None:
+            lookups = {source: lookup for source, lookup in lookups.items() if source not in prefetched.results}
+        embedder = embedder or self.retrieval.embedder()
+        retrieval = self.retrieval.run(lookups, embedder, prefetched)
 
         # --- Image Processing Logic ---
         if image_path:
-            building_info = self.identify_building(image_path)
+            building_info = retrieval.get("place")
             if building_info:
+                building_name = building_info['name']
                 # Add to context for the LLM
                 context_parts.append("معلومات من تحليل الصورة:")
                 context_parts.append(f"تم تحليل الصورة. النتائج تشير بقوة إلى أن هذا المكان هو '{building_info['name']}'. المعلومات المتوفرة عنه: '{building_info['description']}'")
@@ -174,8 +227,12 @@ class HemdanRAGSystem:
                     "content": building_info
                 })
 
-                # Retrieve related lore based on the identified building
-                relevant_lore = self.retrieve_relevant_lore(f"{building_info['name']} {building_info['description']}")
+                # Retrieve related lore based on the identified building (depends on the identification)
+                place_query = f"{building_info['name']} {building_info['description']}"
+                if "place_lore" not in retrieval.results:
+                    self.retrieval.run({"place_lore": lambda embed_query: self.retrieve_relevant_lore(place_query, embed_query=embed_query)},
+                                       embedder, retrieval)
+                relevant_lore = retrieval.get("place_lore", [])
                 if relevant_lore:
                     context_parts.append("\nمعلومات ذات صلة من قصة اللعبة:")
                     for lore_chunk in relevant_lore:
@@ -191,7 +248,7 @@ class HemdanRAGSystem:
         
         # --- Text-only Lore Retrieval Logic ---
         else: 
-            relevant_lore = self.retrieve_relevant_lore(user_message)
+            relevant_lore = retrieval.get("lore", [])
             if relevant_lore:
                 context_parts.append("معلومات من قصة اللعبة:")
                 for lore_chunk in relevant_lore:
@@ -202,28 +259,229 @@ class HemdanRAGSystem:
                         "source": "lore.txt",
                         "content": lore_chunk
                     })
+        print(f"⏱️ {retrieval}")
         
-        # --- LLM Call ---
+        # --- Semantic Response Cache ---
+        # Same context (building + lore chunk ids) and a near-identical question: reuse the answer.
+        fingerprint = context_fingerprint(building_name, [chunk_id(chunk["content"]) for chunk in retrieved_chunks if chunk["type"] == "lore"])
+        query_embedding = retrieval.get("query_embedding")
+        hit = self.response_cache.lookup(query_embedding, fingerprint) if query_embedding is not None else None
+        if hit:
+            print(f"⚡ Response cache hit: entry {hit.entry_id} (similarity {hit.similarity:.3f}, {hit.lookup_ms:.1f} ms)")
+
         context = "\n".join(context_parts)
         messages = [{"role": "system", "content": self.system_prompt},{"role": "system", "content": f"السياق المتاح:\n{context}" if context else "لا يوجد سياق إضافي متاح."},{"role": "user", "content": user_message}]
+        return {"messages": messages, "retrieved_chunks": retrieved_chunks, "retrieval": retrieval,
+                "fingerprint": fingerprint, "query_embedding": query_embedding, "hit": hit}
+
+    def _finish_query(self, user_message: str, prepared: Dict[str, Any], assistant_response: str,
+                      history: Optional[List[Dict[str, Any]]] = None, complete: bool = True) -> Dict[str, Any]:
+        """
+        Stores the turn, caches a fresh answer and builds the result returned to callers. A
+        stream cut off by an error (`complete=False`) is stored marked as truncated and never cached.
+        """
+        self.store_conversation_turn(user_message, assistant_response, history, truncated=not complete)
+        hit = prepared["hit"]
+        if hit:
+            cache = hit.as_dict()
+        else:
+            entry_id = None
+            if prepared["query_embedding"] is not None and assistant_response and complete:
+                entry_id = self.response_cache.put(user_message, prepared["query_embedding"], prepared["fingerprint"], assistant_response)
+            cache = {"hit": False, "entry_id": entry_id}
+        result = {
+            "response": assistant_response,
+            "retrieved_chunks": prepared["retrieved_chunks"],
+            "cache": cache,
+            "retrieval": prepared["retrieval"].as_dict()
+        }
+        if not complete:
+            result["truncated"] = True
+        return result
+
+    # <<< MODIFIED METHOD >>>
+    def process_query(self, user_message: str, image_path: Optional[str] = None,
+                      embedder: Optional[QueryEmbedder] = None,
+                      prefetched: Optional[RetrievalResult] = None) -> Dict[str, Any]:
+        """
+        Processes a user query, retrieves context, generates a response, and returns both the
+        response and the sources used. `embedder` and `prefetched` come from speculate.
+        """
+        prepared = self._prepare_query(user_message, image_path, embedder, prefetched)
+        if prepared["hit"]:
+            return self._finish_query(user_message, prepared, prepared["hit"].response)
+
+        # --- LLM Call ---
         try:
-            response = self.client.chat.completions.create(model="gpt-4o-mini", messages=messages, max_tokens=1000, temperature=0.7)
+            response = self.gateway.chat(model="gpt-4o-mini", messages=prepared["messages"], max_tokens=1000, temperature=0.7)
             assistant_response = response.choices[0].message.content
-            self.store_conversation_turn(user_message, assistant_response)
-            
             # Return a dictionary instead of a string
+            return self._finish_query(user_message, prepared, assistant_response)
+        except Exception as e:
+            print(f"Error during final response generation: {e}")
+            # Return a consistent dictionary structure on error
             return {
-                "response": assistant_response,
-                "retrieved_chunks": retrieved_chunks
+                "response": "آسف يا لورنزو، حدث خطأ في النظام.",
+                "retrieved_chunks": []
             }
+
+    # --- Speculative prefetch (used by the interactive loop) ---
+    def speculate(self, user_message: str, capture_image: Optional[Callable[[], Optional[str]]] = None,
+                  release_image: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Starts everything a query might need as soon as the utterance arrives, instead of
+        waiting for the intent: intent classification, screenshot capture with building
+        identification and place lore, text lore retrieval and the query embedding. All of them
+        share one QueryEmbedder, so the utterance is embedded once. When the intent is known, the
+        lookups it needs are collected and the rest discarded; a discarded screenshot is handed
+        to `release_image` once captured.
+
+        Returns {"intent", "image_path", "embedder", "retrieval", "speculation"}. Pass embedder
+        and retrieval (as prefetched) to process_query. "speculation" compares the time until
+        everything was ready with the time the sequential pipeline would have taken.
+        """
+        start = time.perf_counter()
+        lookups = {
+            "intent": lambda embed_query: self.determine_user_intent(user_message, embed_query),
+            "lore": lambda embed_query: self.retrieve_relevant_lore(user_message, embed_query=embed_query),
+        }
+        if self.response_cache.enabled:
+            lookups["query_embedding"] = lambda embed_query: embed_query(user_message)
+        if capture_image is not None:
+            lookups["image"] = lambda embed_query: self._prefetch_place(capture_image, embed_query)
+        pending = self.retrieval.start(lookups, self.retrieval.embedder())
+
+        intent_info = pending.collect(["intent"]).get("intent", {"intent": "lore_query"})
+        intent_ms = (time.perf_counter() - start) * 1000
+        needed = ["image"] if intent_info.get("intent") == "place_identification" and capture_image is not None else ["lore"]
+        if "query_embedding" in lookups:
+            needed.append("query_embedding")
+        unneeded = [source for source in lookups if source not in needed and source != "intent"]
+        if "image" in unneeded and release_image is not None:
+            pending.futures["image"].add_done_callback(lambda future: self._release_prefetched_image(future, release_image))
+        discarded = pending.discard(unneeded)
+
+        retrieval = pending.collect(needed)
+        stages_ms = dict(retrieval.timings_ms)
+        image_path = None
+        image = retrieval.results.pop("image", None)
+        if image is not None:
+            # The image branch ran capture -> identification -> place lore; record them as the
+            # "place" and "place_lore" lookups _prepare_query would have made.
+            retrieval.timings_ms.pop("image", None)
+            image_path = image["image_path"]
+            retrieval.results.update({source: image[source] for source in ("place", "place_lore") if source in image})
+            retrieval.timings_ms.update(image["timings_ms"])
+            stages_ms.update({f"image.{stage}": ms for stage, ms in image["timings_ms"].items()})
+        ready_ms = (time.perf_counter() - start) * 1000
+        # Sequentially the needed lookups would only have started after the intent was known.
+        sequential_ms = intent_ms + max((retrieval_ms for source, retrieval_ms in stages_ms.items() if source in needed), default=0.0)
+        speculation = {
+            "intent_ms": round(intent_ms, 2), "ready_ms": round(ready_ms, 2), "sequential_ms": round(sequential_ms, 2),
+            "saved_ms": round(max(0.0, sequential_ms - ready_ms), 2), "used": needed, "discarded": discarded,
+            "stages_ms": {stage: round(ms, 2) for stage, ms in stages_ms.items()},
+        }
+        return {"intent": intent_info, "image_path": image_path, "embedder": pending.embedder,
+                "retrieval": retrieval, "speculation": speculation}
+
+    def _prefetch_place(self, capture_image: Callable[[], Optional[str]],
+                        embed_query: Callable[[str], Sequence[float]]) -> Dict[str, Any]:
+        """Speculative image branch: capture, identify the building, then retrieve its lore."""
+        timings_ms = {}
+        start = time.perf_counter()
+        image_path = capture_image()
+        timings_ms["capture"] = (time.perf_counter() - start) * 1000
+        prefetched = {"image_path": image_path, "timings_ms": timings_ms}
+        if not image_path:
+            return prefetched
+        start = time.perf_counter()
+        building_info = self.identify_building(image_path)
+        timings_ms["place"] = (time.perf_counter() - start) * 1000
+        prefetched["place"] = building_info
+        if building_info:
+            start = time.perf_counter()
+            place_query = f"{building_info['name']} {building_info['description']}"
+            prefetched["place_lore"] = self.retrieve_relevant_lore(place_query, embed_query=embed_query)
+            timings_ms["place_lore"] = (time.perf_counter() - start) * 1000
+        return prefetched
+
+    @staticmethod
+    def _release_prefetched_image(future, release_image: Callable[[str], None]):
+        if future.cancelled() or future.exception() is not None:
+            return
+        prefetched, _ = future.result()
+        if prefetched.get("image_path"):
+            release_image(prefetched["image_path"])
+
+    # --- Async API (used by the service so requests don't hold a thread while waiting on OpenAI) ---
+    async def _aprepare_query(self, user_message: str, image_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        _prepare_query for the event loop: the query embedding is awaited here, then the local
+        lookups (Chroma, BM25, ResNet) run in a worker thread and reuse it.
+        """
+        embedder = self.retrieval.embedder()
+        if self.response_cache.enabled:
+            try:
+                embedder.prime(user_message, (await self.openai_ef.acall([user_message]))[0])
+            except Exception as e:
+                print(f"Async query embedding failed, retrieval will embed it: {e}")
+        return await asyncio.to_thread(self._prepare_query, user_message, image_path, embedder)
+
+    async def aprocess_query(self, user_message: str, image_path: Optional[str] = None,
+                             history: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Async process_query; the turn is appended to `history` (a session's) when given."""
+        prepared = await self._aprepare_query(user_message, image_path)
+        if prepared["hit"]:
+            return await asyncio.to_thread(self._finish_query, user_message, prepared, prepared["hit"].response, history)
+        try:
+            response = await self.gateway.achat(model="gpt-4o-mini", messages=prepared["messages"], max_tokens=1000, temperature=0.7)
+            assistant_response = response.choices[0].message.content
+            return await asyncio.to_thread(self._finish_query, user_message, prepared, assistant_response, history)
         except Exception as e:
             print(f"Error during final response generation: {e}")
-            # Return a consistent dictionary structure on error
             return {
                 "response": "آسف يا لورنزو، حدث خطأ في النظام.",
                 "retrieved_chunks": []
             }
 
+    async def astream_query(self, user_message: str, image_path: Optional[str] = None,
+                            history: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of aprocess_query. Yields events as they become available:
+            {"type": "retrieval", "retrieved_chunks": [...], "retrieval": {...}}
+            {"type": "token", "text": "..."}                     (as the model streams)
+            {"type": "sentence", "index": n, "text": "..."}      (each finished sentence)
+            {"type": "final", "response": "...", "retrieved_chunks": [...], "cache": {...}, ...}
+        The turn goes to `history` when given, once the stream ends. If it breaks off after some
+        text, an "error" event precedes a final event with "truncated": True, and the partial
+        answer is not put in the response cache.
+        """
+        assembler = StreamAssembler(time.perf_counter())
+        prepared = await self._aprepare_query(user_message, image_path)
+        yield {"type": "retrieval", "retrieved_chunks": prepared["retrieved_chunks"], "retrieval": prepared["retrieval"].as_dict()}
+
+        complete = True
+        try:
+            if prepared["hit"]:
+                for event in assembler.feed(prepared["hit"].response):
+                    yield event
+            else:
+                async for chunk in self.gateway.astream_chat(model="gpt-4o-mini", messages=prepared["messages"], max_tokens=1000, temperature=0.7):
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        for event in assembler.feed(chunk.choices[0].delta.content):
+                            yield event
+        except Exception as e:
+            print(f"Error during streamed response generation: {e}")
+            yield {"type": "error", "message": str(e)}
+            if not assembler.parts:
+                yield {"type": "final", "response": "آسف يا لورنزو، حدث خطأ في النظام.", "retrieved_chunks": []}
+                return
+            complete = False
+        for event in assembler.flush():
+            yield event
+        result = await asyncio.to_thread(self._finish_query, user_message, prepared, assembler.response, history, complete)
+        yield assembler.final_event(result)
+
     def ingest_places_data(self, csv_path: str, images_root: str):
         """Ingest places data by mapping CSV rows to image folders by their natural order."""
         if self.places_collection.count() > 0:
@@ -383,34 +641,44 @@ class HemdanRAGSystem:
             return None
     
     def load_lore(self, file_path: str):
-        if self.lore_collection.count() > 0:
-            print("Lore collection already contains data. Skipping ingestion.")
-            return
-
-        print('Loading lore from file...')
         try:
             if not os.path.exists(file_path):
                 print(f"Error: Lore file not found at '{file_path}'")
                 return
-            with open(file_path, 'r', encoding='utf-8') as f: content = f.read()
-            chunks = [chunk.strip() for chunk in content.split('\n\n') if chunk.strip()]
-            ids = [str(uuid.uuid4()) for _ in chunks]
-            self.lore_collection.add(documents=chunks, ids=ids)
-            print(f"Successfully loaded {len(chunks)} lore chunks into the 'game_lore' collection.")
+            # Only new or changed chunks are embedded; stale ones are removed.
+            report = sync_lore(self.lore_collection, file_path, self.openai_ef,
+                               manifest_path=os.path.join(self.db_path, "game_lore_manifest.json"),
+                               model=self.openai_ef.model_name, metadata={"type": "lore"})
+            if report.skipped:
+                print("Lore collection is up to date. Skipping ingestion.")
+            else:
+                print(f"Lore synced into the 'game_lore' collection: {report.added} added, {report.removed} removed, "
+                      f"{report.unchanged} unchanged ({report.seconds:.2f}s).")
+            self.lore_retriever = HybridRetriever(self.lore_collection)
         except Exception as e:
             print(f"An error occurred while loading lore: {e}")
         
-    def retrieve_relevant_lore(self, query: str, n_results: int = 3) -> List[str]:
+    def retrieve_relevant_lore(self, query: str, n_results: int = 3,
+                               embed_query: Optional[Callable[[str], Sequence[float]]] = None) -> List[str]:
         try:
-            results = self.lore_collection.query(query_texts=[query], n_results=n_results)
+            # Confident keyword matches skip the embedding call; otherwise BM25 and vector results are fused.
+            if self.lore_retriever is not None:
+                return self.lore_retriever.retrieve(query, n_results=n_results, embed_query=embed_query)
+            if embed_query is not None:
+                results = self.lore_collection.query(query_embeddings=[list(embed_query(query))], n_results=n_results)
+            else:
+                results = self.lore_collection.query(query_texts=[query], n_results=n_results)
             return results['documents'][0] if results and results['documents'] else []
         except Exception as e:
             print(f"Error retrieving lore: {e}")
             return []
         
-    def store_conversation_turn(self, user_message: str, assistant_response: str):
+    def store_conversation_turn(self, user_message: str, assistant_response: str,
+                                history: Optional[List[Dict[str, Any]]] = None, truncated: bool = False):
         turn = {"user": user_message, "assistant": assistant_response, "timestamp": datetime.now().isoformat()}
-        self.conversation_history.append(turn)
+        if truncated:
+            turn["truncated"] = True
+        (self.conversation_history if history is None else history).append(turn)
 
     def debug_places_collection_detailed(self):
         """Detailed debugging of the places collection."""
@@ -521,6 +789,15 @@ def get_image_for_analysis(debug_image_path: Optional[str]) -> Optional[str]:
     print("[System]: Taking a live screenshot...")
     return take_screenshot()
 
+def release_screenshot(image_path: str, debug_image_path: Optional[str]):
+    """Deletes a speculatively captured screenshot that the query turned out not to need."""
+    if image_path == debug_image_path:
+        return
+    try:
+        os.remove(image_path)
+    except OSError as e:
+        print(f"Could not remove unused screenshot {image_path}: {e}")
+
 def main():
     """Main function with diagnostics and chat loop."""
     # To use a .env file, uncomment the next line
@@ -580,6 +857,7 @@ def main():
 
     # <<< CORRECTED CHAT LOOP >>>
     print("\n\n=== نظام حمدان الذكي جاهز ===\n")
+    saved_total_ms, queries = 0.0, 0
         
     while True:
         user_input = input("\nلورنزو: ").strip()
@@ -590,16 +868,24 @@ def main():
             continue
 
         print("[Hemdan System]: Analyzing your request...")
-        intent_info = hemdan.determine_user_intent(user_input)
+        speculation = None
+        if SPECULATE:
+            # Screenshot, lore and embeddings are fetched while the intent is being classified
+            speculation = hemdan.speculate(user_input, capture_image=lambda: get_image_for_analysis(debug_image_path),
+                                           release_image=lambda path: release_screenshot(path, debug_image_path))
+            intent_info = speculation["intent"]
+        else:
+            intent_info = hemdan.determine_user_intent(user_input)
         intent = intent_info.get("intent", "lore_query")
+        prefetch = {"embedder": speculation["embedder"], "prefetched": speculation["retrieval"]} if speculation else {}
 
         result_data = {}
 
         if intent == "place_identification":
-            image_to_process = get_image_for_analysis(debug_image_path)
+            image_to_process = speculation["image_path"] if speculation else get_image_for_analysis(debug_image_path)
             if image_to_process:
                 print(f"[Hemdan System]: Intent is 'place_identification'. Using image for analysis...")
-                result_data = hemdan.process_query(user_input, image_path=image_to_process)
+                result_data = hemdan.process_query(user_input, image_path=image_to_process, **prefetch)
             else:
                 print("[Hemdan System]: Could not obtain image for analysis.")
                 result_data = {
@@ -608,7 +894,15 @@ def main():
                 }
         else:
             print(f"[Hemdan System]: Intent is '{intent}'. Processing text-only query...")
-            result_data = hemdan.process_query(user_input)
+            result_data = hemdan.process_query(user_input, **prefetch)
+
+        if speculation:
+            report = speculation["speculation"]
+            saved_total_ms += report["saved_ms"]
+            queries += 1
+            print(f"⚡ Speculation: context ready after {report['ready_ms']:.0f} ms instead of ~{report['sequential_ms']:.0f} ms "
+                  f"(saved {report['saved_ms']:.0f} ms; {saved_total_ms / queries:.0f} ms on average over {queries} queries). "
+                  f"Discarded: {', '.join(f'{source} ({state})' for source, state in report['discarded'].items()) or 'nothing'}")
         
         final_response = result_data.get("response", "حدث خطأ غير متوقع.")
         sources = result_data.get("retrieved_chunks", [])
@@ -0,0 +1,358 @@
+# llm_gateway.py
+"""
+Process-wide gateway for every OpenAI call made by the AI stages (NPC agent, Hemdan RAG).
+
+One gateway is kept per API key. It owns a single pooled httpx client (sync and async) with
+keep-alive, so consecutive calls in a player turn reuse warm TLS connections instead of
+building a fresh OpenAI client each time. Per-model semaphores cap how many requests for a
+given model are in flight at once.
+
+Configuration (environment variables, all optional):
+    OPENAI_BASE_URL        - override the API endpoint (e.g. a local stand-in)
+    LLM_MAX_CONNECTIONS    - total pooled connections (default 20)
+    LLM_KEEPALIVE          - idle keep-alive connections kept warm (default 10)
+    LLM_KEEPALIVE_EXPIRY   - seconds an idle connection stays open (default 60)
+    LLM_CONNECT_TIMEOUT    - connect timeout in seconds (default 5)
+    LLM_TIMEOUT            - read/write timeout in seconds (default 60)
+    LLM_MODEL_LIMITS       - per-model concurrency, e.g. "gpt-4o-mini=8,text-embedding-ada-002=4"
+    LLM_DEFAULT_LIMIT      - concurrency for models not listed above (default 8)
+"""
+
+import os
+import asyncio
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+
+DEFAULT_CHAT_MODEL = "gpt-4o-mini"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _parse_model_limits(spec: str) -> Dict[str, int]:
+    """Parse "model=limit,model=limit" into a dict, ignoring malformed entries."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        model, limit = item.split("=", 1)
+        try:
+            limits[model.strip()] = max(1, int(limit))
+        except ValueError:
+            continue
+    return limits
+
+
+class LLMGateway:
+    """Pooled OpenAI client with per-model concurrency limits and timeouts."""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None,
+                 max_connections: Optional[int] = None, keepalive: Optional[int] = None,
+                 keepalive_expiry: Optional[float] = None, connect_timeout: Optional[float] = None,
+                 timeout: Optional[float] = None, model_limits: Optional[Dict[str, int]] = None,
+                 default_limit: Optional[int] = None):
+        if not api_key:
+            raise ValueError("OpenAI API key must be provided.")
+
+        self.api_key = api_key
+        self.base_url = base_url or os.environ.get("OPENAI_BASE_URL") or None
+
+        max_connections = max_connections or _env_int("LLM_MAX_CONNECTIONS", 20)
+        keepalive = keepalive or _env_int("LLM_KEEPALIVE", 10)
+        keepalive_expiry = keepalive_expiry or _env_float("LLM_KEEPALIVE_EXPIRY", 60.0)
+        connect_timeout = connect_timeout or _env_float("LLM_CONNECT_TIMEOUT", 5.0)
+        timeout = timeout or _env_float("LLM_TIMEOUT", 60.0)
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+
+        self.model_limits = _parse_model_limits(os.environ.get("LLM_MODEL_LIMITS", ""))
+        self.model_limits.update(model_limits or {})
+        self.default_limit = default_limit or _env_int("LLM_DEFAULT_LIMIT", 8)
+
+        self._http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            base_url=self.base_url,
+            http_client=self._http_client,
+            timeout=self.timeout,
+        )
+
+        # Async clients and semaphores are bound to the event loop that created them, so they
+        # are built lazily per loop. Keyed by the loop itself, not its id(), which a later loop can
+        # reuse once this one is collected. The keys are weak, but a value can still reference its
+        # loop (a semaphore that has been waited on, a client's open connections), which keeps the
+        # entry alive; entries of closed loops are therefore pruned whenever a new loop is added.
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, openai.AsyncOpenAI]" = weakref.WeakKeyDictionary()
+        self._async_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    # --- Concurrency limits ---
+    def limit_for(self, model: str) -> int:
+        return self.model_limits.get(model, self.default_limit)
+
+    def _semaphore(self, model: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(model)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limit_for(model))
+                self._semaphores[model] = semaphore
+            return semaphore
+
+    def _async_semaphore(self, model: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_semaphores:
+                self._prune_closed_loops()
+            semaphores = self._async_semaphores.setdefault(loop, {})
+            semaphore = semaphores.get(model)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.limit_for(model))
+                semaphores[model] = semaphore
+            return semaphore
+
+    def _async_client(self) -> openai.AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                self._prune_closed_loops()
+                client = openai.AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout),
+                    timeout=self.timeout,
+                )
+                self._async_clients[loop] = client
+            return client
+
+    def _prune_closed_loops(self):
+        # Under self._lock. A closed loop's client can no longer be closed, only dropped.
+        for loops in (self._async_clients, self._async_semaphores):
+            for loop in [loop for loop in loops if loop.is_closed()]:
+                del loops[loop]
+
+    # --- Sync calls ---
+    def chat(self, messages: List[Dict[str, Any]], model: str = DEFAULT_CHAT_MODEL, stream: bool = False,
+             timings: Optional[Dict[str, float]] = None, **kwargs):
+        """
+        Run a chat completion. With stream=True an iterator of chunks is returned; the model's
+        concurrency slot is held until the stream is exhausted, closed or dropped. If a `timings`
+        dict is given, the time spent waiting for a concurrency slot is stored in it as "queue_s".
+        """
+        if stream:
+            return self.stream_chat(messages, model=model, timings=timings, **kwargs)
+
+        semaphore = self._semaphore(model)
+        self._acquire(semaphore, timings)
+        try:
+            return self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        finally:
+            semaphore.release()
+
+    @staticmethod
+    def _acquire(semaphore: threading.BoundedSemaphore, timings: Optional[Dict[str, float]]):
+        start = time.perf_counter()
+        semaphore.acquire()
+        if timings is not None:
+            timings["queue_s"] = time.perf_counter() - start
+
+    def stream_chat(self, messages: List[Dict[str, Any]], model: str = DEFAULT_CHAT_MODEL,
+                    timings: Optional[Dict[str, float]] = None, **kwargs) -> "SlotStream":
+        """
+        Open a streamed chat completion and return an iterator over its chunks. The request is
+        sent here, so API errors are raised to the caller rather than on the first chunk.
+        """
+        semaphore = self._semaphore(model)
+        self._acquire(semaphore, timings)
+        try:
+            completion = self.client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+        except BaseException:
+            semaphore.release()
+            raise
+        return SlotStream(completion, semaphore)
+
+    def embed(self, input: List[str], model: str = DEFAULT_EMBEDDING_MODEL) -> List[List[float]]:
+        """Embed a batch of texts and return the vectors in input order."""
+        with self._semaphore(model):
+            response = self.client.embeddings.create(input=input, model=model)
+        return [data.embedding for data in response.data]
+
+    # --- Async calls ---
+    async def achat(self, messages: List[Dict[str, Any]], model: str = DEFAULT_CHAT_MODEL, **kwargs):
+        async with self._async_semaphore(model):
+            return await self._async_client().chat.completions.create(model=model, messages=messages, **kwargs)
+
+    async def astream_chat(self, messages: List[Dict[str, Any]], model: str = DEFAULT_CHAT_MODEL, **kwargs) -> AsyncIterator[Any]:
+        """Async generator over the chunks of a streamed chat completion."""
+        async with self._async_semaphore(model):
+            completion = await self._async_client().chat.completions.create(
+                model=model, messages=messages, stream=True, **kwargs
+            )
+            try:
+                async for chunk in completion:
+                    yield chunk
+            finally:
+                await completion.close()
+
+    async def aembed(self, input: List[str], model: str = DEFAULT_EMBEDDING_MODEL) -> List[List[float]]:
+        async with self._async_semaphore(model):
+            response = await self._async_client().embeddings.create(input=input, model=model)
+        return [data.embedding for data in response.data]
+
+    # --- Lifecycle ---
+    def warm_up(self):
+        """Open a connection ahead of the first real call so the TLS handshake is off the critical path."""
+        start = time.perf_counter()
+        try:
+            self.client.models.list()
+        except Exception as e:
+            print(f"LLM gateway warm-up failed: {e}")
+            return None
+        return time.perf_counter() - start
+
+    async def aclose(self):
+        """Close the async client of the running loop (call from that loop on shutdown)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.pop(loop, None)
+            self._async_semaphores.pop(loop, None)
+        if client is not None:
+            await client.close()
+
+    def close(self):
+        """
+        Close the sync client and every async client. An async client is closed on its own loop
+        when that loop is still usable; clients of closed loops are just dropped.
+        """
+        self.client.close()
+        with self._lock:
+            clients = list(self._async_clients.items())
+            self._async_clients.clear()
+            self._async_semaphores.clear()
+        for loop, client in clients:
+            try:
+                if loop.is_closed():
+                    continue
+                if loop.is_running():
+                    if _running_loop() is loop:
+                        loop.create_task(client.close())
+                    else:
+                        asyncio.run_coroutine_threadsafe(client.close(), loop).result(timeout=5)
+                else:
+                    loop.run_until_complete(client.close())
+            except Exception as e:
+                print(f"LLM gateway: could not close an async client: {e}")
+
+
+class SlotStream:
+    """
+    Iterator over a streamed completion that holds one of its model's concurrency slots. The
+    slot is released exactly once: when the stream is exhausted or fails, on close(), or when
+    the stream is garbage-collected without having been read to the end.
+    """
+
+    def __init__(self, completion, semaphore: threading.BoundedSemaphore):
+        self._released = False
+        self._completion = completion
+        self._semaphore = semaphore
+        self._chunks = None
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> "SlotStream":
+        return self
+
+    def __next__(self) -> Any:
+        if self._released:
+            raise StopIteration
+        try:
+            if self._chunks is None:
+                self._chunks = iter(self._completion)
+            return next(self._chunks)
+        except BaseException:
+            # Exhausted (StopIteration) or failed: either way the slot goes back.
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            self._completion.close()
+        finally:
+            self._semaphore.release()
+
+    def __enter__(self) -> "SlotStream":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if not getattr(self, "_released", True):
+            self.close()
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+_gateways: Dict[str, LLMGateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(api_key: Optional[str] = None, **kwargs) -> LLMGateway:
+    """Return the shared gateway for `api_key` (default: OPENAI_API_KEY), creating it on first use."""
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OpenAI API key must be provided or set in OPENAI_API_KEY.")
+
+    with _gateways_lock:
+        gateway = _gateways.get(api_key)
+        if gateway is None:
+            gateway = LLMGateway(api_key, **kwargs)
+            _gateways[api_key] = gateway
+        return gateway
+
+
+def close_all():
+    with _gateways_lock:
+        for gateway in _gateways.values():
+            gateway.close()
+        _gateways.clear()
+
+
+async def aclose_all():
+    """Close every gateway's async client for the running loop (e.g. on service shutdown)."""
+    with _gateways_lock:
+        gateways = list(_gateways.values())
+    for gateway in gateways:
+        await gateway.aclose()
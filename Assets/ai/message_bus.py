@@ -0,0 +1,272 @@
+# message_bus.py
+"""
+Local message bus between the Python AI stages and Unity.
+
+Results used to be handed over through files (npc_output.txt, gbt_output.txt,
+egtts_output.wav) that the next stage polled. The bus is a small asyncio TCP server that
+forwards events from publishers to subscribers as soon as they arrive:
+
+    {"channel": "npc.Neferkare", "type": "token", "text": "Thank "}
+    {"channel": "npc.Neferkare", "type": "sentence", "text": "Thank you, friend."}
+    {"channel": "egtts", "type": "audio_chunk", "data": "<base64>", "format": "wav", "seq": 0}
+    {"channel": "hemdan", "type": "done", "text": "..."}
+
+Every frame, in both directions, is a 4-byte big-endian length followed by UTF-8 JSON (the
+same framing the NPC server uses). A connection starts with a hello frame:
+
+    {"role": "publisher"}
+    {"role": "subscriber", "channels": ["npc.Neferkare", "hemdan"]}     ("*" = everything)
+
+Run the bus with `python message_bus.py [--host 127.0.0.1] [--port 8790]`. Publishers never
+block or fail their stage when the bus is down: events are dropped and the connection is retried
+later, and the stages still write their output files themselves for consumers that poll them.
+
+Configuration (environment variables, all optional):
+    MESSAGE_BUS_HOST       - bus address (default 127.0.0.1)
+    MESSAGE_BUS_PORT       - bus port (default 8790)
+    MESSAGE_BUS_DISABLED   - set to 1 to turn publishing off entirely
+"""
+
+import os
+import json
+import time
+import base64
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+DEFAULT_HOST = os.environ.get("MESSAGE_BUS_HOST", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("MESSAGE_BUS_PORT", 8790))
+EVENT_TYPES = ("token", "sentence", "audio_chunk", "done")
+
+
+# --- Framing ---
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    payload = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """Read one frame; returns None when the peer has closed the connection."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return json.loads((await reader.readexactly(length)).decode("utf-8"))
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        data += chunk
+    return data
+
+
+def recv_frame(sock: socket.socket) -> Dict[str, Any]:
+    """Blocking counterpart of read_frame for plain sockets."""
+    (length,) = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return json.loads(_recv_exactly(sock, length).decode("utf-8"))
+
+
+# --- Bus server ---
+class _Subscriber:
+    def __init__(self, writer: asyncio.StreamWriter, channels: Set[str], max_queue: int):
+        self.writer = writer
+        self.channels = channels
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def wants(self, channel: str) -> bool:
+        return "*" in self.channels or channel in self.channels
+
+
+class MessageBus:
+    """Forwards events from publishers to the subscribers of their channel."""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, max_queue: int = 1024):
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.subscribers: List[_Subscriber] = []
+        self.events_forwarded = 0
+        self._server = None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = await read_frame(reader)
+            if hello is None:
+                return
+            if hello.get("role") == "subscriber":
+                await self._serve_subscriber(reader, writer, set(hello.get("channels") or ["*"]))
+            else:
+                await self._serve_publisher(reader)
+        except (ConnectionError, ValueError, json.JSONDecodeError) as e:
+            print(f"DEBUG: Bus connection dropped: {e}")
+        finally:
+            writer.close()
+
+    async def _serve_publisher(self, reader: asyncio.StreamReader):
+        while True:
+            event = await read_frame(reader)
+            if event is None:
+                return
+            self.publish(event)
+
+    def publish(self, event: Dict[str, Any]):
+        channel = event.get("channel", "")
+        for subscriber in list(self.subscribers):
+            if not subscriber.wants(channel):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                self.events_forwarded += 1
+            except asyncio.QueueFull:
+                # A stalled consumer loses events instead of stalling every publisher.
+                subscriber.dropped += 1
+
+    async def _serve_subscriber(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, channels: Set[str]):
+        subscriber = _Subscriber(writer, channels, self.max_queue)
+        self.subscribers.append(subscriber)
+        print(f"DEBUG: Bus subscriber joined for {sorted(channels)}")
+        # Notice the subscriber hanging up even while nothing is being published.
+        closed = asyncio.ensure_future(reader.read())
+        try:
+            while True:
+                getter = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait({getter, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if closed in done:
+                    getter.cancel()
+                    return
+                writer.write(encode_frame(getter.result()))
+                await writer.drain()
+        finally:
+            closed.cancel()
+            self.subscribers.remove(subscriber)
+            if subscriber.dropped:
+                print(f"DEBUG: Bus subscriber dropped {subscriber.dropped} events")
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"Message bus listening on {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+
+# --- Clients ---
+class BusPublisher:
+    """
+    Publishes events for one channel. Sending never raises: if the bus is not running the event
+    is dropped and the connection is retried after `retry_interval` seconds.
+    """
+
+    def __init__(self, channel: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 retry_interval: float = 5.0, connect_timeout: float = 0.2):
+        self.channel = channel
+        self.host = host
+        self.port = port
+        self.retry_interval = retry_interval
+        self.connect_timeout = connect_timeout
+        self.enabled = os.environ.get("MESSAGE_BUS_DISABLED", "0") != "1"
+        self.sent = 0
+        self._sock: Optional[socket.socket] = None
+        self._next_attempt = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> bool:
+        if self._sock is not None:
+            return True
+        if not self.enabled or time.monotonic() < self._next_attempt:
+            return False
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(None)
+            sock.sendall(encode_frame({"role": "publisher"}))
+            self._sock = sock
+            return True
+        except OSError:
+            self._next_attempt = time.monotonic() + self.retry_interval
+            return False
+
+    def publish(self, event_type: str, **fields):
+        event = {"channel": self.channel, "type": event_type, "ts": time.time(), **fields}
+        with self._lock:
+            if not self._connect():
+                return
+            try:
+                self._sock.sendall(encode_frame(event))
+                self.sent += 1
+            except OSError:
+                self._sock.close()
+                self._sock = None
+                self._next_attempt = time.monotonic() + self.retry_interval
+
+    def token(self, text: str, **fields):
+        self.publish("token", text=text, **fields)
+
+    def sentence(self, text: str, **fields):
+        self.publish("sentence", text=text, **fields)
+
+    def audio_chunk(self, data: bytes, seq: int, audio_format: str = "wav", **fields):
+        self.publish("audio_chunk", data=base64.b64encode(data).decode("ascii"), seq=seq, format=audio_format, **fields)
+
+    def done(self, text: str = "", **fields):
+        self.publish("done", text=text, **fields)
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+
+def subscribe(channels: List[str], host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> Iterator[Dict[str, Any]]:
+    """Blocking iterator over the events published on `channels`."""
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        sock.sendall(encode_frame({"role": "subscriber", "channels": channels}))
+        while True:
+            yield recv_frame(sock)
+    finally:
+        sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the local message bus for the AI stages.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--watch", nargs="*", help="instead of serving, print events from these channels")
+    args = parser.parse_args()
+
+    if args.watch is not None:
+        for event in subscribe(args.watch or ["*"], args.host, args.port):
+            if event.get("type") == "audio_chunk":
+                event = {**event, "data": f"<{len(event['data'])} base64 chars>"}
+            print(event)
+        return
+
+    try:
+        asyncio.run(MessageBus(args.host, args.port).serve_forever())
+    except KeyboardInterrupt:
+        print("Message bus stopped")
+
+
+if __name__ == "__main__":
+    main()
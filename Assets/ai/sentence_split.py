@@ -0,0 +1,34 @@
+# sentence_split.py
+"""
+Sentence splitting for streamed replies, shared by the NPC agent (speech and bus events) and
+Hemdan (stream events and bus publishing), so both stages cut text at the same boundaries.
+
+A sentence ends at ".", "!", "?" or the Arabic question mark "؟", plus any closing quotes or
+brackets, once whitespace follows. A streamed buffer is split with split_sentences(), which
+keeps the unfinished tail for the next fragment; a complete text with split_text().
+"""
+
+import re
+from typing import List, Tuple
+
+SENTENCE_END = re.compile(r'(?<=[.!?؟])["\'\)\]]*\s+')
+
+
+def split_sentences(buffer: str) -> Tuple[List[str], str]:
+    """Split `buffer` into finished sentences and the unfinished remainder."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(buffer):
+        sentence = buffer[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+def split_text(text: str) -> List[str]:
+    """All sentences of a complete text, the last one included even without end punctuation."""
+    sentences, remainder = split_sentences(text)
+    if remainder.strip():
+        sentences.append(remainder.strip())
+    return sentences